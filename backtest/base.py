@@ -1,11 +1,64 @@
 """The base backtest strategy runner"""
 
 import os
+import json
+import hashlib
+import inspect
+import importlib
 from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from vectorbt.portfolio.nb import no_pre_func_nb
+from vectorbt.utils.datetime_ import datetime_to_ms
+
+from backtest.data import BinanceData
+from backtest.kernels import run_kernel
+from backtest.metrics import select_metrics
+from backtest.timing import span
+
+
+# The modules which the results depend on besides the strategy, e.g. the
+# loading, the signal kernels, the simulation and the metrics
+RESULT_MODULES = (
+    'backtest.base',
+    'backtest.db',
+    'backtest.data',
+    'backtest.resample',
+    'backtest.kernels',
+    'backtest.callbacks',
+    'backtest.incremental',
+    'backtest.metrics'
+)
+
+
+@lru_cache(maxsize=None)
+def hash_modules(modules: tuple) -> str:
+    """Hash the source of the modules and the version of vectorbt"""
+    h = hashlib.sha1(vbt.__version__.encode())
+    for name in modules:
+        h.update(inspect.getsource(importlib.import_module(name)).encode())
+    return h.hexdigest()
 
 
 class Runner(ABC):
 
+    # The config keys of the parameter grid and the outputs, changing them
+    # does not change the result of a computed backtest
+    volatile_keys = ('intervals', 'params', 'plots', 'output', 'export_csv', 'work_dir', 'search',
+                     'save_portfolios')
+
+    # The numba kernel of the signals, see `backtest.kernels`, a strategy
+    # declares it by `signal_kernel = staticmethod(kernel)`
+    signal_kernel = None
+
+    # The step kernel of the live updates and its (signal width, ring depth),
+    # see `backtest.incremental`
+    live_kernel = None
+    live_state = (0, 0)
+
     def __init__(self, work_dir: str, cfg: dict):
         self.work_dir = work_dir
         self.cfg = cfg
@@ -14,6 +67,19 @@ class Runner(ABC):
         """Get plots for creation"""
         return self.cfg.get("plots", [])
     
+    def get_metrics(self) -> list | None:
+        """Get the stats names to compute, or None for all metrics
+
+        The `metrics` of the config are computed with the plotted ones and
+        the metric of the search.
+        """
+        if self.cfg.get("metrics") is None:
+            return None
+        names = self.cfg.get("metrics") + self.get_plots()
+        if self.cfg.get("search"):
+            names.append(self.cfg["search"].get("metric", 'Total Return [%]'))
+        return select_metrics(names)
+
     def get(self, key, default=None):
         return self.cfg.get(key, default)
     
@@ -31,6 +97,10 @@ class Runner(ABC):
         """Iterate all possible backtesting parameters"""
         pass
 
+    def valid_parameters(self, **params) -> bool:
+        """Whether a set of parameters sampled by the search is valid"""
+        return True
+
     def get_output_file(self, **params):
         """Build the path of output file"""
         label = self.create_label(**params)
@@ -40,8 +110,228 @@ class Runner(ABC):
     
     def get_work_dir(self):
         return self.work_dir
+
+    def get_portfolio_dir(self):
+        """Build the dir of the saved portfolios"""
+        return os.path.join(self.work_dir, 'portfolios')
+
+    def get_result_file(self):
+        """Build the path of the result store"""
+        return os.path.join(self.work_dir, 'results.db')
+
+    def get_checkpoint_file(self):
+        """Build the path of the checkpoints of the live updates"""
+        return os.path.join(self.work_dir, 'checkpoints.db')
+
+    def get_code_hash(self) -> str:
+        """Hash the strategy code and config, the results are stale once it changes
+
+        The code is the modules of the strategy class and its bases, and the
+        `RESULT_MODULES`. The metrics are resolved by `get_metrics`, as the
+        plots and the search add to the computed ones.
+        """
+        modules = [
+            cls.__module__ for cls in type(self).__mro__ if cls.__module__ not in ('builtins', 'abc')
+        ]
+        modules = tuple(dict.fromkeys(modules + list(RESULT_MODULES)))
+        h = hashlib.sha1(hash_modules(modules).encode())
+        cfg = {k: v for k, v in self.cfg.items() if k not in self.volatile_keys}
+        cfg['metrics'] = self.get_metrics()
+        h.update(json.dumps(cfg, sort_keys=True, default=str).encode())
+        return h.hexdigest()
     
     @abstractmethod
     def run(self, symbol: str, **params):
         """Run backtest for a given symbol on a set of parameters"""
         pass
+
+    def run_batch(self, symbol: str, param_list: list):
+        """Run backtest for a given symbol on many sets of parameters at once
+
+        It is optional, a strategy supporting it returns one portfolio whose
+        columns are the labels of the parameter sets. The engine only passes
+        a group of parameters from `group_parameters`.
+        """
+        raise NotImplementedError
+
+    def run_panel(self, symbols: list, **params):
+        """Run backtest for many symbols on a set of parameters at once
+
+        It is optional, a strategy supporting it loads the symbols into one
+        aligned price frame and returns one portfolio whose columns are the
+        symbols.
+        """
+        raise NotImplementedError
+
+    def get_start(self) -> datetime:
+        """Get the `start` of the config
+
+        A date like `start: 2023-10-01` of YAML is a `datetime.date`, which
+        is the datetime of its midnight.
+        """
+        return pd.Timestamp(self.get("start", datetime(2023, 10, 1))).to_pydatetime()
+
+    def get_start_ms(self) -> int:
+        """Get the `start` of the config in unix time like `BinanceData.load`"""
+        return datetime_to_ms(self.get_start())
+
+    def load_price(self, symbol: str, interval: str) -> pd.Series:
+        """Load the close prices of a symbol since the `start` of the config"""
+        df = BinanceData.load([symbol], interval=interval, start=self.get_start(), columns=['Close'])
+        return df.get('Close')
+
+    def simulate(self, price, entries, exits):
+        """Simulate the portfolio of the signals with the `init_cash` of the config"""
+        init_cash = self.get("init_cash", 10000)
+        with span('simulate'):
+            return vbt.Portfolio.from_signals(price, entries, exits, init_cash=init_cash)
+
+    def kernel_args(self, **params) -> tuple:
+        """Get the arguments of `signal_kernel` for a set of parameters"""
+        raise NotImplementedError
+
+    def supports_kernel(self) -> bool:
+        """Whether the strategy declares `signal_kernel`"""
+        return self.signal_kernel is not None
+
+    def live_window(self, **params) -> int:
+        """Get the bars kept in the ring of `live_kernel` for a set of parameters"""
+        raise NotImplementedError
+
+    def supports_live(self) -> bool:
+        """Whether the strategy declares `live_kernel`"""
+        return self.live_kernel is not None
+
+    def generate_signals(self, price: pd.Series | pd.DataFrame, param_list: list) -> tuple:
+        """Generate the entries and exits by `signal_kernel`
+
+        Each pair of price column and set of parameters is an output column.
+        The columns are the price columns for one set of parameters, the
+        labels of the parameters for one price column, and both otherwise.
+        A price series on one set of parameters gives the signal series.
+
+        Returns:
+            (entries, exits)
+        """
+        frame = price.to_frame() if isinstance(price, pd.Series) else price
+        n_prices, n_params = frame.shape[1], len(param_list)
+        args = [self.kernel_args(**params) for params in param_list]
+        col_map = np.repeat(np.arange(n_prices), n_params)
+        params = [np.tile([a[i] for a in args], n_prices) for i in range(len(args[0]))]
+        with span('signals'):
+            entries, exits = run_kernel(self.signal_kernel, frame.to_numpy(), col_map, params)
+
+        if isinstance(price, pd.Series) and n_params == 1:
+            return (pd.Series(entries[:, 0], index=price.index, name=price.name),
+                    pd.Series(exits[:, 0], index=price.index, name=price.name))
+        labels = pd.Index([self.create_label(**params) for params in param_list], name='label')
+        if n_params == 1:
+            columns = frame.columns
+        elif n_prices == 1:
+            columns = labels
+        else:
+            columns = pd.MultiIndex.from_product([frame.columns, labels])
+        return (pd.DataFrame(entries, index=frame.index, columns=columns),
+                pd.DataFrame(exits, index=frame.index, columns=columns))
+
+    def supports_panel(self) -> bool:
+        """Whether the strategy implements `run_panel`"""
+        return type(self).run_panel is not Runner.run_panel
+
+    def supports_batch(self) -> bool:
+        """Whether the strategy implements `run_batch`"""
+        return type(self).run_batch is not Runner.run_batch
+
+    def group_parameters(self, param_list: list) -> list:
+        """Group the parameters which could be run in one batch
+
+        The parameters are grouped by interval by default, since each interval
+        has its own price series.
+        """
+        groups = dict()
+        for params in param_list:
+            groups.setdefault(params.get('interval'), []).append(params)
+        return list(groups.values())
+
+
+class OrderRunner(Runner):
+    """The base runner of the strategies simulated by numba order callbacks
+
+    A strategy declares its callbacks, see `backtest.callbacks`, by
+
+        order_func = staticmethod(order_func_nb)
+        pre_sim_func = staticmethod(pre_sim_func_nb)
+
+    and `order_args` for the columns. A batch of parameters or a panel of
+    symbols is one simulation whose columns are the labels or the symbols.
+    """
+
+    # The numba order callback and the one creating the state of the columns
+    order_func = None
+    pre_sim_func = None
+
+    def order_args(self, close: np.ndarray, param_list: list) -> tuple:
+        """Get the arguments of `order_func` for the columns
+
+        Args:
+            close: 2-D array, the close prices of the columns
+            param_list: list, the set of parameters of each column
+        """
+        raise NotImplementedError
+
+    def supports_orders(self) -> bool:
+        """Whether the strategy declares `order_func`"""
+        return self.order_func is not None
+
+    def simulate_orders(self, price: pd.Series | pd.DataFrame, param_list: list,
+                        use_numba: bool = True):
+        """Simulate the order callbacks with the `init_cash` of the config
+
+        The columns are the price columns for one set of parameters and the
+        labels of the parameters for a price series, like `generate_signals`.
+        Without `use_numba`, the simulation and the callbacks run in Python,
+        which is slow but could be debugged.
+
+        Returns:
+            the portfolio, whose index is the naive UTC times of the price.
+        """
+        if isinstance(price, pd.Series) and len(param_list) > 1:
+            labels = pd.Index([self.create_label(**params) for params in param_list], name='label')
+            # Not `vbt.tile`, whose checks convert a tz-aware index to objects
+            price = pd.DataFrame(np.tile(price.to_numpy()[:, None], len(param_list)),
+                                 index=price.index, columns=labels)
+            col_params = param_list
+        else:
+            col_params = param_list * (price.shape[1] if price.ndim > 1 else 1)
+        close = np.asfortranarray(price.to_numpy(), dtype=np.float64).reshape(len(price), -1)
+        args = self.order_args(close, col_params)
+        order_func, pre_sim_func = self.order_func, self.pre_sim_func or no_pre_func_nb
+        if not use_numba:
+            order_func, pre_sim_func = order_func.py_func, pre_sim_func.py_func
+        init_cash = self.get("init_cash", 10000)
+        # The wrapper of vectorbt converts a tz-aware index to objects in each
+        # wrap, which takes longer than the simulation and most of the stats,
+        # so the portfolio is on the naive index of the UTC times
+        if getattr(price.index, 'tz', None) is not None:
+            price = price.set_axis(price.index.tz_convert(None), axis=0)
+        with span('simulate'):
+            return vbt.Portfolio.from_order_func(price, order_func, *args, pre_sim_func_nb=pre_sim_func,
+                                                 init_cash=init_cash, use_numba=use_numba)
+
+    def run(self, symbol: str, **params):
+        price = self.load_price(symbol, params['interval'])
+        return self.simulate_orders(price, [params])
+
+    def run_batch(self, symbol: str, param_list: list):
+        price = self.load_price(symbol, param_list[0]['interval'])
+        # Each param set is a column
+        return self.simulate_orders(price, param_list)
+
+    def run_panel(self, symbols: list, **params):
+        data = BinanceData.load(symbols, interval=params['interval'], start=self.get_start(),
+                                skip_missing=True, columns=['Close'])
+        price = data.get('Close')
+        if isinstance(price, pd.Series):
+            price = price.to_frame(data.symbols[0])
+        # Keep the symbols as the columns
+        return self.simulate_orders(price, [params])
@@ -0,0 +1,131 @@
+"""The in-process cache of loaded kline frames
+
+A parameter sweep runs the same symbol/interval once per parameter set, so
+the typed frames built by `BinanceData.load` are kept in a bounded LRU cache
+and shared by all the runs of a sweep. The keys carry the coverage of the
+klines, so a long-lived process reads the frames again after an ingest.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+# The default memory budget of the cache: 1GB
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def frame_nbytes(df) -> int:
+    """Estimate the memory used by a DataFrame"""
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+class KlineCache:
+    """A bounded LRU cache of typed kline frames
+
+    >>> cache = KlineCache(max_bytes=512 * 1024 * 1024)
+    >>> key = ('BTCUSDT', '30m', 0, 0)
+    >>> df = cache.get(key)
+    >>> if df is None:
+    >>>     cache.put(key, load_frame())
+
+    The cached frames are shared, callers must not modify them in place.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def configure(self, enabled: bool | None = None, max_bytes: int | None = None):
+        """Change the cache settings, evicting frames above the new budget"""
+        with self.lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if not self.enabled:
+                self._clear()
+            else:
+                self._evict()
+        return self
+
+    def get(self, key: tuple):
+        """Get the frame of key, or None if it is not cached"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            df = self.frames.get(key)
+            if df is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return df
+
+    def put(self, key: tuple, df):
+        """Add a frame into the cache"""
+        if not self.enabled:
+            return df
+        size = frame_nbytes(df)
+        if size > self.max_bytes:
+            log.debug("frame %s is larger than the cache budget, skipped", key)
+            return df
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.nbytes -= frame_nbytes(old)
+            self.frames[key] = df
+            self.nbytes += size
+            self._evict()
+        return df
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def discard(self, match):
+        """Remove the frames whose key matches, e.g. the stale ones of a frame"""
+        with self.lock:
+            for key in [key for key in self.frames if match(key)]:
+                self.nbytes -= frame_nbytes(self.frames.pop(key))
+
+    def stats(self) -> dict:
+        """Get the cache statistics"""
+        return dict(
+            enabled=self.enabled,
+            frames=len(self.frames),
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions
+        )
+
+    def _clear(self):
+        self.frames.clear()
+        self.nbytes = 0
+
+    def _evict(self):
+        while self.frames and self.nbytes > self.max_bytes:
+            key, df = self.frames.popitem(last=False)
+            self.nbytes -= frame_nbytes(df)
+            self.evictions += 1
+            log.debug("evict %s from kline cache", key)
+
+
+# The process-wide kline cache
+kline_cache = KlineCache()
+
+
+def configure_cache(enabled: bool | None = None, max_bytes: int | None = None):
+    """Configure the process-wide kline cache"""
+    return kline_cache.configure(enabled=enabled, max_bytes=max_bytes)
@@ -0,0 +1,77 @@
+"""The numba order callbacks of the order strategies
+
+A signal strategy decides its entries and exits before the simulation, so a
+rule depending on the position, e.g. a trailing stop, pyramiding or the
+sizing of each trade, could not be a signal kernel. An order strategy is
+simulated by `vbt.Portfolio.from_order_func` instead, whose callbacks see the
+cash, the position and the state of each column at each bar:
+
+    state = pre_sim_func_nb(c)
+    order = order_func_nb(c, *state, *order_args)
+
+    - c: the context of vectorbt, e.g. `c.i`, `c.col`, `c.position_now`
+    - state: tuple of arrays, the state of the columns kept by the callbacks
+    - order_args: the arrays of the strategy, e.g. the parameter of each
+      column as a 1-D array
+
+The columns of one simulation are the sets of parameters or the symbols, see
+`OrderRunner.simulate_orders`. An order callback only reads the fields of the
+context it needs and passes them to a rule on scalars; a callback using the
+context throughout is not inlined into the simulation and is about 9x slower.
+
+The simulation of vectorbt takes the callbacks as arguments, so numba could
+not cache it on disk like the signal kernels, and it is compiled once per
+process, see `backtest.warmup`.
+"""
+
+import numpy as np
+from numba import njit
+from vectorbt.generic.nb import rolling_mean_1d_nb
+from vectorbt.portfolio.enums import Direction, SizeType, NoOrder
+from vectorbt.portfolio.nb import order_nb
+
+
+@njit(cache=True)
+def sma_columns_nb(close, window):
+    """The SMA of each column on its own window"""
+    out = np.empty_like(close)
+    for col in range(close.shape[1]):
+        out[:, col] = rolling_mean_1d_nb(close[:, col], window[col])
+    return out
+
+
+@njit(cache=True)
+def trailing_stop_pre_sim_nb(c):
+    """Create the highest close since the entry of each column"""
+    return (np.full(c.target_shape[1], np.nan),)
+
+
+@njit(cache=True)
+def trailing_stop_nb(close, prev_close, sma, prev_sma, position, peak, col, stop, size):
+    """Enter when the close crosses above the SMA, exit by a trailing stop
+
+    A long position is opened by `size` of the cash, and it is closed once
+    the close falls by `stop` from the highest close since the entry.
+    """
+    if np.isnan(close):
+        return NoOrder
+    if position > 0:
+        if close > peak[col]:
+            peak[col] = close
+        if close < peak[col] * (1 - stop):
+            return order_nb(size=-np.inf, price=close, direction=Direction.LongOnly)
+    elif close > sma and prev_close <= prev_sma:
+        peak[col] = close
+        return order_nb(size=size, price=close, size_type=SizeType.Percent,
+                        direction=Direction.LongOnly)
+    return NoOrder
+
+
+@njit(cache=True)
+def trailing_stop_order_nb(c, peak, sma, stop, size):
+    """The order callback of `trailing_stop_nb`"""
+    i, col = c.i, c.col
+    if i == 0:
+        return NoOrder
+    return trailing_stop_nb(c.close[i, col], c.close[i - 1, col], sma[i, col], sma[i - 1, col],
+                            c.position_now, peak, col, stop[col], size[col])
@@ -0,0 +1,338 @@
+"""The catalog of the kline dbs
+
+The catalog keeps the coverage of each (symbol, interval) of the kline dbs in
+one small sqlite db, so the engine knows up front which symbols have no db,
+no table or too few bars, and how many bars each work unit runs on:
+
+    - first, last: the open time of the first and the last kline
+    - rows: the number of klines
+    - gaps: the missing open times as [start, end) spans
+    - modified, size: the modified time in ms and the bytes of the db files
+
+A refresh only scans the dbs whose files changed since the last refresh, and
+a table which was only appended to is scanned from its last kline, e.g. after
+the ingestion of a new month:
+
+    python runbt.py catalog --db D:\\data\\binance\\db\\futures\\um_klines
+
+The engine refreshes the catalog of the config symbols with a `catalog` in
+the config, e.g.
+
+    - catalog: {
+        path: D:\\data\\binance\\db\\futures\\catalog.db,
+        min_bars: 500
+      }
+
+then the symbols without enough bars since the `start` of a strategy are
+skipped into `skipped.csv` of the work dir, see `BacktestEngine.exec`.
+"""
+
+import os
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import MetaData
+from sqlalchemy import Table, Column, Integer, String
+from sqlalchemy import select, delete, insert
+from sqlalchemy import create_engine
+
+import backtest.db
+from backtest.db import KlineDb, KLINE_INTERVALS, get_base_interval, file_signature
+from backtest.utils import parse_interval
+
+
+log = logging.getLogger(__name__)
+
+
+def add_catalog_table(metadata_obj):
+    return Table(
+        "catalog",
+        metadata_obj,
+        Column('symbol', String, primary_key=True),
+        Column('interval', String, primary_key=True),
+        # the open time of the first and the last kline
+        Column('first', Integer),
+        Column('last', Integer),
+        # the number of klines
+        Column('rows', Integer),
+        # the JSON list of the [start, end) spans of the missing klines
+        Column('gaps', String),
+        # the modified time in ms and the bytes of the db and its WAL file
+        Column('modified', Integer),
+        Column('size', Integer),
+        # the refresh time in unix time format
+        Column('updated', Integer)
+    )
+
+
+def get_default_catalog_file() -> str:
+    """Build the path of the catalog in the dir of the kline dbs"""
+    return os.path.join(backtest.db.BINANCE_FUTURES_KLINE_DB, 'catalog.db')
+
+
+def get_db_file(symbol: str, path: str) -> str:
+    """Build the path of the kline db of a symbol like `KlineDb`"""
+    return os.path.join(path, f'{symbol.strip().upper()}.db')
+
+
+def find_gaps(s: np.ndarray, interval: str) -> list:
+    """Find the [start, end) spans of the missing open times"""
+    ms = parse_interval(interval)
+    i = np.flatnonzero(np.diff(s) > ms)
+    return [[int(s[j]) + ms, int(s[j + 1])] for j in i]
+
+
+def _read_times(conn, table: str, after: int) -> np.ndarray:
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        cursor.execute(f'select s from {table} where s > ? order by s', (after,))
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+    finally:
+        cursor.close()
+
+
+def scan_table(conn, symbol: str, interval: str, known: dict | None = None) -> dict | None:
+    """Scan the coverage of a kline table, from the last kline of `known` if only appended
+
+    Returns:
+        the catalog row, or None if the table is empty.
+    """
+    table = f'k{interval}'
+    first, last, rows = conn.exec_driver_sql(f'select min(s), max(s), count(*) from {table}').one()
+    if rows == 0:
+        return None
+    if known is not None and known['first'] == first and known['last'] <= last:
+        tail = _read_times(conn, table, known['last'])
+        if known['rows'] + len(tail) == rows:
+            gaps = known['gaps'] + find_gaps(np.concatenate([[known['last']], tail]), interval)
+            return dict(symbol=symbol, interval=interval, first=first, last=last, rows=rows, gaps=gaps)
+    # Some klines were inserted before the last one
+    gaps = find_gaps(_read_times(conn, table, -1), interval)
+    return dict(symbol=symbol, interval=interval, first=first, last=last, rows=rows, gaps=gaps)
+
+
+def scan_symbol(symbol: str, path: str, known: dict) -> tuple:
+    """Scan the kline db of a symbol, the work unit of the refresh
+
+    Args:
+        symbol: str, the symbol
+        path: str, the dir of the kline dbs
+        known: dict, the catalog rows of the symbol keyed by interval
+
+    Returns:
+        (symbol, rows), the catalog rows of the stored intervals, or None if
+        the db is unchanged.
+    """
+    signature = file_signature(get_db_file(symbol, path))
+    if signature is None:
+        return symbol, []
+    modified, size = signature
+    if known and all(row['modified'] == modified and row['size'] == size for row in known.values()):
+        return symbol, None
+    kdb = KlineDb(symbol, path=path, readonly=True)
+    rows = list()
+    try:
+        with kdb.create_engine(echo=False).connect() as conn:
+            tables = set(conn.exec_driver_sql(
+                "select name from sqlite_master where type = 'table'"
+            ).scalars())
+            for interval in KLINE_INTERVALS:
+                if f'k{interval}' not in tables:
+                    continue
+                row = scan_table(conn, symbol, interval, known.get(interval))
+                if row is not None:
+                    rows.append(dict(row, modified=modified, size=size))
+    finally:
+        kdb.dispose()
+    return symbol, rows
+
+
+def count_bars(row: dict, interval: str, start: int = 0) -> int:
+    """Count the bars of an interval since `start` by the catalog row of its base interval
+
+    The bars of a derived interval, e.g. 2h from 30m, are approximated by
+    the stored ones.
+    """
+    base = parse_interval(row['interval'])
+    st = row['first']
+    if start > st:
+        # The first open time since `start`
+        st += -(-(start - st) // base) * base
+    if st > row['last']:
+        return 0
+    bars = (row['last'] - st) // base + 1
+    for gap_start, gap_end in row['gaps']:
+        if gap_end > st:
+            bars -= (gap_end - max(gap_start, st)) // base
+    return int(bars * base // parse_interval(interval))
+
+
+class KlineCatalog:
+    """The catalog of the kline dbs
+
+    >>> catalog = KlineCatalog('catalog.db')
+    >>> catalog.refresh(['BTCUSDT', 'ETHUSDT'])
+    >>> catalog.bars('BTCUSDT', '2h', start=datetime_to_ms(start))
+    """
+
+    def __init__(self, path: str, kline_path: str | None = None):
+        self.db_url = f'sqlite:///{path}'
+        self.kline_path = kline_path
+        self.metadata = MetaData()
+        self.catalog = add_catalog_table(self.metadata)
+        self.engine = None
+        # The rows of the refreshed symbols keyed by symbol and interval
+        self.rows = dict()
+
+    def create_engine(self, echo: bool = False):
+        """Create or get the db engine"""
+        if self.engine is None:
+            self.engine = create_engine(self.db_url, echo=echo)
+            self.metadata.create_all(self.engine)
+        return self.engine
+
+    def get_kline_path(self) -> str:
+        return self.kline_path or backtest.db.BINANCE_FUTURES_KLINE_DB
+
+    def load(self, symbols: list | None = None) -> dict:
+        """Load the catalog rows keyed by symbol and interval"""
+        table = self.catalog
+        stmt = select(table)
+        if symbols is not None:
+            stmt = stmt.where(table.c.symbol.in_([s.strip().upper() for s in symbols]))
+        engine = self.create_engine()
+        rows = dict()
+        with engine.connect() as conn:
+            for row in conn.execute(stmt).mappings():
+                rows.setdefault(row['symbol'], dict())[row['interval']] = dict(
+                    row, gaps=json.loads(row['gaps'])
+                )
+        return rows
+
+    def save(self, symbol: str, rows: list):
+        """Replace the catalog rows of a symbol"""
+        table = self.catalog
+        updated = int(time.time())
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.symbol == symbol))
+            if rows:
+                conn.execute(insert(table), [
+                    dict(row, gaps=json.dumps(row['gaps']), updated=updated) for row in rows
+                ])
+
+    def refresh(self, symbols: list, workers: int = 1) -> dict:
+        """Scan the changed kline dbs of the symbols, in parallel by worker processes
+
+        Returns:
+            the catalog rows of the symbols keyed by symbol and interval, a
+            symbol without db has no rows.
+        """
+        symbols = list(dict.fromkeys(s.strip().upper() for s in symbols))
+        path = self.get_kline_path()
+        known = self.load(symbols)
+        args = (repeat(path), [known.get(symbol, dict()) for symbol in symbols])
+        t0 = time.perf_counter()
+        if workers > 1 and len(symbols) > 1:
+            chunksize = max(1, len(symbols) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(scan_symbol, symbols, *args, chunksize=chunksize))
+        else:
+            results = list(map(scan_symbol, symbols, *args))
+        scanned = 0
+        for symbol, rows in results:
+            if rows is None:
+                continue
+            scanned += 1
+            self.save(symbol, rows)
+            known[symbol] = {row['interval']: row for row in rows}
+        log.info('catalog: %d of %d symbols scanned in %.1fs', scanned, len(symbols),
+                 time.perf_counter() - t0)
+        self.rows.update({symbol: known.get(symbol, dict()) for symbol in symbols})
+        return {symbol: self.rows[symbol] for symbol in symbols}
+
+    def find(self, symbol: str, interval: str) -> dict | None:
+        """Find the refreshed row of the stored interval of an interval"""
+        rows = self.rows.get(symbol.strip().upper())
+        if rows is None:
+            return None
+        base = interval if interval in KLINE_INTERVALS else get_base_interval(interval)
+        return rows.get(base)
+
+    def bars(self, symbol: str, interval: str, start: int = 0) -> int:
+        """Count the bars of a symbol since `start`, 0 if it has no klines"""
+        row = self.find(symbol, interval)
+        return count_bars(row, interval, start) if row is not None else 0
+
+    def check(self, symbol: str, interval: str, start: int = 0, min_bars: int = 1) -> str | None:
+        """Check whether a symbol has `min_bars` bars of an interval since `start`
+
+        Returns:
+            None if it has, otherwise the reason.
+        """
+        if not os.path.exists(get_db_file(symbol, self.get_kline_path())):
+            return 'no kline db'
+        if self.find(symbol, interval) is None:
+            base = interval if interval in KLINE_INTERVALS else get_base_interval(interval)
+            return f'no klines of {base}'
+        bars = self.bars(symbol, interval, start)
+        if bars < min_bars:
+            return f'{bars} bars of {interval} since {pd.Timestamp(start, unit="ms")}, ' \
+                   f'less than {min_bars}'
+        return None
+
+    def summary(self) -> pd.DataFrame:
+        """Summarize the refreshed rows, a row per symbol and interval"""
+        records = list()
+        for symbol, rows in self.rows.items():
+            for interval in [interval for interval in KLINE_INTERVALS if interval in rows]:
+                row = rows[interval]
+                records.append(dict(
+                    symbol=symbol,
+                    interval=interval,
+                    first=pd.Timestamp(row['first'], unit='ms', tz='UTC'),
+                    last=pd.Timestamp(row['last'], unit='ms', tz='UTC'),
+                    rows=row['rows'],
+                    gaps=len(row['gaps']),
+                    missing=sum((end - start) // parse_interval(interval)
+                                for start, end in row['gaps'])
+                ))
+        return pd.DataFrame(records, columns=['symbol', 'interval', 'first', 'last', 'rows',
+                                              'gaps', 'missing'])
+
+
+def refresh_catalog(path: str | None = None, catalog: str | None = None, symbols: list | None = None,
+                    output: str | None = None, workers: int = 1) -> pd.DataFrame:
+    """Refresh the catalog of the kline dbs of a dir
+
+    Args:
+        path: str, the dir of the kline dbs, `BINANCE_FUTURES_KLINE_DB` by default
+        catalog: str, the catalog db, `catalog.db` of the dir by default
+        symbols: list, only refresh these symbols, all the dbs of the dir by default
+        output: str, write the summary into a CSV file
+        workers: int, the number of worker processes
+
+    Returns:
+        the summary, a row per symbol and interval.
+    """
+    path = path or backtest.db.BINANCE_FUTURES_KLINE_DB
+    catalog = catalog or os.path.join(path, 'catalog.db')
+    if symbols is None:
+        # The catalog could be in the dir of the kline dbs
+        symbols = sorted(
+            fn[:-len('.db')] for fn in os.listdir(path)
+            if fn.endswith('.db') and os.path.abspath(os.path.join(path, fn)) != os.path.abspath(catalog)
+        )
+    kc = KlineCatalog(catalog, kline_path=path)
+    kc.refresh(symbols, workers=workers)
+    df = kc.summary()
+    log.info('catalog: %d symbols, %d tables, %d gaps, %d missing klines', df['symbol'].nunique(),
+             len(df), df['gaps'].sum(), df['missing'].sum())
+    if output:
+        df.to_csv(output, index=False)
+    return df
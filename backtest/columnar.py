@@ -0,0 +1,206 @@
+"""The columnar on-disk kline cache
+
+Each symbol/interval of the KlineDb is materialized as one `.npy` file per
+column, which are memory-mapped when loading:
+
+    {root}/BTCUSDT/30m/meta.json
+    {root}/BTCUSDT/30m/s-{version}.npy
+    {root}/BTCUSDT/30m/c-{version}.npy
+    ...
+
+The cache is invalidated by the max(`s`) watermark and the row count of the
+sqlite table, the new bars are appended when the watermark moves forward, and
+the klines are read again after a backfill of older ones. Every update writes
+a new version of the column files, so memory-mapped readers of the previous
+version are never broken.
+
+The processes sharing the cache, e.g. the workers of a work queue, write
+their own versions named by the pid and a random suffix. The files are
+written into temp files and renamed into place, then `meta.json` is replaced
+to commit the version. A writer removes the version two commits back, since
+a reader could have just resolved the previous one, and the files of other
+versions once they are stale, e.g. of a commit replaced by another writer.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import numpy as np
+
+from backtest.db import get_default_klinedb
+
+
+log = logging.getLogger(__name__)
+
+
+# The age in seconds of the files of another version to remove
+STALE_SECONDS = 600
+
+# The kline columns and their dtypes, the unused field `i` is not cached
+KLINE_COLUMNS = {
+    's': np.int64,
+    'o': np.float64,
+    'h': np.float64,
+    'l': np.float64,
+    'c': np.float64,
+    'bv': np.float64,
+    'e': np.int64,
+    'qv': np.float64,
+    'n': np.int64,
+    'tbbv': np.float64,
+    'tbqv': np.float64
+}
+
+
+class ColumnarCache:
+    """The memory-mapped column files of klines
+
+    >>> cache = ColumnarCache('D:\\data\\binance\\cache')
+    >>> columns = cache.load('BTCUSDT', '30m', st=1696118400000)
+    >>> columns['c']
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, symbol.strip().upper(), interval)
+
+    def read_meta(self, symbol: str, interval: str) -> dict | None:
+        fn = os.path.join(self.get_dir(symbol, interval), 'meta.json')
+        if not os.path.exists(fn):
+            return None
+        with open(fn, 'r') as f:
+            return json.load(f)
+
+    def _column_file(self, d: str, name: str, version: int | str) -> str:
+        return os.path.join(d, f'{name}-{version}.npy')
+
+    def _read_rows(self, symbol: str, interval: str, after: int = 0) -> dict:
+        """Read the klines with open time after the given watermark"""
+        kdb = get_default_klinedb(symbol)
+        return kdb.select(interval, start=after + 1, columns=list(KLINE_COLUMNS))
+
+    def _write(self, symbol: str, interval: str, columns: dict, watermark: int,
+               previous: dict | None) -> dict:
+        current = self.read_meta(symbol, interval)
+        if (current is not None and current != previous and current['watermark'] == watermark
+                and current['rows'] == len(columns['s'])):
+            # Another writer has committed the same klines meanwhile
+            return current
+        d = self.get_dir(symbol, interval)
+        os.makedirs(d, exist_ok=True)
+        version = f'{os.getpid()}-{uuid.uuid4().hex[:12]}'
+        for name, values in columns.items():
+            fn = self._column_file(d, name, version)
+            with open(f'{fn}.tmp', 'wb') as f:
+                np.save(f, values)
+            os.replace(f'{fn}.tmp', fn)
+        meta = dict(
+            version=version,
+            previous=previous['version'] if previous is not None else None,
+            watermark=watermark,
+            rows=len(columns['s'])
+        )
+        # Replace the meta atomically, it commits the new version
+        tmp = os.path.join(d, f'meta.json.{version}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(d, 'meta.json'))
+        self._clean(d, meta, previous)
+        return meta
+
+    def _clean(self, d: str, meta: dict, previous: dict | None):
+        """Remove the version two commits back and the stale files of other versions"""
+        keep = {str(meta['version']), str(meta['previous'])}
+        superseded = str(previous.get('previous')) if previous is not None else None
+        stale = time.time() - STALE_SECONDS
+        for fn in os.listdir(d):
+            if fn == 'meta.json':
+                continue
+            if fn.startswith('meta.json.'):
+                version = fn[len('meta.json.'):-len('.tmp')]
+            else:
+                # e.g. c-{version}.npy or c-{version}.npy.tmp
+                version = fn.split('-', 1)[-1].split('.npy')[0]
+            if version in keep:
+                continue
+            path = os.path.join(d, fn)
+            try:
+                # The files may still be mapped on Windows
+                if version == superseded or os.path.getmtime(path) < stale:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def refresh(self, symbol: str, interval: str) -> dict:
+        """Bring the column files up to the watermark and the rows of the sqlite table"""
+        watermark, rows = get_default_klinedb(symbol).get_coverage(interval)
+        meta = self.read_meta(symbol, interval)
+        if meta is not None and meta['watermark'] == watermark and meta['rows'] == rows:
+            return meta
+
+        columns = None
+        if meta is not None and meta['watermark'] < watermark:
+            # Append the new bars
+            log.info("append %s %s into columnar cache ...", symbol, interval)
+            d = self.get_dir(symbol, interval)
+            new_rows = self._read_rows(symbol, interval, after=meta['watermark'])
+            if meta['rows'] + len(new_rows['s']) == rows:
+                columns = {
+                    name: np.concatenate([
+                        np.load(self._column_file(d, name, meta['version'])),
+                        new_rows[name]
+                    ])
+                    for name in KLINE_COLUMNS
+                }
+        if columns is None:
+            # Missing, rebuilt or backfilled
+            log.info("materialize %s %s into columnar cache ...", symbol, interval)
+            columns = self._read_rows(symbol, interval)
+        watermark = int(columns['s'][-1]) if len(columns['s']) else 0
+        return self._write(symbol, interval, columns, watermark, meta)
+
+    def load(self, symbol: str, interval: str, st: int = 0, et: int = 0,
+             columns: list | None = None, attempts: int = 3) -> dict:
+        """Load the memory-mapped columns in [st, et) of a fresh cache"""
+        for attempt in range(attempts):
+            meta = self.refresh(symbol, interval)
+            try:
+                return self._map(symbol, interval, meta, st, et, columns)
+            except FileNotFoundError:
+                # The version was removed by other writers after it was resolved
+                if attempt == attempts - 1:
+                    raise
+                log.info("reload %s %s of the removed version %s", symbol, interval, meta['version'])
+
+    def _map(self, symbol: str, interval: str, meta: dict, st: int, et: int,
+             columns: list | None) -> dict:
+        d = self.get_dir(symbol, interval)
+        s = np.load(self._column_file(d, 's', meta['version']), mmap_mode='r')
+        i = np.searchsorted(s, st, side='left') if st > 0 else 0
+        j = np.searchsorted(s, et, side='left') if et > 0 else len(s)
+        names = columns if columns is not None else KLINE_COLUMNS.keys()
+        result = dict(s=s[i:j])
+        for name in names:
+            if name != 's':
+                values = np.load(self._column_file(d, name, meta['version']), mmap_mode='r')
+                result[name] = values[i:j]
+        return result
+
+
+# The process-wide columnar cache, disabled until configured
+columnar_cache: ColumnarCache | None = None
+
+
+def configure_columnar_cache(root: str | None = None):
+    """Enable the columnar cache under the root dir, or disable it by None"""
+    global columnar_cache
+    columnar_cache = ColumnarCache(root) if root else None
+    return columnar_cache
+
+
+def get_columnar_cache() -> ColumnarCache | None:
+    return columnar_cache
@@ -1,83 +1,168 @@
 # Copyright (c) 2021 Oleg Polakow. All rights reserved.
 
 """Custom data classes that subclass `vectorbt.data.base.Data`."""
+import logging
+import numpy as np
 import pandas as pd
 from vectorbt import _typing as tp
 from vectorbt.data.base import Data
 from vectorbt.utils.datetime_ import (
     datetime_to_ms
 )
-from backtest.db import get_default_klinedb
+from backtest.cache import kline_cache
+from backtest.columnar import get_columnar_cache
+from backtest.db import get_default_klinedb, get_base_interval, KLINE_INTERVALS
+from backtest.resample import resample_columns, align_start
+from backtest.timing import span
+
+
+log = logging.getLogger(__name__)
 
 
 BinanceDataT = tp.TypeVar("BinanceDataT", bound="BinanceData")
 
 
+# The kline fields and their column names in the data frame
+KLINE_NAMES = {
+    'o': 'Open',
+    'h': 'High',
+    'l': 'Low',
+    'c': 'Close',
+    'bv': 'Volume',
+    'e': 'Close time',
+    'qv': 'Quote volume',
+    'n': 'Number of trades',
+    'tbbv': 'Taker base volume',
+    'tbqv': 'Taker quote volume'
+}
+
+# The column names to the kline fields
+KLINE_FIELDS = {name: field for field, name in KLINE_NAMES.items()}
+
+
 class BinanceData(Data):
     """load binace data from sqlitedb"""
+
+    @classmethod
+    def frame_from_columns(cls, columns: dict) -> pd.DataFrame:
+        """Create the kline frame from the (memory-mapped) column arrays
+
+        Only a frame of one column, e.g. of ['Close'], stays a view of its
+        mapped array. With more columns, pandas consolidates the columns of
+        a dtype into one block, which copies them.
+        """
+        data = dict()
+        for name, values in columns.items():
+            if name == 's':
+                continue
+            elif name == 'e':
+                data[KLINE_NAMES[name]] = pd.to_datetime(values, unit='ms', utc=True)
+            else:
+                data[KLINE_NAMES[name]] = values
+        index = pd.to_datetime(columns['s'], unit='ms', utc=True)
+        index.name = 'Open time'
+        # Do not copy at the construction, a single column is not consolidated
+        return pd.DataFrame(data, index=index, copy=False)
+
+    @classmethod
+    def read_frame(cls, symbol: str, interval: str, st: int = 0, et: int = 0,
+                   columns: list | None = None, dtype=np.float64) -> pd.DataFrame:
+        """Read the typed kline frame of a symbol from sqlite3 db
+
+        Only the given frame columns are read, e.g. ['Close'], and the
+        columnar cache is used when it is configured. An interval which is not
+        stored, e.g. 15m or 2h, is resampled from a stored interval.
+        """
+        fields = [KLINE_FIELDS[c] for c in columns] if columns is not None else None
+        if interval not in KLINE_INTERVALS:
+            # Derive the interval from the coarsest stored one
+            base = get_base_interval(interval)
+            with span('read'):
+                data = cls.read_columns(symbol, base, st=align_start(st, interval), et=et,
+                                        fields=fields, dtype=dtype)
+            with span('convert'):
+                data = resample_columns(data, interval)
+                i = np.searchsorted(data['s'], st, side='left')
+                data = {name: values[i:] for name, values in data.items()}
+        else:
+            with span('read'):
+                data = cls.read_columns(symbol, interval, st=st, et=et, fields=fields, dtype=dtype)
+        with span('convert'):
+            return cls.frame_from_columns(data)
+
+    @classmethod
+    def read_columns(cls, symbol: str, interval: str, st: int = 0, et: int = 0,
+                     fields: list | None = None, dtype=np.float64) -> dict:
+        """Read the kline arrays of a stored interval"""
+        columnar = get_columnar_cache()
+        if columnar is not None:
+            data = columnar.load(symbol, interval, st=st, et=et, columns=fields)
+            if dtype != np.float64:
+                data = {
+                    name: values.astype(dtype) if values.dtype == np.float64 else values
+                    for name, values in data.items()
+                }
+            return data
+        kdb = get_default_klinedb(symbol)
+        return kdb.select(interval, start=st, end=et, columns=fields, dtype=dtype)
+
     @classmethod
     def load(cls: tp.Type[BinanceDataT],
                  symbols: tp.Labels,
                  interval: str = '1d',
                  start = None,
                  end = None,
+                 skip_missing: bool = False,
+                 columns: list | None = None,
+                 dtype = np.float64,
                  **kwargs) -> BinanceDataT:
-        """Load data from sqlite3 db"""
+        """Load data from sqlite3 db
+
+        The typed frames are shared through the process-wide `kline_cache`,
+        so a parameter sweep reads each series only once. They are keyed by
+        the bounds of the klines and the modified time and the size of the
+        db files, see `KlineDb.get_signature`, so a frame is read again once
+        any kline is stored, without counting the rows on every load.
+
+        With `skip_missing`, the symbols failing to load or having no bars are
+        skipped, which is used to load the panel of a symbol universe.
+
+        The `columns` projects the frame columns to read, e.g. ['Close'], and
+        the `dtype` of the price and volume columns could be np.float32.
+        """
         data = dict()
         st = datetime_to_ms(start) if start else 0
         et = datetime_to_ms(end) if end else 0
-        if st > 0 and et > 0:
-            sql = f'select * from k{interval} where s >= {st} and s < {et} order by s;'
-        elif st > 0:
-            sql = f'select * from k{interval} where s >= {st} order by s;'
-        elif et > 0:
-            sql = f'select * from k{interval} where s < {et} order by s;'
-        else:
-            sql = f'select * from k{interval} order by s;'
         # Create for all
         for s in symbols:
-            # Select keyword arguments for this symbol
-            kdb = get_default_klinedb(s)
-            engine = kdb.create_engine(echo=False)
-            df = pd.read_sql(sql, engine)
-            # Convert data to a DataFrame
-            df = df.rename(columns={
-                's': 'Open time',
-                'o': 'Open',
-                'h': 'High',
-                'l': 'Low',
-                'c': 'Close',
-                'bv': 'Volume',
-                'e': 'Close time',
-                'qv': 'Quote volume',
-                'n': 'Number of trades',
-                'tbbv': 'Taker base volume',
-                'tbqv': 'Taker quote volume',
-                'i': 'Ignore'
-            })
-            df.index = pd.to_datetime(df['Open time'], unit='ms', utc=True)
-            del df['Open time']
-            df['Open'] = df['Open'].astype(float)
-            df['High'] = df['High'].astype(float)
-            df['Low'] = df['Low'].astype(float)
-            df['Close'] = df['Close'].astype(float)
-            df['Volume'] = df['Volume'].astype(float)
-            df['Close time'] = pd.to_datetime(df['Close time'], unit='ms', utc=True)
-            df['Quote volume'] = df['Quote volume'].astype(float)
-            df['Number of trades'] = df['Number of trades'].astype(int)
-            df['Taker base volume'] = df['Taker base volume'].astype(float)
-            df['Taker quote volume'] = df['Taker quote volume'].astype(float)
-            del df['Ignore']
-            
+            try:
+                frame = (s, interval, st, et, tuple(columns or ()), np.dtype(dtype).name)
+                key = frame + (get_default_klinedb(s).get_signature(interval),)
+                df = kline_cache.get(key)
+                if df is None:
+                    # The frames of the older klines are stale
+                    kline_cache.discard(lambda k: k[:len(frame)] == frame)
+                    df = kline_cache.put(key, cls.read_frame(s, interval, st, et,
+                                                             columns=columns, dtype=dtype))
+            except Exception as ex:
+                if not skip_missing:
+                    raise
+                log.warning("skip %s %s: %s", s, interval, ex)
+                continue
+            if skip_missing and len(df) == 0:
+                continue
             data[s] = df
+        if len(data) == 0:
+            raise ValueError(f"No data of {interval} for {list(symbols)}")
 
         # Create new instance from data
-        return cls.from_data(
-            data,
-            # tz_localize=tz_localize,
-            # tz_convert=tz_convert,
-            # missing_index=missing_index,
-            # missing_columns=missing_columns,
-            # wrapper_kwargs=wrapper_kwargs,
-            download_kwargs=kwargs
-        )
\ No newline at end of file
+        with span('align'):
+            return cls.from_data(
+                data,
+                # tz_localize=tz_localize,
+                # tz_convert=tz_convert,
+                # missing_index=missing_index,
+                # missing_columns=missing_columns,
+                # wrapper_kwargs=wrapper_kwargs,
+                download_kwargs=kwargs
+            )
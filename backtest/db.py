@@ -1,17 +1,63 @@
 # https://docs.sqlalchemy.org/en/20/core/metadata.html
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dateutil.tz import tzlocal
 
 from sqlalchemy import MetaData
 from sqlalchemy import Table, Column, Integer, Float, String
-from sqlalchemy import insert, update, select, and_
+from sqlalchemy import insert, update, select, and_, func
 from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import create_engine
+from sqlalchemy import event
+
+from backtest.utils import parse_interval
 
 # from basana.config import BINANCE_FUTURES_KLINE_DB
 
-BINANCE_FUTURES_KLINE_DB = "D:\\data\\binance\\db\\futures\\um_klines"
+# The dir of the kline dbs, which could be overridden by the env variable
+BINANCE_FUTURES_KLINE_DB = os.getenv(
+    'BINANCE_FUTURES_KLINE_DB', "D:\\data\\binance\\db\\futures\\um_klines"
+)
+
+# The options of the default kline dbs, see `configure_klinedb`
+KLINEDB_OPTIONS = {
+    # open the db read-only via sqlite URI
+    'readonly': False,
+    # PRAGMA mmap_size in bytes, the sqlite default if None
+    'mmap_size': None,
+    # PRAGMA cache_size in bytes, the sqlite default if None, note each db
+    # of the registry keeps its page cache
+    'cache_size': None,
+    # the max number of dbs kept open in the registry
+    'max_open': 32
+}
+
+# The counters of kline dbs, engines and connections
+KLINEDB_STATS = {
+    'instances': 0,
+    'hits': 0,
+    'engines': 0,
+    'connects': 0,
+    'checkouts': 0,
+    'evictions': 0
+}
+
+# The kline fields, the unused field `i` is excluded
+KLINE_FIELDS = ['s', 'o', 'h', 'l', 'c', 'bv', 'e', 'qv', 'n', 'tbbv', 'tbqv']
+
+# The integer fields
+INT_FIELDS = ('s', 'e', 'n')
+
+# The intervals stored in the kline tables, from the coarsest
+KLINE_INTERVALS = ['1d', '4h', '30m', '5m', '1m']
 
 # Following are only Sqlite3!
 
@@ -47,23 +93,60 @@ def add_kline_table(metadata_obj, period='1d'):
     )
 
 
+def get_base_interval(interval: str) -> str:
+    """Get the coarsest stored interval which an interval could be derived from
+
+    e.g. 2h from 30m, 8h from 4h, 3d from 1d, and 1m at last.
+    """
+    ms = parse_interval(interval)
+    for base in KLINE_INTERVALS:
+        if ms % parse_interval(base) == 0:
+            return base
+    raise ValueError(f"Interval {interval} could not be derived")
+
+
+def file_signature(fn: str) -> tuple | None:
+    """Get the (modified, size) of a db and its WAL file, or None without the db"""
+    if not os.path.exists(fn):
+        return None
+    modified, size = 0, 0
+    for one in (fn, f'{fn}-wal'):
+        if os.path.exists(one):
+            st = os.stat(one)
+            modified = max(modified, st.st_mtime_ns // 1_000_000)
+            size += st.st_size
+    return modified, size
+
+
 class KlineDb:
     """"The Db for storing Kline Data
     
     >>> db = KlineDb('BTCUSDT')
     >>> db.create_tables()
-    
+
+    A read-only db is opened via sqlite URI with the pragma query_only, and
+    its connections could be tuned for reading by the pragmas mmap_size and
+    cache_size, which are the sqlite defaults unless given.
     """
-    def __init__(self, symbol: str, path: str = '.'):
+    def __init__(self, symbol: str, path: str = '.', readonly: bool = False,
+                 mmap_size: int | None = None, cache_size: int | None = None):
         self.symbol = symbol
         self.path = path
         self.dbname = symbol.strip().upper()
-        self.db_url = f'sqlite:///{path}/{self.dbname}.db'
+        self.readonly = readonly
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        if readonly:
+            uri = Path(path, f'{self.dbname}.db').absolute().as_uri()
+            self.db_url = f'sqlite:///{uri}?mode=ro&uri=true'
+        else:
+            self.db_url = f'sqlite:///{path}/{self.dbname}.db'
         # print(self.db_url)
         # breakpoint()
         # print(self.db_url)
         # db metadata
         self.metadata = MetaData()
+        KLINEDB_STATS['instances'] += 1
 
         # db engine
         self.engine = None
@@ -89,75 +172,406 @@ class KlineDb:
         """Create or get the db engine"""
         if self.engine is None:
             self.engine = create_engine(self.db_url, echo=echo)
+            event.listen(self.engine, 'connect', self._on_connect)
+            event.listen(self.engine, 'checkout', self._on_checkout)
+            KLINEDB_STATS['engines'] += 1
         return self.engine
+
+    def _on_connect(self, dbapi_conn, conn_record):
+        KLINEDB_STATS['connects'] += 1
+        cursor = dbapi_conn.cursor()
+        if self.mmap_size is not None:
+            cursor.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        if self.cache_size is not None:
+            # a negative cache_size is in KiB
+            cursor.execute(f'PRAGMA cache_size = -{int(self.cache_size) // 1024}')
+        if self.readonly:
+            cursor.execute('PRAGMA query_only = 1')
+        cursor.close()
+
+    def _on_checkout(self, dbapi_conn, conn_record, conn_proxy):
+        KLINEDB_STATS['checkouts'] += 1
+
+    def dispose(self, close: bool = True):
+        """Release the connections of the engine"""
+        if self.engine is not None:
+            self.engine.dispose(close=close)
+            self.engine = None
     
     def create_tables(self):
         engine = self.create_engine()
         self.metadata.create_all(engine)
 
-    def _to_timestamp(self, dt: datetime | None = None):
-        if dt is not None:
+    def enable_wal(self):
+        """Switch the db into WAL mode for bulk writing"""
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode = WAL')
+            conn.exec_driver_sql('PRAGMA synchronous = NORMAL')
+
+    def count(self, interval: str, start: int, end: int) -> int:
+        """Count the klines with open time in [start, end]"""
+        table = self.tables[interval]
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(table).where(
+                    and_(table.c.s >= start, table.c.s <= end)
+                )
+            ).scalar()
+
+    def upsert(self, interval: str, rows: list, batch_size: int = 10000) -> int:
+        """Insert the kline rows in one transaction, skipping existing open times
+
+        Args:
+            interval: str, the kline interval
+            rows: list, dicts of the kline fields
+            batch_size: int, the number of rows of an executemany
+
+        Returns:
+            the number of inserted rows.
+        """
+        table = self.tables[interval]
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=[table.c.s])
+        engine = self.create_engine(echo=False)
+        inserted = 0
+        with engine.begin() as conn:
+            for i in range(0, len(rows), batch_size):
+                result = conn.execute(stmt, rows[i:i + batch_size])
+                inserted += max(result.rowcount, 0)
+        return inserted
+
+    def get_watermark(self, interval: str) -> int:
+        """Get the open time of the latest kline, or 0 if the table is empty"""
+        table = self.tables.get(interval)
+        if table is None:
+            # A derived interval is as fresh as its base interval
+            table = self.tables[get_base_interval(interval)]
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            value = conn.execute(select(func.max(table.c.s))).scalar()
+        return value or 0
+
+    def get_coverage(self, interval: str) -> tuple:
+        """Get the (watermark, rows) of an interval
+
+        The rows tell a backfill of older klines, which leaves the watermark.
+        A derived interval is covered by its base interval.
+        """
+        table = self.tables.get(interval)
+        if table is None:
+            table = self.tables[get_base_interval(interval)]
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            watermark, rows = conn.execute(select(func.max(table.c.s), func.count())).one()
+        return watermark or 0, rows
+
+    def get_bounds(self, interval: str) -> tuple:
+        """Get the open times of the first and the latest klines, or (0, 0) if empty
+
+        Unlike the count of `get_coverage`, each is a lookup of the primary
+        key, so it could be checked on every load. The first tells a backfill
+        of older klines. A derived interval is bounded by its base interval.
+        """
+        table = self.tables.get(interval)
+        if table is None:
+            table = self.tables[get_base_interval(interval)]
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            # One min or max per query, which sqlite answers by the index
+            first = conn.execute(select(func.min(table.c.s))).scalar()
+            last = conn.execute(select(func.max(table.c.s))).scalar()
+        return first or 0, last or 0
+
+    def get_file(self) -> str:
+        """Get the path of the db file"""
+        return os.path.join(self.path, f'{self.dbname}.db')
+
+    def get_signature(self, interval: str) -> tuple:
+        """Get the bounds of an interval and the (modified, size) of the db files
+
+        It changes with any stored kline, including the ones filling a gap,
+        without counting the rows like `get_coverage`.
+        """
+        return self.get_bounds(interval) + (file_signature(self.get_file()),)
+
+    def _to_timestamp(self, dt: datetime | int | None = None):
+        if dt is None:
+            return 0
+        elif isinstance(dt, datetime):
             return int(dt.timestamp() * 1000)
         else:
-            return 0
-        
-    def select(self, symbol: str, interval: str, 
-                          start: datetime | None = None, end: datetime | None = None, 
-                          skip_if_exists: bool = True):
-        pass
+            # already in unix time format
+            return int(dt)
+
+    def select(self, interval: str,
+               start: datetime | int | None = None, end: datetime | int | None = None,
+               columns: list | None = None, dtype=np.float64, limit: int | None = None) -> dict:
+        """Select the klines in [start, end) into typed NumPy arrays
+
+        Args:
+            interval: str, the kline interval
+            start: the start time, datetime or unix time in ms
+            end: the end time, datetime or unix time in ms
+            columns: list, the kline fields such as ['c'], all by default
+            dtype: the dtype of the price and volume fields, e.g. np.float32
+            limit: int, the max number of klines
+
+        Returns:
+            dict of field to array, the open time `s` is always included.
+
+        >>> db.select('30m', start=datetime(2023, 10, 1), columns=['c'])
+        """
+        table = self.tables.get(interval)
+        if table is None:
+            raise Exception(f"Not table for interval {interval}")
+        names = ['s'] + [c for c in (columns or KLINE_FIELDS) if c != 's']
+        types = [(name, np.int64 if name in INT_FIELDS else dtype) for name in names]
+
+        # Push the projection and the time range into the query
+        start_ts = self._to_timestamp(start)
+        end_ts = self._to_timestamp(end)
+        sql = f'select {", ".join(names)} from {table.name} where s >= ?'
+        params = [start_ts]
+        if end_ts > 0:
+            sql += ' and s < ?'
+            params.append(end_ts)
+        sql += ' order by s'
+        if limit is not None:
+            sql += ' limit ?'
+            params.append(int(limit))
+
+        engine = self.create_engine(echo=False)
+        with engine.connect() as conn:
+            cursor = conn.connection.driver_connection.cursor()
+            try:
+                cursor.execute(sql, params)
+                rows = np.fromiter(cursor, dtype=types)
+            finally:
+                cursor.close()
+        return {name: np.ascontiguousarray(rows[name]) for name in names}
+
+    def iter_chunks(self, interval: str,
+                    start: datetime | int | None = None, end: datetime | int | None = None,
+                    columns: list | None = None, chunk_size: int = 100000):
+        """Iterate the klines in [start, end) by chunks of `select` arrays"""
+        start_ts = self._to_timestamp(start)
+        while True:
+            chunk = self.select(interval, start=start_ts, end=end, columns=columns, limit=chunk_size)
+            if len(chunk['s']) == 0:
+                break
+            yield chunk
+            if len(chunk['s']) < chunk_size:
+                break
+            start_ts = int(chunk['s'][-1]) + 1
 
     def export_ohlcv_file(self, symbol: str, interval: str, 
                           start: datetime | None = None, end: datetime | None = None, 
-                          skip_if_exists: bool = True):
-        fn = f'data/binance-{symbol}-{interval}.csv'
+                          skip_if_exists: bool = True, fmt: str = 'csv',
+                          chunk_size: int = 100000):
+        """Export the OHLCV feed into a csv, parquet or feather file
+
+        The klines are converted and written chunk by chunk, the datetime is
+        the open time in local time as `datetime.fromtimestamp`, and the
+        volume is the quote asset volume. Parquet and feather need pyarrow.
+        """
+        fn = f'data/binance-{symbol}-{interval}.{fmt}'
         if os.path.exists(fn) and skip_if_exists:
             return fn
         
         table = self.tables.get(interval)
         if table is None:
             raise Exception(f"Not table for interval {interval}")
-        
-        engine = self.create_engine()
-        # https://docs.sqlalchemy.org/en/20/tutorial/data_select.html
-        start_ts = self._to_timestamp(start)
-        end_ts = self._to_timestamp(end)
-        
-        if start_ts > 0 and end_ts > 0:
-            stmt = select(table.c.s, table.c.o, table.c.h, 
-                      table.c.l, table.c.c, table.c.qv).where(
-                          and_(table.c.s >= start_ts, table.c.s < end_ts)
-                      ).order_by(table.c.s)
-        elif start_ts > 0:
-            stmt = select(table.c.s, table.c.o, table.c.h, 
-                      table.c.l, table.c.c, table.c.qv).where(
-                          table.c.s >= start_ts
-                      ).order_by(table.c.s)
-        elif end_ts > 0:
-            stmt = select(table.c.s, table.c.o, table.c.h, 
-                      table.c.l, table.c.c, table.c.qv).where(
-                          table.c.s < end_ts
-                      ).order_by(table.c.s)
-        else:
-            stmt = select(table.c.s, table.c.o, table.c.h, 
-                      table.c.l, table.c.c, table.c.qv).order_by(table.c.s)
-        
-        lines = list()
-        with engine.connect() as conn:
-            for row in conn.execute(stmt):
-                # datetime,open,high,low,close,volume
-                dt = datetime.fromtimestamp(row[0] / 1000)
-                line = f'{dt},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]}\n'
-                lines.append(line)
-        
-        with open(fn, 'w') as f:
-            f.write('datetime,open,high,low,close,volume\n')
-            f.writelines(lines)
+
+        if fmt not in OHLCV_WRITERS:
+            raise Exception(f"Not supported format {fmt}")
+
+        # Write into a temp file, so a partial file is never taken as done
+        tmp = f'{fn}.tmp'
+        writer = OHLCV_WRITERS[fmt](tmp)
+        try:
+            try:
+                for chunk in self.iter_chunks(interval, start=start, end=end,
+                                              columns=['o', 'h', 'l', 'c', 'qv'],
+                                              chunk_size=chunk_size):
+                    writer.write(ohlcv_frame(chunk))
+            finally:
+                writer.close()
+            os.replace(tmp, fn)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
 
         return fn
 
 
-def get_default_klinedb(symbol: str):
-    return KlineDb(symbol, path=BINANCE_FUTURES_KLINE_DB)
+def ohlcv_frame(chunk: dict) -> pd.DataFrame:
+    """Convert the kline arrays into the OHLCV feed frame"""
+    dt = pd.to_datetime(chunk['s'], unit='ms', utc=True)
+    dt = dt.tz_convert(tzlocal()).tz_localize(None)
+    return pd.DataFrame({
+        'datetime': dt,
+        'open': chunk['o'],
+        'high': chunk['h'],
+        'low': chunk['l'],
+        'close': chunk['c'],
+        'volume': chunk['qv']
+    })
+
+
+def empty_ohlcv_frame() -> pd.DataFrame:
+    """Get the OHLCV feed frame of no klines, which fixes the schema of an empty file"""
+    chunk = {k: np.empty(0) for k in ('o', 'h', 'l', 'c', 'qv')}
+    chunk['s'] = np.empty(0, dtype=np.int64)
+    return ohlcv_frame(chunk)
+
+
+class CsvWriter:
+    """Write the OHLCV feed frames into CSV file"""
+
+    def __init__(self, fn: str):
+        self.f = open(fn, 'w', newline='')
+        self.f.write('datetime,open,high,low,close,volume\n')
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.f, header=False, index=False)
+
+    def close(self):
+        self.f.close()
+
+
+def import_pyarrow(fmt: str):
+    """Import pyarrow, an optional dependency of the parquet and feather feeds"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"The {fmt} feeds need pyarrow, install it by `pip install pyarrow`") from None
+    return pyarrow
+
+
+class ParquetWriter:
+    """Write the OHLCV feed frames into Parquet file, a row group per frame"""
+
+    def __init__(self, fn: str):
+        self.pq = import_pyarrow('parquet').parquet
+        self.fn = fn
+        self.writer = None
+
+    def write(self, df: pd.DataFrame):
+        import pyarrow as pa
+        t = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.fn, t.schema)
+        self.writer.write_table(t)
+
+    def close(self):
+        if self.writer is None:
+            self.write(empty_ohlcv_frame())
+        self.writer.close()
+
+
+class FeatherWriter:
+    """Write the OHLCV feed frames into Feather (Arrow IPC) file"""
+
+    def __init__(self, fn: str):
+        self.pa = import_pyarrow('feather')
+        self.fn = fn
+        self.writer = None
+
+    def write(self, df: pd.DataFrame):
+        batch = self.pa.RecordBatch.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pa.ipc.new_file(self.fn, batch.schema)
+        self.writer.write_batch(batch)
+
+    def close(self):
+        if self.writer is None:
+            self.write(empty_ohlcv_frame())
+        self.writer.close()
+
+
+# The OHLCV feed writers by format
+OHLCV_WRITERS = {
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+    'feather': FeatherWriter
+}
+
+
+# The process-wide kline dbs keyed by (path, symbol, readonly), from the
+# least recently used
+_klinedbs = OrderedDict()
+_klinedbs_lock = threading.Lock()
+
+
+def configure_klinedb(readonly: bool | None = None, mmap_size: int | None = None,
+                      cache_size: int | None = None, max_open: int | None = None):
+    """Configure the options of the default kline dbs"""
+    if readonly is not None:
+        KLINEDB_OPTIONS['readonly'] = readonly
+    if mmap_size is not None:
+        KLINEDB_OPTIONS['mmap_size'] = mmap_size
+    if cache_size is not None:
+        KLINEDB_OPTIONS['cache_size'] = cache_size
+    if max_open is not None:
+        KLINEDB_OPTIONS['max_open'] = max_open
+    return KLINEDB_OPTIONS
+
+
+def get_default_klinedb(symbol: str, readonly: bool | None = None):
+    """Get the kline db of a symbol from the process-wide registry
+
+    The db and its engine are created once and reused by all the loads.
+    Only the `max_open` recently used dbs are kept, the engine of an evicted
+    one is disposed, which releases its connection and page cache.
+    """
+    if readonly is None:
+        readonly = KLINEDB_OPTIONS['readonly']
+    key = (BINANCE_FUTURES_KLINE_DB, symbol.strip().upper(), readonly)
+    with _klinedbs_lock:
+        db = _klinedbs.get(key)
+        if db is not None:
+            KLINEDB_STATS['hits'] += 1
+            _klinedbs.move_to_end(key)
+            return db
+        db = KlineDb(symbol, path=BINANCE_FUTURES_KLINE_DB, readonly=readonly,
+                     mmap_size=KLINEDB_OPTIONS['mmap_size'],
+                     cache_size=KLINEDB_OPTIONS['cache_size'])
+        _klinedbs[key] = db
+        while len(_klinedbs) > max(KLINEDB_OPTIONS['max_open'], 1):
+            _, evicted = _klinedbs.popitem(last=False)
+            evicted.dispose()
+            KLINEDB_STATS['evictions'] += 1
+        return db
+
+
+def dispose_klinedbs(close: bool = True):
+    """Clear the registry of kline dbs
+
+    A forked process should use close=False, which leaves the connections
+    of the parent process alone.
+    """
+    with _klinedbs_lock:
+        for db in _klinedbs.values():
+            db.dispose(close=close)
+        _klinedbs.clear()
+
+
+def klinedb_stats() -> dict:
+    """Get the counters of kline dbs, engines and connections"""
+    return dict(KLINEDB_STATS, registered=len(_klinedbs))
+
+
+def init_export_worker(options: dict):
+    """Initialize a worker process of the exports
+
+    Like the workers of the engine, it does not share the db connections of
+    the parent process.
+    """
+    dispose_klinedbs(close=False)
+    configure_klinedb(**options)
 
 
 def export_ohlcv_feed(
@@ -165,10 +579,33 @@ def export_ohlcv_feed(
         interval: str, 
         start: datetime | None = None, 
         end: datetime | None = None, 
-        skip_if_exists: bool = True
+        skip_if_exists: bool = True,
+        fmt: str = 'csv'
     ):
     db = get_default_klinedb(symbol)
     return db.export_ohlcv_file(symbol, interval, 
-                                start=start, end=end, skip_if_exists=skip_if_exists)
+                                start=start, end=end, skip_if_exists=skip_if_exists, fmt=fmt)
+
+
+def export_ohlcv_feeds(
+        symbols: list,
+        interval: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        skip_if_exists: bool = True,
+        fmt: str = 'csv',
+        workers: int = 1
+    ):
+    """Export the OHLCV feeds of many symbols, in parallel by worker processes
+
+    Returns:
+        the exported files in the order of symbols.
+    """
+    args = (repeat(interval), repeat(start), repeat(end), repeat(skip_if_exists), repeat(fmt))
+    if workers > 1 and len(symbols) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_export_worker,
+                                 initargs=(dict(KLINEDB_OPTIONS),)) as executor:
+            return list(executor.map(export_ohlcv_feed, symbols, *args))
+    return list(map(export_ohlcv_feed, symbols, *args))
 
 
@@ -5,19 +5,70 @@ The engine runs according to the configuration file which will include:
     - the strategies and their params
     - the output result files
     - the plots
+    - the metrics of a strategy, e.g. `metrics: ['Total Return [%]', 'Max Drawdown [%]']`
+      only computes these metrics and the plotted ones, all by default
+    - the portfolios of a strategy are saved for `--show` by `save_portfolios: true`,
+      see `backtest.portfolios`
+    - the walk-forward mode of a strategy, see `backtest.walkforward`
+    - the adaptive parameter search of a strategy, see `backtest.search`
+    - the panel mode of a strategy, `panel: true` simulates all symbols as
+      the columns of one portfolio, `panel_size` limits the symbols of a pass
+    - the kline cache, e.g.
+
+        - cache: {
+            enabled: true,
+            max_memory: 2GB,
+            disk_dir: D:\\data\\binance\\cache
+          }
+
+      the `disk_dir` enables the columnar on-disk kline cache, and each
+      worker process has its own `max_memory`.
+    - the distributed work queue on a shared filesystem, see `backtest.workqueue`
+    - the live updates of the results by the new klines, see `backtest.live`
+    - the kline catalog, which skips the symbols without enough bars and
+      runs the work units with more bars first, see `backtest.catalog`
+    - the kline db options, e.g.
+
+        - db: {
+            readonly: true,
+            mmap_size: 256MB,
+            cache_size: 64MB,
+            max_open: 32
+          }
+
+      the `mmap_size` and the `cache_size` pragmas are the sqlite defaults
+      unless given, and they apply to each of the `max_open` dbs kept open
+      by a worker process.
 """
 
 
 import os
+import time
 import logging
+from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
 
-from backtest.base import Runner
-from backtest.plot import BoxPlot
+from backtest.cache import configure_cache, kline_cache
+from backtest.columnar import configure_columnar_cache
+from backtest.db import (
+    get_default_klinedb, configure_klinedb, dispose_klinedbs, klinedb_stats
+)
+from backtest.log import create_log
+from backtest.metrics import compute_stats
+from backtest.portfolios import PortfolioCache
+from backtest.store import ResultStore, make_key
+from backtest.timing import profiler, configure_profiler, span
 from backtest.utils import (
-    load_yaml_config, read_file, import_class
+    load_yaml_config, read_file, import_class, parse_size, parse_seconds
 )
 
+# The strategies, the plots, the search and the walk-forward import vectorbt,
+# numba or matplotlib, so they are only imported on the paths which use them
+if TYPE_CHECKING:
+    from backtest.base import Runner
+
 
 log = logging.getLogger(__name__)
 
@@ -53,53 +104,632 @@ class EngineConfig:
         # Add strategy
         for s in cfgs.get('strategies', []):
             self.strategies.append(s)
+        # The kline cache options
+        self.set('cache', cfgs.get('cache', {}))
+        # The kline db options
+        self.set('db', cfgs.get('db', {}))
+        # The work queue options
+        self.set('queue', cfgs.get('queue', {}))
+        # The kline catalog options
+        self.set('catalog', cfgs.get('catalog', {}))
         return self
 
 
 
+def configure_caches(enabled: bool = True, max_bytes: int | None = None, disk_dir: str | None = None):
+    configure_cache(enabled=enabled, max_bytes=max_bytes)
+    configure_columnar_cache(disk_dir)
+
+
+def get_coverage(token: str, interval: str) -> tuple:
+    """Get the open time of the latest kline of a token and the rows, or (0, 0) if unknown"""
+    try:
+        return get_default_klinedb(token).get_coverage(interval)
+    except Exception:
+        return 0, 0
+
+
+def init_worker(cache_options: dict, db_options: dict, profile: bool = False):
+    """Initialize a worker process of the engine"""
+    create_log("backtest")
+    configure_profiler(enabled=profile)
+    # Do not share the db connections of the parent process
+    dispose_klinedbs(close=False)
+    configure_klinedb(**db_options)
+    configure_caches(**cache_options)
+
+
+def save_portfolio(runner: "Runner", token: str, pf, keys: dict, single: bool = False):
+    """Save the portfolio of a token if `save_portfolios` of the strategy"""
+    if not runner.get('save_portfolios') or keys is None:
+        return
+    try:
+        PortfolioCache(runner.get_portfolio_dir()).save(token, pf, keys, single=single)
+    except Exception as ex:
+        log.warning('save portfolio %s failed: %s', token, ex)
+
+
+def run_token(runner: "Runner", token: str, param_list: list, keys: dict | None = None) -> tuple:
+    """Run backtest for a token on all the parameters, the work unit of the engine
+
+    The `keys` are the result keys of the labels to save the portfolios.
+
+    Returns:
+        (token, stats, errors, spans), the stats and the errors are keyed by
+        label, and the spans are the timing of the unit if profiling.
+    """
+    stats, errors = dict(), dict()
+    names = runner.get_metrics()
+    if runner.supports_batch():
+        # All parameter sets of a group are the columns of one portfolio
+        for group in runner.group_parameters(param_list):
+            labels = [runner.create_label(**params) for params in group]
+            try:
+                log.info('backtest %s on %d parameters ...', token, len(group))
+                with profiler.context(symbol=token, label=','.join(labels)):
+                    with span('run'):
+                        pf = runner.run_batch(token, group)
+                    with span('stats'):
+                        df = compute_stats(pf, names)
+                # A group of one set of parameters may give a portfolio of one
+                # column named by the symbol
+                single = pf.wrapper.ndim == 1
+                save_portfolio(runner, token, pf, keys and {label: keys[label] for label in labels},
+                               single=single)
+                for label in labels:
+                    stats[label] = df.iloc[0] if single else df.loc[label]
+            except Exception as ex:
+                for label in labels:
+                    errors[label] = f'{type(ex).__name__}: {ex}'
+    else:
+        for params in param_list:
+            label = runner.create_label(**params)
+            try:
+                log.info('backtest %s on %s ...', token, params)
+                with profiler.context(symbol=token, label=label):
+                    with span('run'):
+                        pf = runner.run(token, **params)
+                    with span('stats'):
+                        stats[label] = pf.stats() if names is None else compute_stats(pf, names).iloc[0]
+                save_portfolio(runner, token, pf, keys and {label: keys[label]}, single=True)
+            except Exception as ex:
+                errors[label] = f'{type(ex).__name__}: {ex}'
+    return token, stats, errors, profiler.drain()
+
+
 class BacktestEngine:
     """The Backtest Engine"""
 
-    def __init__(self, fp: str):
+    def __init__(self, fp: str, use_cache: bool = True, workers: int = 1, force: bool = False,
+                 profile: bool = False):
         self.cfg = EngineConfig(fp)
+        self.workers = workers
+        self.force = force
+        self.profile = profile
+        configure_profiler(enabled=profile)
+        cache = self.cfg.get('cache', {})
+        max_memory = cache.get('max_memory')
+        self.cache_options = dict(
+            enabled=use_cache and cache.get('enabled', True),
+            max_bytes=parse_size(max_memory) if max_memory is not None else None,
+            disk_dir=cache.get('disk_dir') if use_cache else None
+        )
+        configure_caches(**self.cache_options)
+        db = self.cfg.get('db', {})
+        self.db_options = dict(
+            readonly=db.get('readonly'),
+            mmap_size=parse_size(db['mmap_size']) if 'mmap_size' in db else None,
+            cache_size=parse_size(db['cache_size']) if 'cache_size' in db else None,
+            max_open=db.get('max_open')
+        )
+        configure_klinedb(**self.db_options)
+        # The kline catalog of the symbols, and the (token, interval) skipped
+        # for the current strategy, see `_screen`
+        self.catalog = None
+        self.skipped = dict()
+
+    def refresh_catalog(self):
+        """Refresh the kline catalog of the symbols if `catalog` in the config"""
+        cfg = self.cfg.get('catalog')
+        if not cfg:
+            return None
+        from backtest.catalog import KlineCatalog, get_default_catalog_file
+
+        if self.catalog is None:
+            self.catalog = KlineCatalog(cfg.get('path') or get_default_catalog_file())
+        with span('catalog'):
+            self.catalog.refresh(self.cfg.symbols, workers=self.workers)
+        return self.catalog
 
-    def _exec(self, runner, tokens: list, **params):
-        """"execute backtest for all tokens via a group of parameters
+    def _screen(self, runner, tokens: list) -> list:
+        """Skip the tokens without `min_bars` bars since the `start` by the kline catalog
+
+        The `min_bars` of the strategy config overrides the one of the
+        catalog. The plans of `_exec` and `_exec_panel` skip a token on an
+        interval, the other modes only skip the tokens without any interval.
+        The skipped ones are written into `skipped.csv` of the work dir.
+
+        Returns:
+            the tokens with any interval to backtest.
+        """
+        self.skipped = dict()
+        if self.catalog is None:
+            return tokens
+        min_bars = runner.get('min_bars', self.cfg.get('catalog').get('min_bars', 1))
+        start = runner.get_start_ms()
+        intervals = runner.get('intervals', [])
+        for token in tokens:
+            for interval in intervals:
+                reason = self.catalog.check(token, interval, start=start, min_bars=min_bars)
+                if reason is not None:
+                    self.skipped[(token, interval)] = reason
+        fp = os.path.join(runner.get_work_dir(), 'skipped.csv')
+        pd.DataFrame([(token, interval, reason) for (token, interval), reason in self.skipped.items()],
+                     columns=['Token', 'Interval', 'Reason']).to_csv(fp, index=False)
+        selected = [
+            token for token in tokens
+            if any((token, interval) not in self.skipped for interval in intervals)
+        ]
+        if self.skipped:
+            log.warning('%d of %d tokens skipped on some intervals, see %s',
+                        len({token for token, _ in self.skipped}), len(tokens), fp)
+        return selected
+
+    def _bars(self, runner, token: str, param_list: list) -> int:
+        """Count the bars of a token on the parameters by the kline catalog"""
+        start = runner.get_start_ms()
+        return sum(self.catalog.bars(token, params['interval'], start=start) for params in param_list)
+
+    def _plan(self, runner, store: ResultStore, tokens: list, param_list: list):
+        """Find the results to compute
+
+        Returns:
+            (keys, units), the keys maps (token, label) to the key columns of
+            the result, and the units are (token, parameters) not computed yet.
+        """
+        keys = self._keys(runner, tokens, param_list)
+        computed = set() if self.force else store.exists([k['key'] for k in keys.values()])
+        units = list()
+        for token in tokens:
+            pending = [
+                params for params in param_list
+                if keys[(token, runner.create_label(**params))]['key'] not in computed
+                and (token, params.get('interval')) not in self.skipped
+            ]
+            if pending:
+                units.append((token, pending))
+        if self.catalog is not None:
+            # The units with more bars first, so the pool does not wait for a
+            # long one at the end
+            units.sort(key=lambda unit: self._bars(runner, *unit), reverse=True)
+        log.info('%d of %d tokens to backtest', len(units), len(tokens))
+        return keys, units
+
+    def _keys(self, runner, tokens: list, param_list: list) -> dict:
+        """Map (token, label) to the key columns of the current result"""
+        strategy = runner.__class__.__name__
+        code_hash = runner.get_code_hash()
+        keys = dict()
+        for token in tokens:
+            coverages = dict()
+            for params in param_list:
+                label = runner.create_label(**params)
+                interval = params.get('interval', '')
+                if interval not in coverages:
+                    coverages[interval] = get_coverage(token, interval)
+                watermark, rows = coverages[interval]
+                keys[(token, label)] = dict(
+                    key=make_key(strategy, label, token, interval, watermark, code_hash, rows=rows),
+                    strategy=strategy,
+                    label=label,
+                    symbol=token,
+                    interval=interval,
+                    watermark=watermark,
+                    code_hash=code_hash
+                )
+        return keys
+
+    def _exec(self, runner, tokens: list, param_list: list, failures: list | None = None,
+              export: bool = True):
+        """"execute backtest for all tokens via all the parameters
 
         Args:
             runner: callable, the strategy instance
             tokens: list, tokens feed into the runner
-            params: dict, a set of strategy parameters
-        
-        We execute backtesting for all symbols for a given set of parameters.
+            param_list: list, all sets of strategy parameters
+            failures: list, collect the failures instead of writing them, so
+                the caller writes the failures of many runs at once
+            export: bool, export the results into the `output` CSV files,
+                the caller of partial runs exports once at the end
+
+        Each token is a work unit running all the parameters, so its data is
+        loaded once. With `workers` > 1, the units are fanned out to a process
+        pool. The failures are logged and written into `failures.csv` of the
+        work dir.
+
+        The results are kept in the result store of the work dir, and only the
+        parameters which are new or stale are run again unless `force`.
+
+        Returns:
+            the key columns of the results keyed by (token, label).
         """
-        # The output CSV headers
-        headers = ['Start', 'End', 'Period', 'Start Value', 'End Value', 'Total Return [%]', 'Benchmark Return [%]', 
-                'Max Gross Exposure [%]', 'Total Fees Paid', 'Max Drawdown [%]', 'Max Drawdown Duration', 'Total Trades', 
-                'Total Closed Trades', 'Total Open Trades', 'Open Trade PnL', 'Win Rate [%]', 'Best Trade [%]', 'Worst Trade [%]', 
-                'Avg Winning Trade [%]', 'Avg Losing Trade [%]', 'Avg Winning Trade Duration', 'Avg Losing Trade Duration', 
-                'Profit Factor', 'Expectancy', 'Sharpe Ratio', 'Calmar Ratio', 'Omega Ratio', 'Sortino Ratio']
-        
-        df = pd.DataFrame(columns=headers)
-
-        # Run backtest for a given symbol + a set of parameters
-        for token in tokens:
+        store = ResultStore(runner.get_result_file())
+        with span('plan'):
+            keys, units = self._plan(runner, store, tokens, param_list)
+        collected = failures
+        if failures is None:
+            failures = list()
+
+        def unit_keys(token: str, pending: list) -> dict:
+            labels = [runner.create_label(**params) for params in pending]
+            return {label: keys[(token, label)]['key'] for label in labels}
+
+        def collect(token: str, stats: dict, errors: dict, spans: list):
+            profiler.extend(spans)
+            for label, values in stats.items():
+                store.add(keys[(token, label)], values)
+            for label, error in errors.items():
+                log.warning('backtest %s@%s failed: %s', token, label, error)
+                failures.append((token, label, error))
+
+        if self.cfg.get('queue') and units:
+            shards = [(token, pending, unit_keys(token, pending)) for token, pending in units]
+            self._exec_queue(runner, shards, collect)
+        elif self.workers > 1 and len(units) > 1:
+            chunksize = max(1, len(units) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=init_worker,
+                                     initargs=(self.cache_options, self.db_options,
+                                               self.profile)) as executor:
+                results = executor.map(run_token, repeat(runner),
+                                       [token for token, _ in units],
+                                       [pending for _, pending in units],
+                                       [unit_keys(token, pending) for token, pending in units],
+                                       chunksize=chunksize)
+                for result in results:
+                    collect(*result)
+        else:
+            for token, pending in units:
+                collect(*run_token(runner, token, pending, unit_keys(token, pending)))
+        with span('store'):
+            store.flush()
+
+        if export:
+            with span('export'):
+                self._export(runner, store, keys, tokens, param_list)
+        if collected is None:
+            self._write_failures(runner, failures)
+        return keys
+
+    def _write_failures(self, runner, failures: list, what: str = 'backtests'):
+        """Write the (token, label, error) of the failed backtests into `failures.csv`"""
+        fp = os.path.join(runner.get_work_dir(), 'failures.csv')
+        pd.DataFrame(failures, columns=['Token', 'Label', 'Error']).to_csv(fp, index=False)
+        if failures:
+            log.warning('%d %s failed, see %s', len(failures), what, fp)
+
+    def _exec_queue(self, runner, units: list, collect):
+        """"execute the work units by the workers of the work queue
+
+        Args:
+            runner: callable, the strategy instance
+            units: list, the (token, parameters, result keys) of the units
+            collect: callable, merge the results of a unit
+
+        The units are enqueued in shards of `shard_size` tokens, then the
+        results of the finished shards are merged until all are finished.
+        """
+        from backtest.workqueue import WorkQueue, get_owner, run_unit
+
+        cfg = self.cfg.get('queue')
+        shard_size = cfg.get('shard_size', 4)
+        poll = parse_seconds(cfg.get('poll', 2))
+        queue = WorkQueue(cfg['path'])
+        options = dict(cache_options=self.cache_options, db_options=self.db_options,
+                       profile=self.profile)
+        shards = [units[i:i + shard_size] for i in range(0, len(units), shard_size)]
+        job = queue.submit(runner, shards, options, lease=parse_seconds(cfg.get('lease', '5m')),
+                           max_attempts=cfg.get('max_attempts', 3))
+        log.info('job %d enqueued %d tokens in %d units into %s', job, len(units), len(shards),
+                 cfg['path'])
+        owner = get_owner()
+        try:
+            while True:
+                # Nothing else fails the expired units while no worker claims
+                queue.expire(job)
+                for status, shard, results, error in queue.collect(job):
+                    if status == 'done':
+                        for result in results:
+                            collect(*result)
+                    else:
+                        for token, _, keys in shard:
+                            collect(token, dict(), {label: error for label in keys}, list())
+                counts = queue.progress(job)
+                remaining = sum(n for status, n in counts.items() if status != 'merged')
+                if remaining == 0:
+                    break
+                # The coordinator is a worker of its job too
+                unit = queue.claim(owner, job=job) if cfg.get('work', True) else None
+                if unit is not None:
+                    run_unit(queue, unit, owner, runner)
+                else:
+                    log.info('job %d: %s', job, counts)
+                    time.sleep(poll)
+        finally:
+            queue.remove(job)
+
+    def _exec_live(self, runner, tokens: list, param_list: list):
+        """"update the backtests of all tokens by their new bars
+
+        Args:
+            runner: callable, the strategy instance with `live_kernel`
+            tokens: list, tokens feed into the runner
+            param_list: list, all sets of strategy parameters
+
+        Each token is a work unit like `_exec`, and the results of the
+        current watermarks are written into the result store, so `exec`
+        takes them as computed. The checkpoints are saved by this process.
+        """
+        from backtest.live import CheckpointStore, live_token
+
+        store = ResultStore(runner.get_result_file())
+        checkpoints = CheckpointStore(runner.get_checkpoint_file())
+        with span('plan'):
+            keys = self._keys(runner, tokens, param_list)
+        failures = list()
+
+        def collect(token: str, stats: dict, errors: dict, token_checkpoints: list, spans: list):
+            profiler.extend(spans)
+            for label, values in stats.items():
+                store.add(keys[(token, label)], values)
+            with span('checkpoint'):
+                checkpoints.save(token_checkpoints)
+            for label, error in errors.items():
+                log.warning('update %s@%s failed: %s', token, label, error)
+                failures.append((token, label, error))
+
+        if self.workers > 1 and len(tokens) > 1:
+            chunksize = max(1, len(tokens) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=init_worker,
+                                     initargs=(self.cache_options, self.db_options,
+                                               self.profile)) as executor:
+                results = executor.map(live_token, repeat(runner), tokens, repeat(param_list),
+                                       chunksize=chunksize)
+                for result in results:
+                    collect(*result)
+        else:
+            for token in tokens:
+                collect(*live_token(runner, token, param_list))
+        with span('store'):
+            store.flush()
+
+        with span('export'):
+            self._export(runner, store, keys, tokens, param_list)
+        self._write_failures(runner, failures, what='updates')
+        return keys
+
+    def _exec_panel(self, runner, tokens: list, param_list: list):
+        """"execute backtest for all tokens via all the parameters in panel
+
+        Args:
+            runner: callable, the strategy instance supporting `run_panel`
+            tokens: list, tokens feed into the runner
+            param_list: list, all sets of strategy parameters
+
+        For each set of parameters, the tokens are split into panels of
+        `panel_size` of the strategy config, and each panel is loaded into
+        one aligned price frame. Note the tokens with shorter history are
+        padded by NaN, so the period and the ratios of their stats span the
+        whole aligned index and depend on the other tokens of the panel. So
+        the panels are fixed by the tokens, the keys of the members of a
+        panel are a part of their result keys, and a panel is run again
+        as a whole once any of its results is not computed. The tokens
+        without bars since the `start` are not in any panel, and a token
+        skipped by `run_panel` is written into `failures.csv`.
+        """
+        from backtest.resample import align_start
+
+        store = ResultStore(runner.get_result_file())
+        size = runner.get('panel_size', 0) or len(tokens)
+        names = runner.get_metrics()
+        start = runner.get_start_ms()
+        keys, panels = dict(), list()
+        with span('plan'):
+            for params in param_list:
+                interval = params.get('interval')
+                label = runner.create_label(**params)
+                members = [token for token in tokens if (token, interval) not in self.skipped]
+                token_keys = self._keys(runner, members, [params])
+                # The tokens without bars since the start, e.g. the delisted
+                # ones, are not in any panel, as `run_panel` skips them. The
+                # last bar opens at the bucket of the watermark.
+                members = [
+                    token for token in members
+                    if token_keys[(token, label)]['watermark'] > 0
+                    and align_start(token_keys[(token, label)]['watermark'], interval) >= start
+                ]
+                if self.catalog is not None:
+                    # The tokens of similar history are in one panel, which pads less
+                    members.sort(key=lambda token: self.catalog.find(token, interval)['first'])
+                for i in range(0, len(members), size):
+                    chunk = members[i:i + size]
+                    chunk_keys = self._panel_keys({(token, label): token_keys[(token, label)]
+                                                   for token in chunk})
+                    keys.update(chunk_keys)
+                    panels.append((params, chunk, chunk_keys))
+            computed = set() if self.force else store.exists([k['key'] for k in keys.values()])
+        pending = [
+            (params, chunk, chunk_keys) for params, chunk, chunk_keys in panels
+            if any(k['key'] not in computed for k in chunk_keys.values())
+        ]
+        log.info('%d of %d panels to backtest', len(pending), len(panels))
+        failures = list()
+        for params, chunk, chunk_keys in pending:
+            label = runner.create_label(**params)
             try:
-                log.info('backtest %s on %s ...', token, params)
-                pf = runner.run(token, **params)
-                df.loc[token] = pf.stats()
+                log.info('backtest %d tokens on %s ...', len(chunk), params)
+                with profiler.context(symbol=f'{chunk[0]}...({len(chunk)})', label=label):
+                    with span('run'):
+                        pf = runner.run_panel(chunk, **params)
+                    with span('stats'):
+                        df = compute_stats(pf, names)
+                for token, values in df.iterrows():
+                    store.add(chunk_keys[(token, label)], values)
+                # The tokens skipped by `run_panel` are failures, not dropped silently
+                missing = [token for token in chunk if token not in df.index]
+                if missing:
+                    log.warning('backtest %s@%s failed: no bars', ','.join(missing), label)
+                    failures.extend((token, label, 'no bars since the start') for token in missing)
             except Exception as ex:
-                pass
-        
-        # Write into CSV file
-        df.index.name = 'Token'
-        df = df.sort_values(by='Total Return [%]', ascending=False)
-        fp = runner.get_output_file(**params)
-        df.to_csv(fp)
-
-    def show(self, runner, tokens: list, **params):
+                error = f'{type(ex).__name__}: {ex}'
+                log.warning('backtest %s...(%d)@%s failed: %s', chunk[0], len(chunk), label, error)
+                failures.extend((token, label, error) for token in chunk)
+        with span('store'):
+            store.flush()
+        with span('export'):
+            self._export(runner, store, keys, tokens, param_list)
+        self._write_failures(runner, failures)
+
+    def _panel_keys(self, keys: dict) -> dict:
+        """Key the results of the tokens of a panel by the panel"""
+        keys = {k: dict(v) for k, v in keys.items()}
+        # The stats of a token depend on the tokens and the klines aligned with it
+        panel = ','.join(k['key'] for k in keys.values())
+        for k in keys.values():
+            k['key'] = make_key(k['strategy'], k['label'], k['symbol'], k['interval'], k['watermark'],
+                                k['code_hash'], panel=panel)
+        return keys
+
+    def _exec_walk_forward(self, runner, tokens: list, param_list: list):
+        """"execute the walk-forward optimization for all tokens
+
+        Args:
+            runner: callable, the strategy instance with `signal_kernel`
+            tokens: list, tokens feed into the runner
+            param_list: list, all sets of strategy parameters
+
+        Each token is a work unit like `_exec`, the folds are written into
+        `walk_forward.csv` and the out of sample summary of each token into
+        `walk_forward_summary.csv` of the work dir. The failures are written
+        into `failures.csv` like `_exec`, labeled by their intervals.
+        """
+        if not runner.supports_kernel():
+            raise ConfigError(f"{runner.__class__.__name__} has no signal kernel for walk forward")
+        from backtest.walkforward import walk_forward_token, summarize
+        rows, failures = list(), list()
+        if self.catalog is not None:
+            tokens = sorted(tokens, key=lambda token: self._bars(runner, token, param_list),
+                            reverse=True)
+
+        def collect(token: str, token_rows: list, errors: dict, spans: list):
+            profiler.extend(spans)
+            rows.extend(token_rows)
+            for interval, error in errors.items():
+                log.warning('walk forward %s@%s failed: %s', token, interval, error)
+                failures.append((token, interval, error))
+
+        if self.workers > 1 and len(tokens) > 1:
+            chunksize = max(1, len(tokens) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=init_worker,
+                                     initargs=(self.cache_options, self.db_options,
+                                               self.profile)) as executor:
+                results = executor.map(walk_forward_token, repeat(runner), tokens,
+                                       repeat(param_list), chunksize=chunksize)
+                for result in results:
+                    collect(*result)
+        else:
+            for token in tokens:
+                collect(*walk_forward_token(runner, token, param_list))
+
+        work_dir = runner.get_work_dir()
+        df = pd.DataFrame(rows)
+        df.to_csv(os.path.join(work_dir, 'walk_forward.csv'), index=False)
+        summarize(df).to_csv(os.path.join(work_dir, 'walk_forward_summary.csv'))
+        # The label of a failure is the interval of the walk forward
+        self._write_failures(runner, failures, what='walk forwards')
+        log.info('%d folds of %d tokens walked forward', len(df), len(tokens))
+
+    def _exec_search(self, runner, tokens: list):
+        """"execute the adaptive parameter search for all tokens
+
+        Each evaluation is a `_exec` of the parameter sets on the tokens, the
+        evaluated points are written into `search_results.csv` and the
+        failures of all the evaluations into `failures.csv` of the work dir.
+        The evaluations run on subsets of the tokens, so only the results of
+        the best parameter sets are exported at the end, over all tokens.
+
+        Returns:
+            the parameter sets of the best points.
+        """
+        store = ResultStore(runner.get_result_file())
+        failures = list()
+
+        def evaluate(param_list: list, eval_tokens: list) -> pd.DataFrame:
+            keys = self._exec(runner, eval_tokens, param_list, failures=failures, export=False)
+            return store.load(keys=[k['key'] for k in keys.values()])
+
+        from backtest.search import create_search
+        search = create_search(runner)
+        df = search.run(evaluate, tokens)
+        # A failed backtest is not stored, so it fails again in a later evaluation
+        self._write_failures(runner, list(dict.fromkeys(failures)))
+        df.to_csv(os.path.join(runner.get_work_dir(), 'search_results.csv'), index=False)
+        log.info('%d parameter sets searched', len(df))
+        if len(df) == 0:
+            return []
+        best = df.head(runner.get('search').get('top', 10))
+        best = [
+            {k: v for k, v in row.items() if k not in ('label', 'step', 'symbols', 'score')}
+            for row in best.to_dict('records')
+        ]
+        with span('export'):
+            self._export(runner, store, self._keys(runner, tokens, best), tokens, best)
+        return best
+
+    def _export(self, runner, store: ResultStore, keys: dict, tokens: list, param_list: list):
+        """Export the results of each set of parameters into CSV file
+
+        It is skipped if there is no `output` or `export_csv` is false in
+        the strategy config.
+        """
+        if not runner.get('output') or not runner.get('export_csv', True):
+            return
+        df = store.load(keys=[k['key'] for k in keys.values()])
+        for params in param_list:
+            label = runner.create_label(**params)
+            fp = runner.get_output_file(**params)
+            store.export_csv(df[df['label'] == label], fp, symbols=tokens,
+                             names=runner.get_metrics())
+
+    def top_tokens(self, runner, tokens: list, label: str, top: int,
+                   metric: str = 'Total Return [%]') -> list:
+        """Get the top tokens of a label by a metric of the computed results"""
+        store = ResultStore(runner.get_result_file())
+        df = store.load(strategy=runner.__class__.__name__, code_hash=runner.get_code_hash(),
+                        labels=[label])
+        df = df[df['symbol'].isin(tokens)].sort_values(metric, ascending=False)
+        return df['symbol'].head(top).tolist()
+
+    def show(self, runner, tokens: list, top: int | None = None,
+             metric: str = 'Total Return [%]', **params):
+        """Show the portfolios of the tokens on a set of parameters
+
+        The portfolios saved by `exec` are loaded while they are current,
+        otherwise the backtests are run again. With `top`, only the top
+        tokens by the metric are shown.
+        """
+        label = runner.create_label(**params)
+        if top:
+            tokens = self.top_tokens(runner, tokens, label, top, metric)
+        keys = self._keys(runner, tokens, [params])
+        cache = PortfolioCache(runner.get_portfolio_dir())
         for token in tokens:
-            pf = runner.run(token, **params)
+            with profiler.context(symbol=token, label=label), span('run'):
+                pf = cache.load(token, label, keys[(token, label)]['key'])
+                if pf is None:
+                    pf = runner.run(token, **params)
             # Note: we can choose subplots according to our requirement.
             # fig is subclass of plotly.graph_objects.Figure
             # fig = pf.plot(subplots=['orders', 'drawdowns', 'underwater'])
@@ -112,28 +742,113 @@ class BacktestEngine:
                 'xanchor': 'center',
                 'yanchor': 'top'
             })
-            fig.show()
+            with profiler.context(symbol=token, label=label), span('plot'):
+                fig.show()
 
-    def exec(self, dry_run: bool = False, show_only: bool = False):
-        if dry_run:
-            return
+    def warm_up(self):
+        """Compile the numba functions of the resampling and the strategies, see `backtest.warmup`"""
+        from backtest.warmup import warm_up_resample, warm_up_runner
+
+        t0 = time.perf_counter()
+        warm_up_resample()
         for one in self.cfg.strategies:
             s = one.get('strategy')
-            name, module = s['name'], s['module']
-            # Load the strategy class
-            log.info("Strategy: %s.%s", module, name)
+            log.info("Warm up %s.%s ...", s['module'], s['name'])
+            runner: "Runner" = import_class(s['module'], s['name'])(s.get('work_dir', '.'), s)
+            warm_up_runner(runner)
+        log.info("Warmed up in %.1fs", time.perf_counter() - t0)
+        if self.profile:
+            profiler.summary()
+
+    def create_runner(self, s: dict) -> "Runner":
+        """Create the runner of a strategy config and its working dir"""
+        name, module = s['name'], s['module']
+        # Load the strategy class
+        log.info("Strategy: %s.%s", module, name)
+        with profiler.context(label=module), span('import'):
             cls= import_class(module, name)
-            # Create working dir
-            work_dir = s.get('work_dir', '.')
-            if not os.path.exists(work_dir):
-                os.mkdir(work_dir)
-            # initialize the strategy
-            runner: Runner = cls(work_dir, s)
+        # Create working dir
+        work_dir = s.get('work_dir', '.')
+        if not os.path.exists(work_dir):
+            os.mkdir(work_dir)
+        # initialize the strategy
+        return cls(work_dir, s)
+
+    def live(self, every: str | None = None):
+        """Update the results by the new bars, then again every `every` if given
+
+        Only the plain backtests of the strategies with `live_kernel` are
+        updated, see `backtest.live`.
+        """
+        import schedule
+
+        runners = list()
+        for one in self.cfg.strategies:
+            runner = self.create_runner(one.get('strategy'))
+            if not runner.supports_live():
+                log.warning("%s has no live kernel, skipped", runner.__class__.__name__)
+            elif runner.get('search') or runner.get('walk_forward'):
+                log.warning("%s of search or walk forward is not updated live, skipped",
+                            runner.__class__.__name__)
+            else:
+                runners.append(runner)
+
+        def update():
+            t0 = time.perf_counter()
+            self.refresh_catalog()
+            for runner in runners:
+                tokens = self._screen(runner, self.cfg.symbols)
+                self._exec_live(runner, tokens, runner.iter_parameters())
+                if self.profile:
+                    profiler.write(os.path.join(runner.get_work_dir(), 'profile'))
+                    profiler.summary()
+                profiler.drain()
+            log.info("Updated in %.1fs", time.perf_counter() - t0)
+
+        update()
+        if every is None:
+            return
+        schedule.every(int(parse_seconds(every))).seconds.do(update)
+        log.info("Update every %s ...", every)
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+
+    def exec(self, dry_run: bool = False, show_only: bool = False, top: int | None = None,
+             metric: str = 'Total Return [%]'):
+        if dry_run:
+            log.info("%d symbols, %d strategies", len(self.cfg.symbols), len(self.cfg.strategies))
+            return
+        self.refresh_catalog()
+        for one in self.cfg.strategies:
+            runner = self.create_runner(one.get('strategy'))
+            work_dir = runner.get_work_dir()
+            tokens = self._screen(runner, self.cfg.symbols)
             # Iterate all possible backtesting parameters
-            for params in runner.iter_parameters():
-                if show_only:
-                    self.show(runner, self.cfg.symbols, **params)
-                else:
-                    self._exec(runner, self.cfg.symbols, **params)
+            if show_only:
+                for params in runner.iter_parameters():
+                    self.show(runner, tokens, top=top, metric=metric, **params)
+            elif runner.get('search'):
+                best = self._exec_search(runner, tokens)
+            elif runner.get('walk_forward'):
+                self._exec_walk_forward(runner, tokens, runner.iter_parameters())
+            elif runner.get('panel', False) and runner.supports_panel():
+                self._exec_panel(runner, tokens, runner.iter_parameters())
+            else:
+                self._exec(runner, tokens, runner.iter_parameters())
+            log.info("Kline cache: %s", kline_cache.stats())
+            log.info("Kline db: %s", klinedb_stats())
             # Create plots
-            BoxPlot(runner).create_plots()
\ No newline at end of file
+            if runner.get_plots() and not runner.get('walk_forward'):
+                with profiler.context(label='backtest.plot'), span('import'):
+                    from backtest.plot import BoxPlot
+                param_list = best if runner.get('search') else None
+                BoxPlot(runner, symbols=tokens, param_list=param_list,
+                        workers=self.workers).create_plots()
+            if self.profile:
+                fp = os.path.join(work_dir, 'profile')
+                profiler.write(fp)
+                profiler.summary()
+                log.info("Profile: %s.csv, %s.json", fp, fp)
+            # The spans of the next strategy
+            profiler.drain()
\ No newline at end of file
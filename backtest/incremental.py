@@ -0,0 +1,376 @@
+"""The incremental state of the signals and the portfolios
+
+A step kernel advances the state of many columns by the new bars only, so a
+live update is O(new bars) instead of O(history):
+
+    entries, exits = step(close, *params, signal, ring)
+    portfolio_step_nb(close, entries, exits, portfolio)
+
+    - close: 1-D float array, the new bars of one symbol
+    - params: 1-D arrays, the parameter of each column
+    - signal: 2-D float array of shape (columns, width), the indicator state
+    - ring: 3-D float array of shape (columns, window, depth), the values of
+      the last `window` bars, e.g. the running sums of the SMA
+    - portfolio: 2-D float array of shape (columns, PORTFOLIO_WIDTH)
+
+The states are updated in place. The step kernels reproduce the signal
+kernels of `backtest.kernels` bar by bar, and the portfolio follows the
+simulation of `Runner.simulate`, i.e. `vbt.Portfolio.from_signals` of all the
+cash without fees. `portfolio_stats` gives the metrics of `pf.stats()` from
+the portfolio state, and they are the same but for the rounding of the
+Sharpe ratio, whose variance is accumulated instead of taken in two passes.
+"""
+
+import numpy as np
+import pandas as pd
+from numba import njit
+from vectorbt.returns.nb import get_return_nb
+from vectorbt.utils.math_ import add_nb, is_close_nb, is_less_nb
+
+from backtest.metrics import STATS_HEADERS
+
+
+@njit(cache=True)
+def rolling_mean_step_nb(x, window, i, state, s, ring, r):
+    """Advance `rolling_mean_1d_nb` by the bar i
+
+    The running sum and NaN count are `state[s:s + 2]`, and their values of
+    the last `window` bars are `ring[:, r:r + 2]`.
+    """
+    if np.isnan(x):
+        state[s + 1] += 1
+    else:
+        state[s] = state[s] + x
+    k = i % window
+    if i < window:
+        window_len = i + 1 - state[s + 1]
+        window_cumsum = state[s]
+    else:
+        window_len = window - (state[s + 1] - ring[k, r + 1])
+        window_cumsum = state[s] - ring[k, r]
+    ring[k, r] = state[s]
+    ring[k, r + 1] = state[s + 1]
+    if window_len < window:
+        return np.nan
+    return window_cumsum / window_len
+
+
+@njit(cache=True)
+def crossed_above_step_nb(a, b, state, s):
+    """Advance `crossed_above_1d_nb`, the state is (was below, crossed ago)"""
+    if np.isnan(a) or np.isnan(b):
+        state[s + 1] = -1
+        state[s] = 0
+        return False
+    elif a > b:
+        if state[s] == 1:
+            state[s + 1] += 1
+            return state[s + 1] == 0
+        return False
+    elif a == b:
+        state[s + 1] = -1
+        return False
+    state[s + 1] = -1
+    state[s] = 1
+    return False
+
+
+# The (signal width, ring depth) of `sma_cross_step_nb`
+SMA_CROSS_STATE = (9, 4)
+
+
+@njit(cache=True)
+def sma_cross_step_nb(close, fast_n, slow_n, signal, ring):
+    """The step kernel of `sma_cross_nb`
+
+    The signal state is the bar count, the sums of the fast and the slow SMA,
+    and the crossings of the entries and the exits.
+    """
+    entries = np.empty((close.shape[0], len(fast_n)), dtype=np.bool_)
+    exits = np.empty((close.shape[0], len(fast_n)), dtype=np.bool_)
+    for j in range(len(fast_n)):
+        state = signal[j]
+        for t in range(close.shape[0]):
+            i = int(state[0])
+            fast = rolling_mean_step_nb(close[t], fast_n[j], i, state, 1, ring[j], 0)
+            slow = rolling_mean_step_nb(close[t], slow_n[j], i, state, 3, ring[j], 2)
+            entries[t, j] = crossed_above_step_nb(fast, slow, state, 5)
+            exits[t, j] = crossed_above_step_nb(slow, fast, state, 7)
+            state[0] = i + 1
+    return entries, exits
+
+
+# The (signal width, ring depth) of `rsi_threshold_step_nb`
+RSI_THRESHOLD_STATE = (6, 4)
+
+
+@njit(cache=True, error_model='numpy')
+def rsi_threshold_step_nb(close, window, min_rsi, max_rsi, signal, ring):
+    """The step kernel of `rsi_threshold_nb`
+
+    The signal state is the bar count, the last close, and the sums of the
+    gains and the losses.
+    """
+    entries = np.empty((close.shape[0], len(window)), dtype=np.bool_)
+    exits = np.empty((close.shape[0], len(window)), dtype=np.bool_)
+    for j in range(len(window)):
+        state = signal[j]
+        for t in range(close.shape[0]):
+            i = int(state[0])
+            delta = np.nan if i == 0 else close[t] - state[1]
+            up = 0. if delta < 0 else delta
+            down = np.abs(0. if delta > 0 else delta)
+            roll_up = rolling_mean_step_nb(up, window[j], i, state, 2, ring[j], 0)
+            roll_down = rolling_mean_step_nb(down, window[j], i, state, 4, ring[j], 2)
+            rsi = 100 - 100 / (1 + roll_up / roll_down)
+            entries[t, j] = rsi < min_rsi[j]
+            exits[t, j] = rsi > max_rsi[j]
+            state[1] = close[t]
+            state[0] = i + 1
+    return entries, exits
+
+
+# The fields of the portfolio state
+(
+    PF_BARS, PF_INIT_CASH, PF_CASH, PF_POSITION, PF_ENTRY_PRICE, PF_ENTRY_IDX, PF_VALUE,
+    PF_ORDER_CASH, PF_FIRST_CLOSE, PF_LAST_CLOSE, PF_BENCH_VALUE, PF_BENCH_GROWTH,
+    PF_MAX_EXPOSURE,
+    PF_DD_STARTED, PF_PEAK_IDX, PF_PEAK_VAL, PF_VALLEY_VAL, PF_MAX_DD, PF_MAX_DD_DURATION,
+    PF_CLOSED, PF_WINS, PF_LOSSES, PF_WIN_PNL, PF_LOSS_PNL, PF_WIN_RET, PF_LOSS_RET,
+    PF_BEST_RET, PF_WORST_RET, PF_WIN_DURATION, PF_LOSS_DURATION,
+    PF_RETURNS, PF_RET_SUM, PF_RET_MEAN, PF_RET_M2, PF_DOWN_SQ, PF_RET_POS, PF_RET_NEG,
+    PF_GROWTH, PF_GROWTH_MAX, PF_RET_MAX_DD
+) = range(40)
+
+PORTFOLIO_WIDTH = 40
+
+
+def create_portfolio_state(columns: int, init_cash: float) -> np.ndarray:
+    state = np.zeros((columns, PORTFOLIO_WIDTH), dtype=np.float64)
+    state[:, PF_INIT_CASH] = init_cash
+    state[:, PF_CASH] = init_cash
+    state[:, PF_VALUE] = init_cash
+    state[:, PF_BENCH_VALUE] = init_cash
+    state[:, PF_BENCH_GROWTH] = 1
+    state[:, [PF_FIRST_CLOSE, PF_LAST_CLOSE, PF_PEAK_VAL, PF_VALLEY_VAL, PF_MAX_DD,
+              PF_MAX_DD_DURATION, PF_BEST_RET, PF_WORST_RET]] = np.nan
+    state[:, PF_PEAK_IDX] = -1
+    state[:, PF_GROWTH] = 1
+    state[:, PF_GROWTH_MAX] = np.nan
+    return state
+
+
+@njit(cache=True)
+def record_drawdown_nb(state, duration):
+    dd = (state[PF_VALLEY_VAL] - state[PF_PEAK_VAL]) / state[PF_PEAK_VAL]
+    if np.isnan(state[PF_MAX_DD]) or dd < state[PF_MAX_DD]:
+        state[PF_MAX_DD] = dd
+    if np.isnan(state[PF_MAX_DD_DURATION]) or duration > state[PF_MAX_DD_DURATION]:
+        state[PF_MAX_DD_DURATION] = duration
+
+
+@njit(cache=True)
+def close_trade_nb(state, exit_price, i):
+    """Record the closed trade of the position, see `get_trade_stats_nb`"""
+    size = state[PF_POSITION]
+    entry_val = size * state[PF_ENTRY_PRICE]
+    pnl = add_nb(size * exit_price, -entry_val)
+    ret = pnl / entry_val
+    duration = i - state[PF_ENTRY_IDX]
+    state[PF_CLOSED] += 1
+    if pnl > 0:
+        state[PF_WINS] += 1
+        state[PF_WIN_PNL] += pnl
+        state[PF_WIN_RET] += ret
+        state[PF_WIN_DURATION] += duration
+    elif pnl < 0:
+        state[PF_LOSSES] += 1
+        state[PF_LOSS_PNL] += pnl
+        state[PF_LOSS_RET] += ret
+        state[PF_LOSS_DURATION] += duration
+    if np.isnan(state[PF_BEST_RET]) or ret > state[PF_BEST_RET]:
+        state[PF_BEST_RET] = ret
+    if np.isnan(state[PF_WORST_RET]) or ret < state[PF_WORST_RET]:
+        state[PF_WORST_RET] = ret
+
+
+@njit(cache=True)
+def portfolio_step_nb(close, entries, exits, portfolio):
+    """Advance the portfolios by the signals of the new bars
+
+    The orders are filled at the close like `from_signals` with the default
+    long only direction: an entry buys for all the cash when flat, an exit
+    sells the whole position, and conflicting signals are ignored.
+    """
+    for j in range(portfolio.shape[0]):
+        state = portfolio[j]
+        for t in range(close.shape[0]):
+            i = state[PF_BARS]
+            price = close[t]
+            if not np.isnan(price):
+                if np.isnan(state[PF_FIRST_CLOSE]):
+                    state[PF_FIRST_CLOSE] = price
+                state[PF_LAST_CLOSE] = price
+                entry = entries[t, j] and not exits[t, j]
+                exit = exits[t, j] and not entries[t, j]
+                if entry and state[PF_POSITION] == 0 and state[PF_CASH] != 0:
+                    size = state[PF_CASH] / price
+                    if not is_less_nb(size, 1e-8):
+                        state[PF_CASH] = add_nb(state[PF_CASH], -state[PF_CASH])
+                        state[PF_POSITION] = add_nb(state[PF_POSITION], size)
+                        state[PF_ENTRY_PRICE] = price
+                        state[PF_ENTRY_IDX] = i
+                        # The profit of vectorbt is by the cash of the orders
+                        state[PF_ORDER_CASH] = add_nb(state[PF_ORDER_CASH], -(size * price))
+                elif exit and state[PF_POSITION] > 0 and not is_close_nb(state[PF_POSITION], 0):
+                    close_trade_nb(state, price, i)
+                    state[PF_ORDER_CASH] = add_nb(state[PF_ORDER_CASH], state[PF_POSITION] * price)
+                    state[PF_CASH] = state[PF_CASH] + state[PF_POSITION] * price
+                    state[PF_POSITION] = 0.
+            # The value at the last valid close
+            asset_value = state[PF_POSITION] * state[PF_LAST_CLOSE] if state[PF_POSITION] != 0 else 0.
+            value = state[PF_CASH] + asset_value
+            denom = add_nb(asset_value, state[PF_CASH])
+            exposure = 0. if denom == 0 else asset_value / denom
+            if exposure > state[PF_MAX_EXPOSURE]:
+                state[PF_MAX_EXPOSURE] = exposure
+
+            # The returns of the benchmark of all the cash at the first close
+            bench_value = state[PF_LAST_CLOSE] / state[PF_FIRST_CLOSE] * state[PF_INIT_CASH]
+            bench_ret = get_return_nb(state[PF_BENCH_VALUE], bench_value)
+            if not np.isnan(bench_ret):
+                state[PF_BENCH_GROWTH] *= bench_ret + 1
+            state[PF_BENCH_VALUE] = bench_value
+
+            # The returns, see `returns_1d_nb`
+            ret = get_return_nb(state[PF_VALUE], value)
+            state[PF_VALUE] = value
+            if not np.isnan(ret):
+                # The sum is sequential like `np.nanmean` of numba, the
+                # variance is by Welford's algorithm
+                state[PF_RETURNS] += 1
+                state[PF_RET_SUM] += ret
+                delta = ret - state[PF_RET_MEAN]
+                state[PF_RET_MEAN] += delta / state[PF_RETURNS]
+                state[PF_RET_M2] += delta * (ret - state[PF_RET_MEAN])
+                if ret < 0:
+                    state[PF_DOWN_SQ] += ret * ret
+                    state[PF_RET_NEG] -= ret
+                elif ret > 0:
+                    state[PF_RET_POS] += ret
+                state[PF_GROWTH] *= ret + 1
+            # The drawdown of the cumulative returns, see `drawdown_1d_nb`
+            growth = state[PF_GROWTH] * 100.
+            if np.isnan(state[PF_GROWTH_MAX]) or growth > state[PF_GROWTH_MAX]:
+                state[PF_GROWTH_MAX] = growth
+            dd = growth / state[PF_GROWTH_MAX] - 1
+            if dd < state[PF_RET_MAX_DD]:
+                state[PF_RET_MAX_DD] = dd
+
+            # The drawdowns, see `get_drawdowns_nb`
+            if np.isnan(state[PF_PEAK_VAL]) or value >= state[PF_PEAK_VAL]:
+                if state[PF_DD_STARTED] == 0:
+                    state[PF_PEAK_VAL] = value
+                    state[PF_PEAK_IDX] = i
+                else:
+                    # Recovered
+                    record_drawdown_nb(state, i - state[PF_PEAK_IDX] - 1)
+                    state[PF_DD_STARTED] = 0
+                    state[PF_PEAK_IDX] = i
+                    state[PF_PEAK_VAL] = value
+                    state[PF_VALLEY_VAL] = value
+            else:
+                if state[PF_DD_STARTED] == 0:
+                    state[PF_DD_STARTED] = 1
+                    state[PF_VALLEY_VAL] = value
+                elif value < state[PF_VALLEY_VAL]:
+                    state[PF_VALLEY_VAL] = value
+            state[PF_BARS] = i + 1
+
+
+def portfolio_stats(state: np.ndarray, start: pd.Timestamp, end: pd.Timestamp,
+                    freq: pd.Timedelta, names: list | None = None) -> pd.Series:
+    """Get the metrics of `pf.stats()` from the state of a portfolio
+
+    Args:
+        state: 1-D array, the portfolio state of a column
+        start: the open time of the first bar
+        end: the open time of the last bar
+        freq: the interval of the bars
+        names: list, the stats names, all by default
+    """
+    state = state.copy()
+    # The durations of vectorbt are in seconds
+    freq = pd.Timedelta(freq).as_unit('s')
+    bars = int(state[PF_BARS])
+    last = bars - 1
+    # The running drawdown is active at the last bar
+    if state[PF_DD_STARTED] == 1:
+        record_drawdown_nb(state, last - state[PF_PEAK_IDX])
+    init_cash = state[PF_INIT_CASH]
+    # The profit of the orders at the last close, see `total_profit_nb`
+    profit = state[PF_ORDER_CASH] + state[PF_POSITION] * state[PF_LAST_CLOSE]
+    ann_factor = pd.Timedelta('365 days') / freq
+    closed, wins, losses = int(state[PF_CLOSED]), state[PF_WINS], state[PF_LOSSES]
+    is_open = state[PF_POSITION] > 0
+    if is_open:
+        size = state[PF_POSITION]
+        open_pnl = add_nb(size * state[PF_LAST_CLOSE], -size * state[PF_ENTRY_PRICE])
+    else:
+        open_pnl = 0.
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = wins / closed if closed > 0 else np.nan
+        avg_win = state[PF_WIN_PNL] / wins if wins > 0 else (0. if closed > 0 else np.nan)
+        avg_loss = state[PF_LOSS_PNL] / losses if losses > 0 else (0. if closed > 0 else np.nan)
+        n = state[PF_RETURNS]
+        mean = state[PF_RET_SUM] / n if n > 0 else np.nan
+        std = np.sqrt(state[PF_RET_M2] / (n - 1)) if n > 1 else np.nan
+        if bars < 2:
+            sharpe = sortino = np.nan
+        else:
+            sharpe = np.inf if std == 0 else mean / std * np.sqrt(ann_factor)
+            downside = np.sqrt(state[PF_DOWN_SQ] / n) * np.sqrt(ann_factor)
+            sortino = np.inf if downside == 0 else mean * ann_factor / downside
+        omega = np.inf if state[PF_RET_NEG] == 0 else state[PF_RET_POS] / state[PF_RET_NEG]
+        if state[PF_RET_MAX_DD] == 0:
+            calmar = np.nan
+        else:
+            calmar = (state[PF_GROWTH] ** (ann_factor / bars) - 1) / abs(state[PF_RET_MAX_DD])
+        profit_factor = (state[PF_WIN_PNL] / abs(state[PF_LOSS_PNL])) if closed > 0 else np.nan
+
+    def duration(total, count):
+        return freq * (total / count) if count > 0 else pd.NaT
+
+    stats = pd.Series({
+        'Start': start,
+        'End': end,
+        'Period': freq * bars,
+        'Start Value': init_cash,
+        'End Value': profit + init_cash,
+        'Total Return [%]': profit / init_cash * 100,
+        'Benchmark Return [%]': (state[PF_BENCH_GROWTH] - 1) * 100,
+        'Max Gross Exposure [%]': state[PF_MAX_EXPOSURE] * 100,
+        'Total Fees Paid': 0.,
+        'Max Drawdown [%]': -state[PF_MAX_DD] * 100,
+        'Max Drawdown Duration': (freq * state[PF_MAX_DD_DURATION]
+                                  if not np.isnan(state[PF_MAX_DD_DURATION]) else pd.NaT),
+        'Total Trades': closed + int(is_open),
+        'Total Closed Trades': closed,
+        'Total Open Trades': int(is_open),
+        'Open Trade PnL': open_pnl,
+        'Win Rate [%]': win_rate * 100,
+        'Best Trade [%]': state[PF_BEST_RET] * 100,
+        'Worst Trade [%]': state[PF_WORST_RET] * 100,
+        'Avg Winning Trade [%]': state[PF_WIN_RET] / wins * 100 if wins > 0 else np.nan,
+        'Avg Losing Trade [%]': state[PF_LOSS_RET] / losses * 100 if losses > 0 else np.nan,
+        'Avg Winning Trade Duration': duration(state[PF_WIN_DURATION], wins),
+        'Avg Losing Trade Duration': duration(state[PF_LOSS_DURATION], losses),
+        'Profit Factor': profit_factor,
+        'Expectancy': win_rate * avg_win - (1 - win_rate) * abs(avg_loss),
+        'Sharpe Ratio': sharpe,
+        'Calmar Ratio': calmar,
+        'Omega Ratio': omega,
+        'Sortino Ratio': sortino,
+    }, dtype=object)
+    return stats[names or STATS_HEADERS]
@@ -0,0 +1,167 @@
+"""Bulk ingestion of Binance kline dumps into the KlineDb
+
+The kline dumps of data.binance.vision are named by the symbol, the interval
+and the month or the day, and they could be kept in any sub dir, e.g.
+
+    {root}/BTCUSDT-1m-2023-10.zip
+    {root}/futures/um/daily/klines/BTCUSDT/1m/BTCUSDT-1m-2023-11-01.zip
+    {root}/ETHUSDT-30m-2023-10.csv
+
+A zip file holds one CSV file of the same name, and the CSV file could start
+with a header line or not. Each file is inserted in one transaction by batched
+`executemany`, the klines already in the db are kept by their open time `s`,
+and a file whose klines are all in the db is skipped without inserting.
+
+The symbols are ingested in parallel, each symbol is written by one process.
+"""
+
+import os
+import re
+import io
+import logging
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pandas as pd
+
+import backtest.db
+from backtest.db import KlineDb, KLINE_INTERVALS
+from backtest.log import create_log
+
+
+log = logging.getLogger(__name__)
+
+
+# The columns of a Binance kline dump to the kline fields
+DUMP_FIELDS = ['s', 'o', 'h', 'l', 'c', 'bv', 'e', 'qv', 'n', 'tbbv', 'tbqv', 'i']
+
+# e.g. BTCUSDT-1m-2023-10.zip or BTCUSDT-1m-2023-10-01.csv
+DUMP_PATTERN = re.compile(
+    r'^(?P<symbol>[A-Z0-9]+)-(?P<interval>\d+[mhdw])-(?P<period>\d{4}-\d{2}(-\d{2})?)\.(zip|csv)$'
+)
+
+# The open time in microseconds is after 2286-11-20 in milliseconds
+MICROSECONDS = 10 ** 13
+
+
+def find_dumps(root: str, symbols: list | None = None, intervals: list | None = None) -> dict:
+    """Find the kline dumps under the root dir
+
+    Returns:
+        the symbol to the sorted list of (interval, period, file).
+    """
+    symbols = {s.strip().upper() for s in symbols} if symbols else None
+    intervals = intervals or KLINE_INTERVALS
+    dumps = dict()
+    for d, _, fns in os.walk(root):
+        for fn in fns:
+            m = DUMP_PATTERN.match(fn)
+            if m is None:
+                continue
+            symbol, interval = m.group('symbol'), m.group('interval')
+            if interval not in intervals:
+                continue
+            if symbols is not None and symbol not in symbols:
+                continue
+            dumps.setdefault(symbol, list()).append((interval, m.group('period'), os.path.join(d, fn)))
+    return {symbol: sorted(files) for symbol, files in sorted(dumps.items())}
+
+
+def _read_csv(f) -> pd.DataFrame:
+    # The dumps since 2022 start with a header line
+    first = f.readline()
+    has_header = not first[:1].isdigit()
+    f.seek(0)
+    return pd.read_csv(f, header=None, names=DUMP_FIELDS, skiprows=1 if has_header else 0)
+
+
+def read_dump(fn: str) -> pd.DataFrame:
+    """Read the klines of a dump file sorted by open time in milliseconds"""
+    if fn.endswith('.zip'):
+        with zipfile.ZipFile(fn) as z:
+            name = [n for n in z.namelist() if n.endswith('.csv')][0]
+            with z.open(name) as f:
+                df = _read_csv(io.BytesIO(f.read()))
+    else:
+        with open(fn, 'rb') as f:
+            df = _read_csv(f)
+    if len(df) > 0 and df['s'].iloc[0] > MICROSECONDS:
+        df['s'] //= 1000
+        df['e'] //= 1000
+    return df.sort_values('s').drop_duplicates('s')
+
+
+def ingest_file(kdb: KlineDb, interval: str, fn: str) -> int:
+    """Ingest a dump file in one transaction
+
+    Returns:
+        the number of inserted klines, 0 if all klines are in the db.
+    """
+    df = read_dump(fn)
+    if len(df) == 0:
+        return 0
+    start, end = int(df['s'].iloc[0]), int(df['s'].iloc[-1])
+    if kdb.count(interval, start, end) >= len(df):
+        log.debug('skip %s, already ingested', fn)
+        return 0
+    return kdb.upsert(interval, df.to_dict('records'))
+
+
+def ingest_symbol(symbol: str, files: list, path: str) -> tuple:
+    """Ingest the dump files of a symbol, the work unit of the ingestion
+
+    Returns:
+        (symbol, inserted, errors), the errors are keyed by file.
+    """
+    kdb = KlineDb(symbol, path)
+    inserted, errors = 0, dict()
+    try:
+        kdb.enable_wal()
+        kdb.create_tables()
+        for interval, _, fn in files:
+            try:
+                inserted += ingest_file(kdb, interval, fn)
+            except Exception as ex:
+                errors[fn] = f'{type(ex).__name__}: {ex}'
+    finally:
+        kdb.dispose()
+    log.info('ingest %s: %d files, %d klines', symbol, len(files), inserted)
+    return symbol, inserted, errors
+
+
+def init_worker():
+    create_log("backtest")
+
+
+def ingest(root: str, path: str | None = None, symbols: list | None = None,
+           intervals: list | None = None, workers: int = 1) -> int:
+    """Ingest the kline dumps under the root dir into the kline dbs
+
+    Args:
+        root: str, the dir of the dump files
+        path: str, the dir of the kline dbs, `BINANCE_FUTURES_KLINE_DB` by default
+        symbols: list, only ingest these symbols
+        intervals: list, only ingest these intervals
+        workers: int, the number of worker processes
+
+    Returns:
+        the number of inserted klines.
+    """
+    path = path or backtest.db.BINANCE_FUTURES_KLINE_DB
+    os.makedirs(path, exist_ok=True)
+    dumps = find_dumps(root, symbols=symbols, intervals=intervals)
+    log.info('ingest %d files of %d symbols into %s ...',
+             sum(len(files) for files in dumps.values()), len(dumps), path)
+    if workers > 1 and len(dumps) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            results = list(executor.map(ingest_symbol, dumps.keys(), dumps.values(), repeat(path)))
+    else:
+        results = [ingest_symbol(symbol, files, path) for symbol, files in dumps.items()]
+
+    total = 0
+    for symbol, inserted, errors in results:
+        total += inserted
+        for fn, error in errors.items():
+            log.warning('ingest %s failed: %s', fn, error)
+    log.info('%d klines ingested', total)
+    return total
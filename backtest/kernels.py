@@ -0,0 +1,78 @@
+"""The numba kernels of strategy signals
+
+A signal kernel turns the close prices into the entries and the exits of
+many columns at once:
+
+    entries, exits = kernel(close, col_map, *params)
+
+    - close: 2-D float array, one column per symbol
+    - col_map: 1-D int array, the close column of each output column
+    - params: 1-D arrays, the parameter of each output column
+
+and both outputs are 2-D bool arrays of shape (len(close), len(col_map)).
+The kernels are compiled once and cached on disk by `cache=True`, so a kernel
+of a strategy is declared by `Runner.signal_kernel` and run for all parameter
+sets and symbols by `Runner.generate_signals`.
+
+The reference kernels below reproduce the signals of the vectorbt indicators
+`MA` and `RSI` with simple moving averages.
+"""
+
+import numpy as np
+from numba import njit
+from vectorbt.generic.nb import rolling_mean_1d_nb, crossed_above_1d_nb, diff_1d_nb
+
+
+@njit(cache=True)
+def rsi_1d_nb(a, window):
+    """The RSI of simple moving averages, same as `vbt.RSI` with ewm=False"""
+    delta = diff_1d_nb(a)
+    up = np.where(delta < 0, 0., delta)
+    down = np.abs(np.where(delta > 0, 0., delta))
+    roll_up = rolling_mean_1d_nb(up, window)
+    roll_down = rolling_mean_1d_nb(down, window)
+    return 100 - 100 / (1 + roll_up / roll_down)
+
+
+@njit(cache=True)
+def sma_cross_nb(close, col_map, fast_n, slow_n):
+    """Enter when the fast SMA crosses above the slow SMA, exit when below"""
+    entries = np.empty((close.shape[0], len(col_map)), dtype=np.bool_)
+    exits = np.empty((close.shape[0], len(col_map)), dtype=np.bool_)
+    for j in range(len(col_map)):
+        a = close[:, col_map[j]]
+        fast = rolling_mean_1d_nb(a, fast_n[j])
+        slow = rolling_mean_1d_nb(a, slow_n[j])
+        entries[:, j] = crossed_above_1d_nb(fast, slow)
+        exits[:, j] = crossed_above_1d_nb(slow, fast)
+    return entries, exits
+
+
+@njit(cache=True)
+def rsi_threshold_nb(close, col_map, window, min_rsi, max_rsi):
+    """Enter when the RSI is below `min_rsi`, exit when above `max_rsi`"""
+    entries = np.empty((close.shape[0], len(col_map)), dtype=np.bool_)
+    exits = np.empty((close.shape[0], len(col_map)), dtype=np.bool_)
+    for j in range(len(col_map)):
+        rsi = rsi_1d_nb(close[:, col_map[j]], window[j])
+        entries[:, j] = rsi < min_rsi[j]
+        exits[:, j] = rsi > max_rsi[j]
+    return entries, exits
+
+
+def run_kernel(kernel, close: np.ndarray, col_map: np.ndarray, params: list) -> tuple:
+    """Run a signal kernel
+
+    Args:
+        kernel: the numba kernel
+        close: 2-D array, one column per symbol
+        col_map: 1-D array, the close column of each output column
+        params: list, a 1-D array per kernel parameter
+
+    Returns:
+        (entries, exits), 2-D bool arrays.
+    """
+    # The columns are contiguous in fortran order
+    close = np.asfortranarray(close, dtype=np.float64)
+    col_map = np.asarray(col_map, dtype=np.int64)
+    return kernel(close, col_map, *[np.asarray(p) for p in params])
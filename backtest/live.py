@@ -0,0 +1,270 @@
+"""The live updates of the backtest results
+
+The live mode keeps the backtests current as new klines are ingested into the
+kline dbs, without running the whole history again:
+
+    python runbt.py -f config.yaml live --every 30m
+
+The signal state of the step kernel, e.g. the SMA sums or the RSI averages,
+and the portfolio state of each (strategy, label, symbol) are checkpointed
+into `checkpoints.db` of the work dir. An update reads only the bars after
+the checkpoint, advances the states by them, and writes the stats of the
+current watermark into the result store, so a refresh of the universe is
+O(new bars) instead of O(history). The first update, the one after the code
+or the config of the strategy changes, or the one after klines are stored
+before a checkpoint, e.g. a backfilled gap, runs the states from the `start`
+of the config.
+
+Only the complete bars are checkpointed. The last bucket of a derived
+interval, e.g. 2h from 30m, could be incomplete, then the states are advanced
+by it on copies for the stats, and it is read again by the next update.
+"""
+
+import time
+import pickle
+import logging
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import MetaData
+from sqlalchemy import Table, Column, Integer, String, LargeBinary
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import create_engine
+
+from backtest.base import Runner
+from backtest.data import BinanceData
+from backtest.db import get_default_klinedb, get_base_interval, KLINE_INTERVALS
+from backtest.incremental import create_portfolio_state, portfolio_step_nb, portfolio_stats
+from backtest.timing import profiler, span
+from backtest.utils import parse_interval
+
+
+log = logging.getLogger(__name__)
+
+
+# The version of the table schema, the checkpoints of another version are dropped
+SCHEMA_VERSION = 1
+
+
+def add_checkpoint_table(metadata_obj):
+    return Table(
+        "checkpoints",
+        metadata_obj,
+        Column('strategy', String, primary_key=True),
+        Column('label', String, primary_key=True),
+        Column('symbol', String, primary_key=True),
+        Column('interval', String),
+        # the hash of the strategy code and config
+        Column('code_hash', String),
+        # the open time of the first bar and of the last checkpointed bar
+        Column('first', Integer),
+        Column('last', Integer),
+        # the rows of the base klines through the last checkpointed bar,
+        # which change once older klines are stored
+        Column('rows', Integer),
+        # the pickled signal, ring and portfolio states
+        Column('state', LargeBinary),
+        # the update time in unix time format
+        Column('updated', Integer)
+    )
+
+
+class CheckpointStore:
+    """The checkpoints of the live updates
+
+    >>> checkpoints = CheckpointStore('bt_dir/checkpoints.db')
+    >>> saved = checkpoints.load('RSIStrategy', 'BTCUSDT')
+    >>> checkpoints.save(rows)
+    """
+
+    def __init__(self, path: str):
+        self.db_url = f'sqlite:///{path}'
+        self.metadata = MetaData()
+        self.checkpoints = add_checkpoint_table(self.metadata)
+        self.engine = None
+
+    def create_engine(self, echo: bool = False):
+        """Create or get the db engine"""
+        if self.engine is None:
+            self.engine = create_engine(self.db_url, echo=echo)
+            with self.engine.begin() as conn:
+                version = conn.execute(text('PRAGMA user_version')).scalar()
+                if version != SCHEMA_VERSION:
+                    self.checkpoints.drop(conn, checkfirst=True)
+                    conn.execute(text(f'PRAGMA user_version = {SCHEMA_VERSION}'))
+            self.metadata.create_all(self.engine)
+        return self.engine
+
+    def load(self, strategy: str, symbol: str) -> dict:
+        """Load the checkpoints of a symbol keyed by label"""
+        table = self.checkpoints
+        engine = self.create_engine()
+        with engine.connect() as conn:
+            rows = conn.execute(select(table).where(
+                table.c.strategy == strategy, table.c.symbol == symbol
+            )).mappings().all()
+        return {row['label']: dict(row, state=pickle.loads(row['state'])) for row in rows}
+
+    def save(self, rows: list):
+        """Save the checkpoints, an existing one is replaced"""
+        if len(rows) == 0:
+            return
+        updated = int(time.time())
+        rows = [dict(r, state=pickle.dumps(r['state']), updated=updated) for r in rows]
+        stmt = sqlite_insert(self.checkpoints)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['strategy', 'label', 'symbol'],
+            set_={c.name: stmt.excluded[c.name] for c in self.checkpoints.c if not c.primary_key}
+        )
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+
+
+def count_checkpointed(token: str, interval: str, last: int | None) -> int:
+    """Count the base klines through the bar of an interval opened at `last`"""
+    if last is None:
+        return 0
+    base = interval if interval in KLINE_INTERVALS else get_base_interval(interval)
+    return get_default_klinedb(token).count(base, 0, last + parse_interval(interval) - 1)
+
+
+def create_states(runner: Runner, group: list, saved: list) -> tuple:
+    """Create the states of the columns from their checkpoints or from scratch
+
+    Returns:
+        (signal, ring, portfolio), see `backtest.incremental`.
+    """
+    width, depth = runner.live_state
+    windows = [runner.live_window(**params) for params in group]
+    signal = np.zeros((len(group), width), dtype=np.float64)
+    ring = np.zeros((len(group), max(windows), depth), dtype=np.float64)
+    portfolio = create_portfolio_state(len(group), runner.get('init_cash', 10000))
+    for j, checkpoint in enumerate(saved):
+        if checkpoint is not None:
+            state = checkpoint['state']
+            signal[j] = state['signal']
+            ring[j, :windows[j]] = state['ring']
+            portfolio[j] = state['portfolio']
+    return signal, ring, portfolio
+
+
+def advance(runner: Runner, token: str, group: list, saved: list, last: int | None) -> tuple:
+    """Advance the columns of a group of parameters from the same checkpoint
+
+    Args:
+        runner: the strategy instance with `live_kernel`
+        token: str, the symbol
+        group: list, the parameters of the columns on one interval
+        saved: list, the checkpoint of each column, None to run from the start
+        last: int, the open time of the last checkpointed bar, None from the start
+
+    Returns:
+        (stats, checkpoints), the stats of each column and their new checkpoints.
+    """
+    interval = group[0]['interval']
+    st = last + 1 if last is not None else runner.get_start_ms()
+    df = BinanceData.read_frame(token, interval, st=st, columns=['Close'])
+    close = df['Close'].to_numpy(dtype=np.float64)
+    opens = df.index.asi8 // 1_000_000
+    # A bucket is complete once the kline of its last base interval is stored
+    base = interval if interval in KLINE_INTERVALS else get_base_interval(interval)
+    watermark = get_default_klinedb(token).get_watermark(base)
+    done = int(np.searchsorted(opens + parse_interval(interval), watermark + parse_interval(base),
+                               side='right'))
+
+    args = [runner.kernel_args(**params) for params in group]
+    params = [np.asarray([a[i] for a in args]) for i in range(len(args[0]))]
+    signal, ring, portfolio = create_states(runner, group, saved)
+    with span('signals'):
+        entries, exits = runner.live_kernel(close[:done], *params, signal, ring)
+    with span('simulate'):
+        portfolio_step_nb(close[:done], entries, exits, portfolio)
+    final = portfolio
+    if done < len(close):
+        # The incomplete bar is not checkpointed
+        final = portfolio.copy()
+        entries, exits = runner.live_kernel(close[done:], *params, signal.copy(), ring.copy())
+        portfolio_step_nb(close[done:], entries, exits, final)
+
+    first = saved[0]['first'] if saved[0] is not None else (int(opens[0]) if len(opens) else None)
+    end = int(opens[-1]) if len(opens) else last
+    checkpointed = int(opens[done - 1]) if done > 0 else last
+    rows = count_checkpointed(token, interval, checkpointed)
+    if first is None:
+        raise ValueError(f"No data of {interval} for {token}")
+    stats, checkpoints = dict(), list()
+    names = runner.get_metrics()
+    code_hash = runner.get_code_hash()
+    freq = pd.Timedelta(parse_interval(interval), unit='ms')
+    with span('stats'):
+        for j, params in enumerate(group):
+            label = runner.create_label(**params)
+            stats[label] = portfolio_stats(final[j], pd.Timestamp(first, unit='ms', tz='UTC'),
+                                           pd.Timestamp(end, unit='ms', tz='UTC'), freq, names)
+            checkpoints.append(dict(
+                strategy=runner.__class__.__name__,
+                label=label,
+                symbol=token,
+                interval=interval,
+                code_hash=code_hash,
+                first=first,
+                last=checkpointed,
+                rows=rows,
+                state=dict(signal=signal[j], ring=ring[j, :runner.live_window(**params)],
+                           portfolio=portfolio[j])
+            ))
+    return stats, checkpoints
+
+
+def live_token(runner: Runner, token: str, param_list: list) -> tuple:
+    """Update the backtests of a token by its new bars, the work unit of the live mode
+
+    Returns:
+        (token, stats, errors, checkpoints, spans), the stats and the errors
+        are keyed by label.
+    """
+    stats, errors, checkpoints = dict(), dict(), list()
+    code_hash = runner.get_code_hash()
+    store = CheckpointStore(runner.get_checkpoint_file())
+    saved = store.load(runner.__class__.__name__, token)
+    # The rows through each checkpointed bar, keyed by (interval, last)
+    counts = dict()
+    for group in runner.group_parameters(param_list):
+        # The columns at the same checkpoint are advanced together
+        batches = dict()
+        for params in group:
+            checkpoint = saved.get(runner.create_label(**params))
+            if checkpoint is not None and (checkpoint['code_hash'] != code_hash
+                                           or checkpoint['interval'] != params['interval']):
+                checkpoint = None
+            if checkpoint is not None:
+                # The klines stored before the checkpoint, e.g. a backfilled
+                # gap, are not in its states
+                at = (checkpoint['interval'], checkpoint['last'])
+                if at not in counts:
+                    try:
+                        counts[at] = count_checkpointed(token, *at)
+                    except Exception:
+                        # Failed again by `advance` from the start
+                        counts[at] = None
+                if checkpoint['rows'] != counts[at]:
+                    checkpoint = None
+            last = checkpoint['last'] if checkpoint is not None else None
+            batches.setdefault(last, []).append((params, checkpoint))
+        for last, batch in batches.items():
+            labels = [runner.create_label(**params) for params, _ in batch]
+            try:
+                log.info('update %s on %d parameters ...', token, len(batch))
+                with profiler.context(symbol=token, label=','.join(labels)), span('run'):
+                    batch_stats, batch_checkpoints = advance(
+                        runner, token, [params for params, _ in batch],
+                        [checkpoint for _, checkpoint in batch], last
+                    )
+                stats.update(batch_stats)
+                checkpoints.extend(batch_checkpoints)
+            except Exception as ex:
+                for label in labels:
+                    errors[label] = f'{type(ex).__name__}: {ex}'
+    return token, stats, errors, checkpoints, profiler.drain()
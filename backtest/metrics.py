@@ -0,0 +1,129 @@
+"""The metrics of the backtest results
+
+Each metric of `pf.stats()` has its stats name used in the CSV files and the
+plots, the metric key of vectorbt used as the column of the result store, and
+a type:
+
+    - datetime: stored as int nanoseconds since epoch in UTC
+    - timedelta: stored as int nanoseconds
+    - int
+    - float
+
+A strategy could choose its metrics by the `metrics` list of its config, then
+only these metrics are computed and stored, the others are left NULL.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# (the stats name, the metric key, the type)
+METRICS = [
+    ('Start', 'start', 'datetime'),
+    ('End', 'end', 'datetime'),
+    ('Period', 'period', 'timedelta'),
+    ('Start Value', 'start_value', 'float'),
+    ('End Value', 'end_value', 'float'),
+    ('Total Return [%]', 'total_return', 'float'),
+    ('Benchmark Return [%]', 'benchmark_return', 'float'),
+    ('Max Gross Exposure [%]', 'max_gross_exposure', 'float'),
+    ('Total Fees Paid', 'total_fees_paid', 'float'),
+    ('Max Drawdown [%]', 'max_dd', 'float'),
+    ('Max Drawdown Duration', 'max_dd_duration', 'timedelta'),
+    ('Total Trades', 'total_trades', 'int'),
+    ('Total Closed Trades', 'total_closed_trades', 'int'),
+    ('Total Open Trades', 'total_open_trades', 'int'),
+    ('Open Trade PnL', 'open_trade_pnl', 'float'),
+    ('Win Rate [%]', 'win_rate', 'float'),
+    ('Best Trade [%]', 'best_trade', 'float'),
+    ('Worst Trade [%]', 'worst_trade', 'float'),
+    ('Avg Winning Trade [%]', 'avg_winning_trade', 'float'),
+    ('Avg Losing Trade [%]', 'avg_losing_trade', 'float'),
+    ('Avg Winning Trade Duration', 'avg_winning_trade_duration', 'timedelta'),
+    ('Avg Losing Trade Duration', 'avg_losing_trade_duration', 'timedelta'),
+    ('Profit Factor', 'profit_factor', 'float'),
+    ('Expectancy', 'expectancy', 'float'),
+    ('Sharpe Ratio', 'sharpe_ratio', 'float'),
+    ('Calmar Ratio', 'calmar_ratio', 'float'),
+    ('Omega Ratio', 'omega_ratio', 'float'),
+    ('Sortino Ratio', 'sortino_ratio', 'float'),
+]
+
+# The stats names, i.e. the headers of the output CSV
+STATS_HEADERS = [name for name, _, _ in METRICS]
+
+# The stats name to the metric key
+METRIC_KEYS = {name: key for name, key, _ in METRICS}
+
+# The metric key to the stats name
+METRIC_NAMES = {key: name for name, key, _ in METRICS}
+
+# The metric key to the type
+METRIC_TYPES = {key: kind for _, key, kind in METRICS}
+
+# The metrics always computed, the results are sorted and filtered by them
+REQUIRED_METRICS = ['Total Return [%]', 'Total Closed Trades']
+
+
+def select_metrics(names: list) -> list:
+    """Get the stats names to compute in the order of `METRICS`"""
+    unknown = [name for name in names if name not in METRIC_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+    selected = set(names) | set(REQUIRED_METRICS)
+    return [name for name in STATS_HEADERS if name in selected]
+
+
+def compute_stats(pf, names: list | None = None) -> pd.DataFrame:
+    """Compute the metrics of all columns of a portfolio in one call
+
+    Args:
+        pf: the vectorbt portfolio
+        names: list, the stats names, all metrics by default
+
+    Returns:
+        the stats of each column as a row.
+    """
+    if names is None:
+        df = pf.stats(agg_func=None)
+    else:
+        df = pf.stats(metrics=[METRIC_KEYS[name] for name in names], agg_func=None)
+    if isinstance(df, pd.Series):
+        # The stats of a single column
+        df = df.to_frame(pf.wrapper.columns[0]).T
+    return df
+
+
+def encode_stats(stats: pd.Series) -> dict:
+    """Encode the stats into the values of the store columns"""
+    values = dict()
+    for name, key, kind in METRICS:
+        value = stats.get(name)
+        if value is None or pd.isna(value):
+            values[key] = None
+        elif kind == 'datetime':
+            values[key] = pd.Timestamp(value).value
+        elif kind == 'timedelta':
+            values[key] = pd.Timedelta(value).value
+        elif kind == 'int':
+            values[key] = int(value)
+        else:
+            values[key] = float(value)
+    return values
+
+
+def decode_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Decode the store columns into the typed stats named columns"""
+    df = df.copy()
+    for key, kind in METRIC_TYPES.items():
+        if key not in df.columns:
+            continue
+        if kind == 'datetime':
+            df[key] = pd.to_datetime(df[key], unit='ns', utc=True)
+        elif kind == 'timedelta':
+            df[key] = pd.to_timedelta(df[key], unit='ns')
+        elif kind == 'int' and df[key].notna().all():
+            df[key] = df[key].astype(np.int64)
+        elif kind in ('int', 'float'):
+            df[key] = df[key].astype(np.float64)
+    return df.rename(columns=METRIC_NAMES)
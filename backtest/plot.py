@@ -1,100 +1,149 @@
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 # from matplotlib import colormaps
 import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
+# Render by the Agg canvas of a plain figure, neither pyplot nor a GUI
+# backend is involved, so no figure is left open
+from matplotlib.figure import Figure
 
 from backtest.base import Runner
+from backtest.metrics import STATS_HEADERS
+from backtest.store import ResultStore
+from backtest.timing import profiler, span
 
 
 log = logging.getLogger(__name__)
 
 
+def get_colors() -> list:
+    # colors = list(mcolors.TABLEAU_COLORS.keys())
+    colors = dict(mcolors.BASE_COLORS, **mcolors.CSS4_COLORS)
+    colors.pop('white')
+    # by_hsv = sorted((tuple(mcolors.rgb_to_hsv(mcolors.to_rgba(color)[:3])), name)
+    #         for name, color in colors.items())
+    # sorted_names = [name for _, name in by_hsv]
+    return list(colors.values())
+
+
+def render_boxplot(key: str, boxes: list, fp: str) -> str:
+    """Render the boxes of a metric into a png file
+
+    Args:
+        key: str, the metric
+        boxes: list, the (label, values) of each box
+        fp: str, the png file
+    """
+    colors = get_colors()
+    fig = Figure(figsize=(20, 10))
+    ax = fig.subplots()
+    artists, labels = list(), list()
+    for i, (label, values) in enumerate(boxes, start=1):
+        color = colors[i % len(colors)]
+        flierprops = dict(marker='o', markerfacecolor=color, markersize=5,
+                          linestyle='none', markeredgecolor='b')
+        # A box and whisker plot shows how the data is distributed and its
+        # outliers, and the boxes of the labels are drawn side by side.
+        # https://www.ncl.ac.uk/webtemplate/ask-assets/external/\
+        # maths-resources/statistics/data-presentation/box-and-whisker-plots.html
+        box = ax.boxplot(values,
+                         positions=[i * 2],
+                         widths=1.5,
+                         patch_artist=True,
+                         showmeans=True,
+                         showfliers=True,
+                         flierprops=flierprops,
+                         medianprops={"color": "white", "linewidth": 0.5},
+                         boxprops={"facecolor": color, "edgecolor": "white", "linewidth": 0.5},
+                         whiskerprops={"color": color, "linewidth": 1.5},
+                         capprops={"color": color, "linewidth": 1.5})
+        artists.append(box['boxes'][0])
+        labels.append(label)
+    ax.legend(artists, labels)
+    ax.set_title(key)
+    fig.savefig(fp)
+    return fp
+
 
 class BoxPlot:
+    """The box plots of the metrics per set of parameters
 
-    def __init__(self, runner: Runner):
+    The results are loaded from the result store once, then each metric is
+    rendered into `{metric}.png` of the work dir, in a process pool with
+    `workers` > 1. The statistics of the boxes are written into
+    `boxplot_summary.csv`.
+    """
+
+    def __init__(self, runner: Runner, symbols: list | None = None, param_list: list | None = None,
+                 workers: int = 1):
         self.runner = runner
+        self.symbols = symbols
+        # The parameters to plot, all of the runner by default
+        self.param_list = param_list if param_list is not None else runner.iter_parameters()
+        self.workers = workers
+        self.store = ResultStore(runner.get_result_file())
 
-    def read_results(self, fn: str):
-        """Read backtest results from CSV file"""
-        df = pd.read_csv(fn)
+    def read_results(self) -> pd.DataFrame:
+        """Read backtest results of all labels from the result store"""
+        labels = [self.runner.create_label(**params) for params in self.param_list]
+        df = self.store.load(
+            strategy=self.runner.__class__.__name__,
+            code_hash=self.runner.get_code_hash(),
+            labels=labels
+        )
+        if self.symbols is not None:
+            df = df[df['symbol'].isin(self.symbols)]
+        df = df[['label'] + (self.runner.get_metrics() or STATS_HEADERS)].copy()
         df.replace([np.inf, -np.inf], np.nan, inplace=True)
         df.dropna(inplace=True)
-        # At least there are two closed trades
-        return df[df['Total Closed Trades'] > 0 ]
-    
-    def boxplot(self, key = 'Total Return [%]'):
-        """plot boxplot for given parameters
-
-        params = [(3, 6, '1d'), (4, 8, '1d'), (5, 10, '1d')]
-        
-        """
-        # Create figures from the output report
+        # At least there is one closed trade
+        return df[df['Total Closed Trades'] > 0]
+
+    def get_boxes(self, df: pd.DataFrame, key: str) -> list:
+        """Get the (label, values) of a metric in the order of the parameters"""
+        groups = dict(list(df.groupby('label')[key]))
         boxes = list()
-        labels = list()
-
-        #
-        # colors = list(mcolors.TABLEAU_COLORS.keys())
-        colors = dict(mcolors.BASE_COLORS, **mcolors.CSS4_COLORS)
-        colors.pop('white')
-        # by_hsv = sorted((tuple(mcolors.rgb_to_hsv(mcolors.to_rgba(color)[:3])), name)
-        #         for name, color in colors.items())
-        # sorted_names = [name for _, name in by_hsv]
-        sorted_names = list(colors.keys())
-        # breakpoint()
-        fig, ax = plt.subplots(figsize=(20, 10))
-        i = 1
-
-        # params is used to find CSV feeds
-        for param in self.runner.iter_parameters():
-            # for f, s, interval in params:
-            # fn = os.path.join(out_dir, f'backtest_sma_{interval}_{f}x{s}.csv')
-            # print(param)
-            fp = self.runner.get_output_file(**param)
-            if not os.path.exists(fp):
-                continue
+        for params in self.param_list:
+            label = self.runner.create_label(**params)
+            if label in groups and len(groups[label]) > 0:
+                boxes.append((label, groups[label].to_numpy()))
+        return boxes
 
-            # log.info("process %s", fn)
-            log.info("process %s ...", fp)
-            df = self.read_results(fp)
-            # color = random.choice(colors)
-            color = colors[sorted_names[i]]
-            flierprops = dict(marker='o', markerfacecolor=color, markersize=5,
-                    linestyle='none', markeredgecolor='b')
-            
-            # A box and whisker plot or diagram (otherwise known as a boxplot), 
-            # is a graph summarising a set of data. The shape of the boxplot shows 
-            # how the data is distributed and it also shows any outliers. It is a 
-            # useful way to compare different sets of data as you can draw more 
-            # than one boxplot per graph. These can be displayed alongside a number line, 
-            # horizontally or vertically.
-            # https://www.ncl.ac.uk/webtemplate/ask-assets/external/\
-            # maths-resources/statistics/data-presentation/\
-            # box-and-whisker-plots.html#:~:text=A%20box%20and%20whisker%20plot,than%20one%20boxplot%20per%20graph.
-            box = ax.boxplot(df[key], 
-                            positions=[i*2],
-                            widths=1.5, 
-                            patch_artist=True,
-                            showmeans=True, 
-                            showfliers=True, 
-                            flierprops=flierprops,
-                            medianprops={"color": "white", "linewidth": 0.5},
-                            boxprops={"facecolor": color, "edgecolor": "white", "linewidth": 0.5},
-                            whiskerprops={"color": color, "linewidth": 1.5},
-                            capprops={"color": color, "linewidth": 1.5})
-            boxes.append(box)
-            label = self.runner.create_label(**param)
-            # labels.append(f'{f}x{s}-{interval}')
-            labels.append(label)
-            i += 1
-        ax.legend([b['boxes'][0] for b in boxes], labels)
-        ax.set_title(key)
-        fig.savefig(os.path.join(self.runner.get_work_dir(), f'{key}.png'))
+    def summarize(self, df: pd.DataFrame, keys: list) -> pd.DataFrame:
+        """Get the statistics of the boxes of the metrics"""
+        frames = list()
+        for key in keys:
+            values = df[key]
+            if not pd.api.types.is_numeric_dtype(values):
+                continue
+            stats = values.groupby(df['label']).describe()
+            stats.insert(0, 'Metric', key)
+            frames.append(stats)
+        if not frames:
+            return pd.DataFrame()
+        summary = pd.concat(frames)
+        summary.index.name = 'Label'
+        return summary
 
     def create_plots(self):
-        for name in self.runner.get_plots():
-            log.info("Create plot for metric: %s ...", name)
-            self.boxplot(key=name)
+        keys = self.runner.get_plots()
+        if not keys:
+            return
+        df = self.read_results()
+        work_dir = self.runner.get_work_dir()
+        jobs = list()
+        for key in keys:
+            boxes = self.get_boxes(df, key)
+            if boxes:
+                jobs.append((key, boxes, os.path.join(work_dir, f'{key}.png')))
+        log.info("Create plots of %d metrics ...", len(jobs))
+        with profiler.context(label=','.join(keys)), span('plot'):
+            if self.workers > 1 and len(jobs) > 1:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+                    list(executor.map(render_boxplot, *zip(*jobs)))
+            else:
+                for job in jobs:
+                    render_boxplot(*job)
+        self.summarize(df, keys).to_csv(os.path.join(work_dir, 'boxplot_summary.csv'))
@@ -0,0 +1,93 @@
+"""The cache of simulated portfolios
+
+With `save_portfolios: true` in the strategy config, the portfolios simulated
+by the engine are saved into the work dir, so `--show` loads them instead of
+running the backtests again:
+
+    {work_dir}/portfolios/BTCUSDT/index.json
+    {work_dir}/portfolios/BTCUSDT/30m-8f2c...pf
+
+A portfolio file of a batch holds the columns of all its labels, and the
+index maps each label to its file, its column and its result key. A label is
+only loaded while its result key is current, see `backtest.store.make_key`.
+The portfolios of the panel mode are not saved.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class PortfolioCache:
+    """The saved portfolios of a work dir
+
+    >>> cache = PortfolioCache('bt_dir/portfolios')
+    >>> cache.save('BTCUSDT', pf, {'30m_3x6': key1, '30m_4x8': key2})
+    >>> pf = cache.load('BTCUSDT', '30m_3x6', key1)
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_dir(self, symbol: str) -> str:
+        return os.path.join(self.root, symbol.strip().upper())
+
+    def read_index(self, symbol: str) -> dict:
+        fn = os.path.join(self.get_dir(symbol), 'index.json')
+        if not os.path.exists(fn):
+            return dict()
+        with open(fn, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self, symbol: str, index: dict):
+        d = self.get_dir(symbol)
+        tmp = os.path.join(d, 'index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, os.path.join(d, 'index.json'))
+        # Remove the files no longer indexed
+        used = {entry['file'] for entry in index.values()}
+        for fn in os.listdir(d):
+            if fn.endswith('.pf') and fn not in used:
+                try:
+                    os.remove(os.path.join(d, fn))
+                except OSError:
+                    pass
+
+    def save(self, symbol: str, pf, keys: dict, single: bool = False):
+        """Save the portfolio of a symbol
+
+        Args:
+            symbol: str, the symbol
+            pf: the portfolio, whose columns are the labels
+            keys: dict, the result key of each label
+            single: bool, the portfolio has a single column of the only label
+        """
+        d = self.get_dir(symbol)
+        os.makedirs(d, exist_ok=True)
+        content = '|'.join(f'{label}={key}' for label, key in sorted(keys.items()))
+        fn = f"{hashlib.sha1(content.encode()).hexdigest()}.pf"
+        pf.save(os.path.join(d, fn))
+        index = self.read_index(symbol)
+        for label, key in keys.items():
+            index[label] = dict(file=fn, key=key, column=None if single else label)
+        self._write_index(symbol, index)
+
+    def load(self, symbol: str, label: str, key: str):
+        """Load the portfolio of a label, or None if it is missing or stale"""
+        entry = self.read_index(symbol).get(label)
+        if entry is None or entry['key'] != key:
+            return None
+        import vectorbt as vbt
+
+        fp = os.path.join(self.get_dir(symbol), entry['file'])
+        try:
+            pf = vbt.Portfolio.load(fp)
+        except Exception as ex:
+            log.warning('load portfolio %s failed: %s', fp, ex)
+            return None
+        return pf if entry['column'] is None else pf[entry['column']]
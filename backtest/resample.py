@@ -0,0 +1,135 @@
+"""Resample klines into any interval by compiled aggregation
+
+An interval such as 15m, 2h, 8h or 3d is derived from a stored interval
+(see `get_base_interval`) instead of storing and syncing more tables. The
+buckets are aligned to the unix epoch, and the weeks start on Monday.
+"""
+
+import numpy as np
+from numba import njit
+
+from backtest.utils import parse_interval
+
+
+# The aggregation of each kline field, the close time `e` is derived
+AGGREGATIONS = {
+    'o': 'first',
+    'h': 'max',
+    'l': 'min',
+    'c': 'last',
+    'bv': 'sum',
+    'qv': 'sum',
+    'n': 'sum',
+    'tbbv': 'sum',
+    'tbqv': 'sum'
+}
+
+# 1970-01-05 is the first Monday after the unix epoch
+WEEK_OFFSET = 4 * 24 * 60 * 60 * 1000
+
+
+@njit(cache=True)
+def bucket_starts_nb(s, bucket_ms, offset):
+    """Get the first index and the open time of each bucket"""
+    starts = np.empty(len(s), dtype=np.int64)
+    keys = np.empty(len(s), dtype=np.int64)
+    k = -1
+    last = np.iinfo(np.int64).min
+    for i in range(len(s)):
+        key = (s[i] - offset) // bucket_ms * bucket_ms + offset
+        if key != last:
+            k += 1
+            starts[k] = i
+            keys[k] = key
+            last = key
+    return starts[:k + 1], keys[:k + 1]
+
+
+@njit(cache=True)
+def first_nb(values, starts):
+    return values[starts]
+
+
+@njit(cache=True)
+def last_nb(values, starts):
+    out = np.empty(len(starts), dtype=values.dtype)
+    for k in range(len(starts)):
+        end = starts[k + 1] if k + 1 < len(starts) else len(values)
+        out[k] = values[end - 1]
+    return out
+
+
+@njit(cache=True)
+def max_nb(values, starts):
+    out = np.empty(len(starts), dtype=values.dtype)
+    for k in range(len(starts)):
+        end = starts[k + 1] if k + 1 < len(starts) else len(values)
+        out[k] = values[starts[k]]
+        for i in range(starts[k] + 1, end):
+            if values[i] > out[k]:
+                out[k] = values[i]
+    return out
+
+
+@njit(cache=True)
+def min_nb(values, starts):
+    out = np.empty(len(starts), dtype=values.dtype)
+    for k in range(len(starts)):
+        end = starts[k + 1] if k + 1 < len(starts) else len(values)
+        out[k] = values[starts[k]]
+        for i in range(starts[k] + 1, end):
+            if values[i] < out[k]:
+                out[k] = values[i]
+    return out
+
+
+@njit(cache=True)
+def sum_nb(values, starts):
+    out = np.zeros(len(starts), dtype=values.dtype)
+    for k in range(len(starts)):
+        end = starts[k + 1] if k + 1 < len(starts) else len(values)
+        for i in range(starts[k], end):
+            out[k] += values[i]
+    return out
+
+
+AGGREGATORS = {
+    'first': first_nb,
+    'last': last_nb,
+    'max': max_nb,
+    'min': min_nb,
+    'sum': sum_nb
+}
+
+
+def get_offset(interval: str) -> int:
+    return WEEK_OFFSET if interval.strip().endswith('w') else 0
+
+
+def resample_columns(columns: dict, interval: str) -> dict:
+    """Resample the kline arrays of `KlineDb.select` into an interval
+
+    The last bucket could be partial when the klines end inside it.
+    """
+    bucket_ms = parse_interval(interval)
+    s = np.ascontiguousarray(columns['s'], dtype=np.int64)
+    if len(s) == 0:
+        return {name: values[:0] for name, values in columns.items()}
+    starts, keys = bucket_starts_nb(s, bucket_ms, get_offset(interval))
+    result = dict(s=keys)
+    for name, values in columns.items():
+        if name == 's':
+            continue
+        elif name == 'e':
+            result[name] = keys + bucket_ms - 1
+        else:
+            aggregate = AGGREGATORS[AGGREGATIONS[name]]
+            result[name] = aggregate(np.ascontiguousarray(values), starts)
+    return result
+
+
+def align_start(st: int, interval: str) -> int:
+    """Align a start time down to the open time of its bucket"""
+    bucket_ms = parse_interval(interval)
+    offset = get_offset(interval)
+    return (st - offset) // bucket_ms * bucket_ms + offset
@@ -0,0 +1,253 @@
+"""The adaptive parameter search
+
+Instead of the full grid of `Runner.iter_parameters`, the search samples the
+parameter ranges of the strategy config and evaluates them adaptively, e.g.
+
+    search: {
+        method: halving,
+        budget: 60,
+        max_time: 30m,
+        metric: 'Total Return [%]',
+        ranges: {window: [5, 30], min_rsi: [10, 40], max_rsi: [60, 90]}
+    }
+
+The methods are:
+
+    - halving: the successive halving, the random candidates are evaluated
+      on a growing subset of the symbols and only the best 1/`eta` of them
+      are kept for the next round
+    - gp: the Gaussian process search, the candidates of the best expected
+      improvement are evaluated on all symbols in batches of `batch_size`
+
+The `budget` is the number of evaluated parameter sets, and `max_time` stops
+the search after a wall time. A parameter set is scored by the mean of the
+metric across the symbols. The search runs for each interval of the config,
+and all evaluated parameter sets go through the engine, so they are kept in
+the result store and exported as usual. The points are also written into
+`search_results.csv` of the work dir.
+"""
+
+import math
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+from backtest.base import Runner
+from backtest.utils import parse_seconds
+
+
+log = logging.getLogger(__name__)
+
+
+class ParameterSpace:
+    """The ranges of the parameters, the int ranges give int parameters"""
+
+    def __init__(self, ranges: dict):
+        self.names = list(ranges)
+        self.low = np.array([ranges[name][0] for name in self.names], dtype=np.float64)
+        self.high = np.array([ranges[name][1] for name in self.names], dtype=np.float64)
+        self.ints = [all(isinstance(v, int) for v in ranges[name]) for name in self.names]
+
+    def from_unit(self, x: np.ndarray) -> dict:
+        """Map a point of the unit cube into the parameters"""
+        values = self.low + np.clip(x, 0, 1) * (self.high - self.low)
+        return {
+            name: int(round(v)) if is_int else float(v)
+            for name, v, is_int in zip(self.names, values, self.ints)
+        }
+
+    def to_unit(self, params: dict) -> np.ndarray:
+        values = np.array([params[name] for name in self.names], dtype=np.float64)
+        return (values - self.low) / np.where(self.high > self.low, self.high - self.low, 1)
+
+
+class Search:
+    """The base of the adaptive searches
+
+    The `evaluate(param_list, tokens)` callback backtests the parameter sets
+    on the tokens, and returns the results with the `label` and the `symbol`
+    columns.
+    """
+
+    def __init__(self, runner: Runner, ranges: dict, budget: int = 50, max_time=None,
+                 metric: str = 'Total Return [%]', minimize: bool = False, seed: int = 0):
+        self.runner = runner
+        self.space = ParameterSpace(ranges)
+        self.budget = budget
+        self.max_time = parse_seconds(max_time)
+        self.metric = metric
+        self.minimize = minimize
+        self.rng = np.random.default_rng(seed)
+        self.points = list()
+        self.evaluations = 0
+        self.t0 = time.time()
+
+    def timeout(self) -> bool:
+        return self.max_time is not None and time.time() - self.t0 > self.max_time
+
+    def sample(self, interval: str, n: int, seen: set) -> list:
+        """Sample new valid parameter sets"""
+        param_list = list()
+        for _ in range(n * 100):
+            if len(param_list) >= n:
+                break
+            params = dict(interval=interval, **self.space.from_unit(self.rng.random(len(self.space.names))))
+            label = self.runner.create_label(**params)
+            if label not in seen and self.runner.valid_parameters(**params):
+                seen.add(label)
+                param_list.append(params)
+        return param_list
+
+    def score(self, evaluate, param_list: list, tokens: list, step: int) -> dict:
+        """Evaluate the parameter sets, the scores are keyed by label"""
+        df = evaluate(param_list, tokens)
+        values = df[self.metric].replace([np.inf, -np.inf], np.nan)
+        scores = values.groupby(df['label']).mean().to_dict()
+        self.evaluations += len(param_list)
+        for params in param_list:
+            label = self.runner.create_label(**params)
+            self.points.append(dict(params, label=label, step=step, symbols=len(tokens),
+                                    score=scores.get(label, np.nan)))
+        return scores
+
+    def rank(self, scores: dict) -> list:
+        """Sort the labels from the best score, the missing ones are dropped"""
+        scores = {k: v for k, v in scores.items() if not pd.isna(v)}
+        return sorted(scores, key=scores.get, reverse=not self.minimize)
+
+    def search(self, evaluate, interval: str, tokens: list, budget: int):
+        """Search the parameters of an interval within the budget of evaluations"""
+        raise NotImplementedError
+
+    def run(self, evaluate, tokens: list) -> pd.DataFrame:
+        """Search each interval of the config, which share the budget
+
+        Returns:
+            the evaluated points from the best.
+        """
+        intervals = self.runner.get('intervals', [])
+        for i, interval in enumerate(intervals):
+            budget = self.budget // len(intervals) + (1 if i < self.budget % len(intervals) else 0)
+            log.info('search %s with %d evaluations ...', interval, budget)
+            self.evaluations = 0
+            self.search(evaluate, interval, tokens, budget)
+        df = pd.DataFrame(self.points)
+        if len(df) == 0:
+            return df
+        # The scores of the last step of a label are on the most symbols
+        df = df.sort_values('step').drop_duplicates('label', keep='last')
+        df = df.sort_values('score', ascending=self.minimize, na_position='last')
+        return df.sort_values('symbols', ascending=False, kind='stable')
+
+
+class SuccessiveHalving(Search):
+
+    def __init__(self, runner: Runner, ranges: dict, eta: int = 3, candidates: int | None = None,
+                 **kwargs):
+        super().__init__(runner, ranges, **kwargs)
+        self.eta = eta
+        self.candidates = candidates
+
+    def search(self, evaluate, interval: str, tokens: list, budget: int):
+        # n + n/eta + n/eta^2 + ... is within the budget
+        n = self.candidates or max(1, budget * (self.eta - 1) // self.eta)
+        param_list = self.sample(interval, n, set())
+        rounds = max(1, math.ceil(math.log(max(n, 1), self.eta)) + 1)
+        order = [tokens[i] for i in self.rng.permutation(len(tokens))]
+        for r in range(rounds):
+            if not param_list or self.timeout():
+                break
+            if self.evaluations + len(param_list) > budget:
+                param_list = param_list[:budget - self.evaluations]
+                if not param_list:
+                    break
+            # The symbols grow by eta up to all symbols in the last round
+            size = max(1, len(order) // self.eta ** (rounds - 1 - r))
+            if len(param_list) == 1:
+                # The winner goes to all symbols at once
+                size = len(order)
+            log.info('halving round %d: %d parameters on %d symbols', r, len(param_list), size)
+            scores = self.score(evaluate, param_list, order[:size], r)
+            ranked = self.rank(scores)
+            keep = ranked[:max(1, len(ranked) // self.eta)]
+            by_label = {self.runner.create_label(**params): params for params in param_list}
+            param_list = [by_label[label] for label in keep]
+            if size == len(order):
+                break
+
+
+class GaussianProcessSearch(Search):
+
+    def __init__(self, runner: Runner, ranges: dict, init_points: int = 8, batch_size: int = 4,
+                 samples: int = 2000, xi: float = 0.01, **kwargs):
+        super().__init__(runner, ranges, **kwargs)
+        self.init_points = init_points
+        self.batch_size = batch_size
+        self.samples = samples
+        self.xi = xi
+
+    def propose(self, interval: str, X: np.ndarray, y: np.ndarray, seen: set) -> list:
+        """Propose the unseen candidates of the best expected improvement"""
+        from scipy.stats import norm
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+
+        gp = GaussianProcessRegressor(kernel=Matern(nu=2.5) + WhiteKernel(), normalize_y=True,
+                                      random_state=int(self.rng.integers(2 ** 31)))
+        gp.fit(X, y)
+        candidates = self.rng.random((self.samples, X.shape[1]))
+        mu, sigma = gp.predict(candidates, return_std=True)
+        sigma = np.maximum(sigma, 1e-9)
+        improvement = mu - y.max() - self.xi
+        z = improvement / sigma
+        ei = improvement * norm.cdf(z) + sigma * norm.pdf(z)
+        param_list = list()
+        for i in np.argsort(-ei):
+            if len(param_list) >= self.batch_size:
+                break
+            params = dict(interval=interval, **self.space.from_unit(candidates[i]))
+            label = self.runner.create_label(**params)
+            if label not in seen and self.runner.valid_parameters(**params):
+                seen.add(label)
+                param_list.append(params)
+        return param_list
+
+    def search(self, evaluate, interval: str, tokens: list, budget: int):
+        seen = set()
+        X, y = list(), list()
+        param_list = self.sample(interval, min(self.init_points, budget), seen)
+        step = 0
+        while param_list and not self.timeout():
+            scores = self.score(evaluate, param_list, tokens, step)
+            for params in param_list:
+                value = scores.get(self.runner.create_label(**params), np.nan)
+                if not pd.isna(value):
+                    X.append(self.space.to_unit(params))
+                    # The gp maximizes
+                    y.append(-value if self.minimize else value)
+            step += 1
+            n = min(self.batch_size, budget - self.evaluations)
+            if n <= 0:
+                break
+            if len(y) < 2:
+                param_list = self.sample(interval, n, seen)
+            else:
+                param_list = self.propose(interval, np.array(X), np.array(y), seen)[:n]
+
+
+SEARCH_METHODS = {
+    'halving': SuccessiveHalving,
+    'gp': GaussianProcessSearch
+}
+
+
+def create_search(runner: Runner) -> Search:
+    """Create the search of the `search` config of a strategy"""
+    cfg = dict(runner.get('search'))
+    method = cfg.pop('method', 'halving')
+    # The number of the best points to plot
+    cfg.pop('top', None)
+    if method not in SEARCH_METHODS:
+        raise ValueError(f"Unknown search method {method}, one of {list(SEARCH_METHODS)}")
+    return SEARCH_METHODS[method](runner, **cfg)
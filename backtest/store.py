@@ -0,0 +1,187 @@
+"""The content-addressed store of backtest results
+
+A result is keyed by the hash of (strategy class, params label, symbol,
+interval, data watermark and rows, code/config hash), so a unit is computed again
+only when its data, its strategy code or its config changes.
+
+All strategies, params and symbols of a work dir are kept in one `results`
+table with a typed column per metric, see `backtest.metrics`. The output
+CSV files are only an exported view of the table.
+"""
+
+import hashlib
+import time
+import pandas as pd
+
+from sqlalchemy import MetaData
+from sqlalchemy import Table, Column, Integer, Float, String
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import create_engine
+
+from backtest.metrics import METRICS, encode_stats, decode_frame
+
+
+# The version of the table schema, the results of another version are dropped
+SCHEMA_VERSION = 2
+
+# The max number of bound keys in one query
+MAX_KEYS = 500
+
+# The metric types to the column types
+COLUMN_TYPES = {
+    'datetime': Integer,
+    'timedelta': Integer,
+    'int': Integer,
+    'float': Float
+}
+
+
+def add_result_table(metadata_obj):
+    return Table(
+        "results",
+        metadata_obj,
+        # the hash of the result key
+        Column('key', String, primary_key=True),
+        # the strategy class
+        Column('strategy', String, index=True),
+        # the label of the params
+        Column('label', String),
+        # the symbol
+        Column('symbol', String),
+        # the kline interval
+        Column('interval', String),
+        # the open time of the latest kline
+        Column('watermark', Integer),
+        # the hash of the strategy code and config
+        Column('code_hash', String),
+        # the creation time in unix time format
+        Column('created', Integer),
+        # the metrics
+        *[Column(key, COLUMN_TYPES[kind]) for _, key, kind in METRICS]
+    )
+
+
+def make_key(strategy: str, label: str, symbol: str, interval: str,
+             watermark: int, code_hash: str, rows: int | None = None, panel: str = '') -> str:
+    """Create the content address of a result
+
+    The `rows` of the klines tell a backfill before the watermark. The
+    `panel` is the keys of the tokens simulated together with the symbol,
+    whose stats depend on them, see `BacktestEngine._exec_panel`.
+    """
+    content = '|'.join([strategy, label, symbol, interval, str(watermark), code_hash])
+    if rows is not None:
+        content += f'|{rows}'
+    if panel:
+        content += f'|{panel}'
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class ResultStore:
+    """The store of backtest results
+
+    >>> store = ResultStore('bt_dir/results.db')
+    >>> key = make_key('RSIStrategy', '30m_10_20x80', 'BTCUSDT', '30m', watermark, code_hash)
+    >>> store.add(dict(key=key, strategy='RSIStrategy', ...), stats)
+    >>> store.flush()
+    >>> df = store.load('RSIStrategy', code_hash)
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        self.path = path
+        self.db_url = f'sqlite:///{path}'
+        self.metadata = MetaData()
+        self.results = add_result_table(self.metadata)
+        self.engine = None
+        self.batch_size = batch_size
+        self.pending = list()
+
+    def create_engine(self, echo: bool = False):
+        """Create or get the db engine"""
+        if self.engine is None:
+            self.engine = create_engine(self.db_url, echo=echo)
+            with self.engine.begin() as conn:
+                version = conn.execute(text('PRAGMA user_version')).scalar()
+                if version != SCHEMA_VERSION:
+                    self.results.drop(conn, checkfirst=True)
+                    conn.execute(text(f'PRAGMA user_version = {SCHEMA_VERSION}'))
+            self.metadata.create_all(self.engine)
+        return self.engine
+
+    def exists(self, keys: list) -> set:
+        """Get the keys which are already computed"""
+        engine = self.create_engine()
+        found = set()
+        with engine.connect() as conn:
+            for i in range(0, len(keys), MAX_KEYS):
+                stmt = select(self.results.c.key).where(
+                    self.results.c.key.in_(keys[i:i + MAX_KEYS])
+                )
+                found.update(conn.execute(stmt).scalars())
+        return found
+
+    def add(self, record: dict, stats: pd.Series):
+        """Add a result, the record holds the key columns
+
+        The results are written in batches of `batch_size`.
+        """
+        self.pending.append(dict(record, **encode_stats(stats)))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending results, an existing key is replaced"""
+        if len(self.pending) == 0:
+            return
+        created = int(time.time())
+        rows = [dict(r, created=created) for r in self.pending]
+        stmt = sqlite_insert(self.results)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.results.c.key],
+            set_={c.name: stmt.excluded[c.name] for c in self.results.c if c.name != 'key'}
+        )
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+        self.pending = list()
+
+    def load(self, strategy: str | None = None, code_hash: str | None = None,
+             labels: list | None = None, keys: list | None = None) -> pd.DataFrame:
+        """Load the typed results with the stats names as columns
+
+        Only the latest watermark of each (strategy, label, symbol) is kept.
+        """
+        engine = self.create_engine()
+        stmt = select(self.results)
+        if strategy is not None:
+            stmt = stmt.where(self.results.c.strategy == strategy)
+        if code_hash is not None:
+            stmt = stmt.where(self.results.c.code_hash == code_hash)
+        if labels is not None:
+            stmt = stmt.where(self.results.c.label.in_(labels))
+        if keys is None:
+            stmts = [stmt]
+        else:
+            stmts = [
+                stmt.where(self.results.c.key.in_(keys[i:i + MAX_KEYS]))
+                for i in range(0, max(len(keys), 1), MAX_KEYS)
+            ]
+        df = pd.concat([pd.read_sql(one, engine) for one in stmts])
+        df = df.sort_values(['watermark', 'created'])
+        df = df.drop_duplicates(['strategy', 'label', 'symbol'], keep='last')
+        return decode_frame(df)
+
+    def export_csv(self, df: pd.DataFrame, fp: str, symbols: list | None = None,
+                   names: list | None = None):
+        """Export the results of a label into CSV file, sorted by total return
+
+        Only the metrics of `names` are exported if given.
+        """
+        df = df.set_index('symbol')
+        if symbols is not None:
+            df = df.reindex([s for s in symbols if s in df.index])
+        df = df[names or [name for name, _, _ in METRICS]]
+        df.index.name = 'Token'
+        df = df.sort_values(by='Total Return [%]', ascending=False)
+        df.to_csv(fp)
@@ -1,13 +1,21 @@
-from datetime import datetime
-import vectorbt as vbt
+import pandas as pd
 
 from backtest.base import Runner
 from backtest.data import BinanceData
+from backtest.kernels import rsi_threshold_nb
+from backtest.incremental import rsi_threshold_step_nb, RSI_THRESHOLD_STATE
 
 
 class RSIStrategy(Runner):
     """The RSI Strategy"""
 
+    volatile_keys = Runner.volatile_keys + ('windows',)
+
+    signal_kernel = staticmethod(rsi_threshold_nb)
+
+    live_kernel = staticmethod(rsi_threshold_step_nb)
+    live_state = RSI_THRESHOLD_STATE
+
     def create_label(self, interval: str = '5m', window: int = 10, min_rsi: int = 5, max_rsi: int = 10):
         """Create label for this set of parameters"""
         return f'{interval}_{window}_{min_rsi}x{max_rsi}'
@@ -25,17 +33,24 @@ class RSIStrategy(Runner):
                     ))
         return args
 
+    def valid_parameters(self, interval: str = '4h', window: int = 4, min_rsi: int = 20, max_rsi: int = 80):
+        return window > 1 and min_rsi < max_rsi
+
+    def kernel_args(self, interval: str = '4h', window: int = 4, min_rsi: int = 20, max_rsi: int = 80):
+        return window, min_rsi, max_rsi
+
+    def live_window(self, interval: str = '4h', window: int = 4, min_rsi: int = 20, max_rsi: int = 80):
+        return window
+
     def run(self, symbol: str, interval: str = '4h', window: int = 4, min_rsi: int = 20, max_rsi: int = 80):
-        start = self.get("start", datetime(2023, 10, 1))
-        df = BinanceData.load([symbol], interval=interval, start=start)
-        price = df.get('Close')
+        price = self.load_price(symbol, interval)
         # Use MA
         # rsi = vbt.RSI.run(price, window=14, short_name="rsi")
         # https://github.com/polakowo/vectorbt/blob/master/examples/MACDVolume.ipynb
 
-        rsi = vbt.RSI.run(price, window)
-        entries = rsi.rsi_below(min_rsi)
-        exits = rsi.rsi_above(max_rsi)
+        entries, exits = self.generate_signals(
+            price, [dict(window=window, min_rsi=min_rsi, max_rsi=max_rsi)]
+        )
         # Note:
         # 1. entries and exits are pandas.core.series.Series with dtype ='bool', and
         #    entries.index.name = 'Open time'
@@ -45,6 +60,28 @@ class RSIStrategy(Runner):
         #    price.name = 'Close'
         # 3. price, entries, exits have the same length
         #    len(price) = len(entries) = len(exits)
-        init_cash = self.get("init_cash", 10000)
-        return vbt.Portfolio.from_signals(price, entries, exits, init_cash=init_cash)
+        return self.simulate(price, entries, exits)
+
+
+    def run_batch(self, symbol: str, param_list: list):
+        price = self.load_price(symbol, param_list[0]['interval'])
+
+        # Each param set is a column
+        entries, exits = self.generate_signals(price, param_list)
+
+        return self.simulate(price, entries, exits)
+
+    def run_panel(self, symbols: list, interval: str = '4h', window: int = 4, min_rsi: int = 20, max_rsi: int = 80):
+        start = self.get_start()
+        data = BinanceData.load(symbols, interval=interval, start=start, skip_missing=True,
+                                columns=['Close'])
+        price = data.get('Close')
+        if isinstance(price, pd.Series):
+            price = price.to_frame(data.symbols[0])
+
+        # Keep the symbols as the columns
+        entries, exits = self.generate_signals(
+            price, [dict(interval=interval, window=window, min_rsi=min_rsi, max_rsi=max_rsi)]
+        )
 
+        return self.simulate(price, entries, exits)
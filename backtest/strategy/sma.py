@@ -1,8 +1,9 @@
-from datetime import datetime
-import vectorbt as vbt
+import pandas as pd
 
 from backtest.base import Runner
 from backtest.data import BinanceData
+from backtest.kernels import sma_cross_nb
+from backtest.incremental import sma_cross_step_nb, SMA_CROSS_STATE
 
 
 __all__ = [
@@ -13,6 +14,11 @@ __all__ = [
 class DualSMAStrategy(Runner):
     """The RSI Strategy"""
 
+    signal_kernel = staticmethod(sma_cross_nb)
+
+    live_kernel = staticmethod(sma_cross_step_nb)
+    live_state = SMA_CROSS_STATE
+
     def create_label(self, interval: str = '5m', fast_n: int = 5, slow_n: int = 10):
         """Create label for this set of parameters"""
         return f'{interval}_{fast_n}x{slow_n}'
@@ -28,19 +34,45 @@ class DualSMAStrategy(Runner):
                 ))
         return args
 
+    def valid_parameters(self, interval: str = '4h', fast_n: int = 5, slow_n: int = 10):
+        return 0 < fast_n < slow_n
+
+    def kernel_args(self, interval: str = '4h', fast_n: int = 5, slow_n: int = 10):
+        return fast_n, slow_n
+
+    def live_window(self, interval: str = '4h', fast_n: int = 5, slow_n: int = 10):
+        return max(fast_n, slow_n)
+
     def run(self, symbol: str, interval: str = '4h', fast_n: int = 5, slow_n: int = 10):
-        start = self.get("start", datetime(2023, 10, 1))
-        df = BinanceData.load([symbol], interval=interval, start=start)
-        price = df.get('Close')
+        price = self.load_price(symbol, interval)
         
-        fast_ma = vbt.MA.run(price, fast_n)
-        slow_ma = vbt.MA.run(price, slow_n)
-        entries = fast_ma.ma_crossed_above(slow_ma)
-        exits = fast_ma.ma_crossed_below(slow_ma)
+        entries, exits = self.generate_signals(price, [dict(fast_n=fast_n, slow_n=slow_n)])
         
-        init_cash = self.get("init_cash", 10000)
-        return vbt.Portfolio.from_signals(price, entries, exits, init_cash=init_cash)
+        return self.simulate(price, entries, exits)
     
+    def run_batch(self, symbol: str, param_list: list):
+        price = self.load_price(symbol, param_list[0]['interval'])
+
+        # Each param set is a column
+        entries, exits = self.generate_signals(price, param_list)
+
+        return self.simulate(price, entries, exits)
+
+    def run_panel(self, symbols: list, interval: str = '4h', fast_n: int = 5, slow_n: int = 10):
+        start = self.get_start()
+        data = BinanceData.load(symbols, interval=interval, start=start, skip_missing=True,
+                                columns=['Close'])
+        price = data.get('Close')
+        if isinstance(price, pd.Series):
+            price = price.to_frame(data.symbols[0])
+
+        # Keep the symbols as the columns
+        entries, exits = self.generate_signals(
+            price, [dict(interval=interval, fast_n=fast_n, slow_n=slow_n)]
+        )
+
+        return self.simulate(price, entries, exits)
+
     def show(self):
         pass
 
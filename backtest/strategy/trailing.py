@@ -0,0 +1,44 @@
+import numpy as np
+
+from backtest.base import OrderRunner
+from backtest.callbacks import sma_columns_nb, trailing_stop_pre_sim_nb, trailing_stop_order_nb
+
+
+__all__ = [
+    'TrailingStopStrategy'
+]
+
+
+class TrailingStopStrategy(OrderRunner):
+    """The SMA entry with a trailing stop exit
+
+    The `params` are the (window, stop) pairs, e.g. [[20, 0.05]], and the
+    `size` of the config is the fraction of the cash of an entry.
+    """
+
+    order_func = staticmethod(trailing_stop_order_nb)
+    pre_sim_func = staticmethod(trailing_stop_pre_sim_nb)
+
+    def create_label(self, interval: str = '4h', window: int = 20, stop: float = 0.05):
+        """Create label for this set of parameters"""
+        return f'{interval}_{window}_{stop:g}'
+
+    def iter_parameters(self) -> list:
+        args = list()
+        for interval in self.get('intervals', []):
+            for (window, stop) in self.get('params', []):
+                args.append(dict(
+                    interval=interval,
+                    window=window,
+                    stop=stop
+                ))
+        return args
+
+    def valid_parameters(self, interval: str = '4h', window: int = 20, stop: float = 0.05):
+        return window > 1 and 0 < stop < 1
+
+    def order_args(self, close: np.ndarray, param_list: list) -> tuple:
+        window = np.asarray([params['window'] for params in param_list], dtype=np.int64)
+        stop = np.asarray([params['stop'] for params in param_list], dtype=np.float64)
+        size = np.full(len(param_list), self.get('size', 1.0), dtype=np.float64)
+        return sma_columns_nb(close, window), stop, size
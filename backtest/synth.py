@@ -0,0 +1,105 @@
+"""The generator of synthetic kline dbs
+
+The prices are geometric random walks seeded per symbol and interval, so the
+same arguments always give the same dbs, e.g. for the benchmarks:
+
+    python -m backtest.synth /tmp/klines --symbols 20 --intervals 30m 4h --years 2
+"""
+
+import os
+import argparse
+import logging
+import zlib
+import numpy as np
+import pandas as pd
+
+from backtest.db import KlineDb, KLINE_INTERVALS
+from backtest.log import create_log
+from backtest.utils import parse_interval
+
+
+log = logging.getLogger(__name__)
+
+
+# 2023-01-01 00:00:00 UTC
+DEFAULT_START = 1672531200000
+
+YEAR_MS = 365 * 24 * 60 * 60 * 1000
+
+
+def synth_symbols(n: int) -> list:
+    return [f'SYN{i:03d}USDT' for i in range(n)]
+
+
+def synth_klines(symbol: str, interval: str, start: int, bars: int, seed: int = 0) -> pd.DataFrame:
+    """Generate the klines of a symbol as a frame of the kline fields"""
+    rng = np.random.default_rng([seed, zlib.crc32(f'{symbol}-{interval}'.encode())])
+    step = parse_interval(interval)
+    s = start + np.arange(bars, dtype=np.int64) * step
+    c = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    o = np.r_[c[0], c[:-1]]
+    bv = rng.random(bars) * 10
+    n = rng.integers(1, 100, bars)
+    return pd.DataFrame(dict(
+        s=s,
+        o=o,
+        h=np.maximum(o, c) * (1 + rng.random(bars) * 0.002),
+        l=np.minimum(o, c) * (1 - rng.random(bars) * 0.002),
+        c=c,
+        bv=bv,
+        e=s + step - 1,
+        qv=bv * c,
+        n=n,
+        tbbv=bv / 2,
+        tbqv=bv * c / 2,
+        i=0
+    ))
+
+
+def generate_klinedb(path: str, symbols: int | list = 10, intervals: list | None = None,
+                     years: float = 1, start: int = DEFAULT_START, seed: int = 0) -> list:
+    """Generate the synthetic kline dbs under the path
+
+    Args:
+        path: str, the dir of the kline dbs
+        symbols: int or list, the number of symbols or the symbols
+        intervals: list, the stored intervals, all by default
+        years: float, the years of bars of each interval
+        start: int, the open time of the first bar
+        seed: int, the random seed
+
+    Returns:
+        the symbols.
+    """
+    if isinstance(symbols, int):
+        symbols = synth_symbols(symbols)
+    intervals = intervals or KLINE_INTERVALS
+    os.makedirs(path, exist_ok=True)
+    for symbol in symbols:
+        kdb = KlineDb(symbol, path)
+        kdb.enable_wal()
+        kdb.create_tables()
+        for interval in intervals:
+            bars = int(years * YEAR_MS // parse_interval(interval))
+            df = synth_klines(symbol, interval, start, bars, seed=seed)
+            kdb.upsert(interval, df.to_dict('records'))
+        kdb.dispose()
+        log.info('generate %s: %s', symbol, intervals)
+    return symbols
+
+
+def run():
+    create_log("backtest")
+    parser = argparse.ArgumentParser(description='Generate synthetic kline dbs')
+    parser.add_argument('path', type=str, help="the dir of the kline dbs")
+    parser.add_argument('--symbols', type=int, default=10, help="the number of symbols")
+    parser.add_argument('--intervals', nargs='+', default=KLINE_INTERVALS, help="the stored intervals")
+    parser.add_argument('--years', type=float, default=1, help="the years of bars")
+    parser.add_argument('--seed', type=int, default=0, help="the random seed")
+    args = parser.parse_args()
+    generate_klinedb(args.path, symbols=args.symbols, intervals=args.intervals,
+                     years=args.years, seed=args.seed)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,143 @@
+"""The timing spans of the backtest stages
+
+The stages are timed by spans tagged with the current symbol and label:
+
+    >>> configure_profiler(enabled=True)
+    >>> with profiler.context(symbol='BTCUSDT', label='30m_3x6'):
+    ...     with span('read'):
+    ...         df = read_frame(...)
+
+The stages of a backtest are:
+
+    - read: the kline arrays read from sqlite or the columnar cache
+    - convert: the resampling and the conversion of arrays into frames
+    - align: the alignment of the symbols by vectorbt
+    - signals: the signal kernel of the strategy
+    - simulate: the portfolio simulation
+    - stats: the metrics of the portfolio
+    - train, test: the folds of the walk-forward including simulate and stats
+    - run: the whole strategy run including read, ..., simulate
+    - plot: the plots of `show` and `BoxPlot`
+    - import: the imports of the engine, the strategies and the plots, which
+      are not tagged by a symbol and only in the summary and the json
+
+and the engine also times its planning, result store, live checkpoints and
+CSV export. A failing span records its error. The spans are disabled by
+default, then a span costs nothing but a call.
+"""
+
+import time
+import json
+import logging
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+
+log = logging.getLogger(__name__)
+
+
+# The stages in the columns of the timing table
+STAGES = ['read', 'convert', 'align', 'signals', 'simulate', 'stats', 'train', 'test', 'run', 'plot']
+
+
+class Profiler:
+    """Collect the timing spans"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.tags = dict()
+        self.spans = list()
+
+    @contextmanager
+    def context(self, **tags):
+        """Tag the spans in the context"""
+        previous = self.tags
+        self.tags = dict(previous, **tags)
+        try:
+            yield
+        finally:
+            self.tags = previous
+
+    @contextmanager
+    def _span(self, stage: str):
+        record = dict(self.tags, stage=stage, seconds=0.0, error=None)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        except Exception as ex:
+            record['error'] = f'{type(ex).__name__}: {ex}'
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - t0
+            self.spans.append(record)
+
+    def span(self, stage: str):
+        """Time a stage"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(stage)
+
+    def record(self, stage: str, seconds: float, **tags):
+        """Record a stage timed before the profiler was configured"""
+        if self.enabled:
+            self.spans.append(dict(self.tags, **tags, stage=stage, seconds=seconds, error=None))
+
+    def drain(self) -> list:
+        """Take the collected spans, e.g. to return them from a worker process"""
+        spans, self.spans = self.spans, list()
+        return spans
+
+    def extend(self, spans: list):
+        self.spans.extend(spans)
+
+    def table(self) -> pd.DataFrame:
+        """Get the seconds of each stage and the error per (symbol, label)"""
+        df = pd.DataFrame(self.spans, columns=['symbol', 'label', 'stage', 'seconds', 'error'])
+        df = df.dropna(subset=['symbol'])
+        if len(df) == 0:
+            return pd.DataFrame(columns=['symbol', 'label'] + STAGES + ['total', 'error'])
+        df['label'] = df['label'].fillna('')
+        table = df.pivot_table(index=['symbol', 'label'], columns='stage', values='seconds',
+                               aggfunc='sum', fill_value=0.0)
+        table = table.reindex(columns=STAGES, fill_value=0.0)
+        # The nested stages are included in `run`
+        table['total'] = table['run'] + table['stats'] + table['plot']
+        errors = df.dropna(subset=['error']).groupby(['symbol', 'label'])['error'].first()
+        table['error'] = errors.reindex(table.index)
+        return table.reset_index()
+
+    def write(self, prefix: str) -> pd.DataFrame:
+        """Write the timing table into {prefix}.csv and the spans into {prefix}.json"""
+        table = self.table()
+        table.to_csv(f'{prefix}.csv', index=False)
+        with open(f'{prefix}.json', 'w') as f:
+            json.dump(dict(spans=self.spans, table=table.to_dict('records')), f, indent=2, default=str)
+        return table
+
+    def summary(self, top: int = 10):
+        """Log the time of the stages, the slowest symbols and the failed units"""
+        if len(self.spans) == 0:
+            return
+        stages = pd.DataFrame(self.spans).groupby('stage', sort=False)['seconds'].sum()
+        log.info('Time of stages: %s', {k: round(v, 3) for k, v in stages.items()})
+        table = self.table()
+        slowest = table.groupby('symbol')['total'].sum().sort_values(ascending=False)
+        for symbol, seconds in slowest.head(top).items():
+            log.info('slow %s: %.3fs', symbol, seconds)
+        failed = table.dropna(subset=['error'])
+        if len(failed) > 0:
+            log.warning('%d units failed', len(failed))
+
+
+# The process-wide profiler, disabled until configured
+profiler = Profiler()
+
+
+def configure_profiler(enabled: bool = False):
+    profiler.enabled = enabled
+    return profiler
+
+
+def span(stage: str):
+    """Time a stage by the process-wide profiler"""
+    return profiler.span(stage)
@@ -53,10 +53,50 @@ def load_yaml_config(fp: str) -> dict:
     return cfg
 
 
+def parse_size(size: int | str) -> int:
+    """parse memory size such as 512MB, 2GB into bytes"""
+    if isinstance(size, (int, float)):
+        return int(size)
+    units = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4, 'B': 1}
+    text = size.strip().upper()
+    for unit, scale in units.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * scale)
+    return int(text)
+
+
+# The interval units in milliseconds
+INTERVAL_UNITS = {
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000
+}
+
+
+def parse_interval(interval: str) -> int:
+    """parse kline interval such as 15m, 2h, 3d into milliseconds"""
+    text = interval.strip()
+    unit = INTERVAL_UNITS.get(text[-1:])
+    if unit is None or not text[:-1].isdigit():
+        raise ValueError(f"Invalid interval {interval}")
+    return int(text[:-1]) * unit
+
+
 def read_file(fn: str):
     lines = list()
     with open(fn, 'r') as f:
         for line in map(str.strip, f):
             if len(line) > 0:
                 lines.append(line)
-    return lines
\ No newline at end of file
+    return lines
+
+
+def parse_seconds(value: int | float | str | None) -> float | None:
+    """parse a duration such as 30s, 30m, 2h or the seconds"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = value.strip()
+    if text.endswith('s'):
+        return float(text[:-1])
+    return parse_interval(text) / 1000
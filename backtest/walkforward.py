@@ -0,0 +1,157 @@
+"""The walk-forward optimization
+
+The history of a symbol is split into folds of a train window followed by a
+test window. The best parameters of each train window by a metric are then
+evaluated on its test window out of sample, e.g. in the strategy config:
+
+    walk_forward: {
+        train: 90d,
+        test: 30d,
+        step: 30d,
+        anchored: false,
+        metric: 'Total Return [%]',
+        minimize: false
+    }
+
+The rolling train windows have a fixed length, and the anchored ones all
+start at the first bar. The `step` is the `test` by default, and the last
+test window could be partial.
+
+The signals of all parameters are generated once over the whole history by
+the `signal_kernel` of the strategy, and each fold only slices them, so the
+indicators are warmed up at the start of every window and the prices are
+loaded once per symbol and interval.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from backtest.base import Runner
+from backtest.metrics import compute_stats
+from backtest.timing import profiler, span
+from backtest.utils import parse_interval
+
+
+log = logging.getLogger(__name__)
+
+
+class WalkForward:
+    """The train/test splits of the walk-forward optimization"""
+
+    def __init__(self, train: str, test: str, step: str | None = None, anchored: bool = False,
+                 metric: str = 'Total Return [%]', minimize: bool = False):
+        self.train = parse_interval(train)
+        self.test = parse_interval(test)
+        self.step = parse_interval(step) if step else self.test
+        self.anchored = anchored
+        self.metric = metric
+        self.minimize = minimize
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        return cls(**cfg)
+
+    def split(self, index: pd.DatetimeIndex) -> list:
+        """Split the index into folds
+
+        Returns:
+            the (train start, test start, test end) positions of each fold.
+        """
+        if len(index) == 0:
+            return []
+        t = index.asi8 // 10 ** 6
+        folds = list()
+        start = t[0]
+        while start + self.train <= t[-1]:
+            train_start = t[0] if self.anchored else start
+            test_start = start + self.train
+            i0, i1, i2 = np.searchsorted(t, [train_start, test_start, test_start + self.test])
+            if i1 > i0 and i2 > i1:
+                folds.append((int(i0), int(i1), int(i2)))
+            start += self.step
+        return folds
+
+    def select(self, values: pd.Series) -> str | None:
+        """Select the label of the best metric"""
+        values = values.replace([np.inf, -np.inf], np.nan).dropna()
+        if len(values) == 0:
+            return None
+        return values.idxmin() if self.minimize else values.idxmax()
+
+    def run(self, runner: Runner, price: pd.Series, entries: pd.DataFrame,
+            exits: pd.DataFrame) -> list:
+        """Run the folds on the signals of all labels
+
+        Returns:
+            a row per fold of the windows, the best label, its train metric
+            and its test stats.
+        """
+        names = runner.get_metrics()
+        rows = list()
+        for k, (i0, i1, i2) in enumerate(self.split(price.index)):
+            train = slice(i0, i1)
+            test = slice(i1, i2)
+            with span('train'):
+                pf = runner.simulate(price.iloc[train], entries.iloc[train], exits.iloc[train])
+                values = compute_stats(pf, [self.metric])[self.metric]
+            label = self.select(values)
+            if label is None:
+                continue
+            with span('test'):
+                pf = runner.simulate(price.iloc[test], entries[label].iloc[test], exits[label].iloc[test])
+                stats = pf.stats() if names is None else compute_stats(pf, names).iloc[0]
+            rows.append({
+                'Fold': k,
+                'Train Start': price.index[i0],
+                'Train End': price.index[i1 - 1],
+                'Test Start': price.index[i1],
+                'Test End': price.index[i2 - 1],
+                'Label': label,
+                f'Train {self.metric}': values[label],
+                **stats.to_dict()
+            })
+        return rows
+
+
+def walk_forward_token(runner: Runner, token: str, param_list: list) -> tuple:
+    """Run the walk-forward of a token on all the parameters, the work unit
+
+    Returns:
+        (token, rows, errors, spans), the errors are keyed by interval.
+    """
+    wf = WalkForward.from_config(runner.get('walk_forward'))
+    rows, errors = list(), dict()
+    for group in runner.group_parameters(param_list):
+        interval = group[0]['interval']
+        try:
+            log.info('walk forward %s on %d parameters of %s ...', token, len(group), interval)
+            with profiler.context(symbol=token, label=interval), span('run'):
+                price = runner.load_price(token, interval)
+                entries, exits = runner.generate_signals(price, group)
+                if len(group) == 1:
+                    # Keep the label of a single parameter set
+                    entries = entries.to_frame(runner.create_label(**group[0]))
+                    exits = exits.to_frame(runner.create_label(**group[0]))
+                for row in wf.run(runner, price, entries, exits):
+                    rows.append(dict(Token=token, Interval=interval, **row))
+        except Exception as ex:
+            errors[interval] = f'{type(ex).__name__}: {ex}'
+    return token, rows, errors, profiler.drain()
+
+
+def summarize(df: pd.DataFrame) -> pd.DataFrame:
+    """Summarize the out of sample results per token and interval"""
+    if len(df) == 0:
+        return pd.DataFrame()
+    grouped = df.groupby(['Token', 'Interval'], sort=False)
+    summary = pd.DataFrame({
+        'Folds': grouped.size(),
+        'OOS Return [%]': grouped['Total Return [%]'].apply(
+            lambda r: ((1 + r / 100).prod() - 1) * 100
+        ),
+        'Mean Test Return [%]': grouped['Total Return [%]'].mean(),
+        'Winning Folds': grouped['Total Return [%]'].apply(lambda r: int((r > 0).sum())),
+        'Top Label': grouped['Label'].agg(lambda labels: labels.value_counts().index[0])
+    })
+    return summary.sort_values('OOS Return [%]', ascending=False)
@@ -0,0 +1,81 @@
+"""The warm-up of the numba caches
+
+The numba functions of the resampling and the signal kernels are compiled
+on their first call and cached on disk by `cache=True`. The warm-up compiles
+them ahead of a run on synthetic klines, so the worker processes load the
+compiled code instead of compiling it at the same time:
+
+    python runbt.py -f config.yaml warmup
+
+The simulation and the metrics of vectorbt take their callbacks as arguments,
+e.g. the order callbacks of `backtest.callbacks`, numba could not cache them
+on disk and they are still compiled once per process, the warm-up only
+reports their time.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from backtest.base import Runner, OrderRunner
+from backtest.db import KLINE_FIELDS, INT_FIELDS
+from backtest.metrics import compute_stats
+from backtest.resample import resample_columns
+from backtest.synth import DEFAULT_START, synth_klines
+from backtest.timing import span
+
+
+log = logging.getLogger(__name__)
+
+
+def warm_up_resample(bars: int = 1000):
+    """Compile the aggregations of the resampling"""
+    df = synth_klines('WARMUP', '1m', DEFAULT_START, bars)
+    columns = {
+        name: df[name].to_numpy(np.int64 if name in INT_FIELDS else np.float64)
+        for name in KLINE_FIELDS
+    }
+    for interval in ('5m', '1w'):
+        resample_columns(columns, interval)
+
+
+def warm_up_parameters(runner: Runner) -> list:
+    """Get a batch of the parameters of a strategy, or sampled by its search without a grid"""
+    param_list = runner.iter_parameters()
+    if param_list:
+        return runner.group_parameters(param_list)[0]
+    if runner.get('search'):
+        from backtest.search import create_search
+        interval = (runner.get('intervals') or ['1h'])[0]
+        return create_search(runner).sample(interval, 2, set())
+    return []
+
+
+def warm_up_runner(runner: Runner, bars: int = 500):
+    """Compile the signal kernel or the order callbacks, the simulation and the metrics of a strategy"""
+    df = synth_klines('WARMUP', '1h', DEFAULT_START, bars)
+    price = pd.Series(df['c'].to_numpy(), index=pd.to_datetime(df['s'], unit='ms', utc=True),
+                      name='Close')
+    names = runner.get_metrics()
+    param_list = warm_up_parameters(runner)
+    orders = isinstance(runner, OrderRunner) and runner.supports_orders()
+    if not param_list and (orders or runner.supports_kernel()):
+        log.info('No parameters of %s, its kernel is not warmed up', runner.__class__.__name__)
+    if orders and param_list:
+        for group in (param_list[:2], param_list[:1]):
+            pf = runner.simulate_orders(price, group)
+            with span('stats'):
+                compute_stats(pf, names)
+    elif runner.supports_kernel() and param_list:
+        # A batch of the parameters and a single one take different paths
+        for group in (param_list[:2], param_list[:1]):
+            with span('signals'):
+                entries, exits = runner.generate_signals(price, group)
+            pf = runner.simulate(price, entries, exits)
+            with span('stats'):
+                compute_stats(pf, names)
+    else:
+        entries = price > price.shift(1)
+        pf = runner.simulate(price, entries, ~entries)
+        with span('stats'):
+            compute_stats(pf, names)
@@ -0,0 +1,383 @@
+"""The SQLite work queue of the distributed backtests
+
+With a `queue` in the config, the engine enqueues its work units into a
+SQLite db on a filesystem shared by the nodes instead of running them:
+
+    - queue: {
+        path: /shared/bt/queue.db,
+        shard_size: 4,
+        lease: 5m,
+        max_attempts: 3,
+        work: true
+      }
+
+A queue unit is the runner of a strategy, the pending parameters and a shard
+of `shard_size` symbols. The workers on any node run the units:
+
+    python runbt.py worker /shared/bt/queue.db -w 8
+
+A worker claims a unit with a lease of `lease`, and renews the lease by a
+heartbeat while running it. The unit of an expired lease, e.g. of a killed
+worker, is claimed again until `max_attempts`, then it fails. The engine is
+the coordinator: it merges the results of the finished units into the
+result store of the work dir, so the outputs are the same as a local run,
+and it runs units itself too unless `work: false`.
+
+The leases compare the clocks of the nodes, which should be synchronized.
+The db uses the rollback journal, since the WAL does not work over a network
+filesystem, and each transaction is short.
+"""
+
+import os
+import time
+import json
+import pickle
+import socket
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import MetaData
+from sqlalchemy import Table, Column, Integer, Float, String, LargeBinary
+from sqlalchemy import select, update, delete, func, case, and_, or_
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from backtest.db import dispose_klinedbs
+from backtest.engine import init_worker, run_token
+from backtest.log import create_log
+from backtest.utils import parse_seconds
+
+
+log = logging.getLogger(__name__)
+
+
+# The status of a unit
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+MERGED = 'merged'
+
+
+def add_queue_tables(metadata_obj) -> tuple:
+    jobs = Table(
+        "jobs",
+        metadata_obj,
+        Column('id', Integer, primary_key=True),
+        # the pickled runner of the strategy
+        Column('runner', LargeBinary),
+        # the json options of the worker processes, see `init_worker`
+        Column('options', String),
+        # the creation time in unix time format
+        Column('created', Integer)
+    )
+    units = Table(
+        "units",
+        metadata_obj,
+        Column('id', Integer, primary_key=True),
+        Column('job', Integer, index=True),
+        Column('status', String, index=True),
+        # the pickled (token, parameters, result keys) of the shard
+        Column('payload', LargeBinary),
+        # the pickled results of `run_token`
+        Column('result', LargeBinary),
+        Column('error', String),
+        # the worker holding the lease, host:pid
+        Column('owner', String),
+        Column('attempts', Integer, default=0),
+        Column('max_attempts', Integer),
+        # the lease in seconds and its expiry in unix time
+        Column('lease', Float),
+        Column('lease_until', Float)
+    )
+    return jobs, units
+
+
+def get_owner() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    """The work queue in a SQLite db
+
+    >>> queue = WorkQueue('/shared/bt/queue.db')
+    >>> job = queue.submit(runner, [[(token, param_list, keys)]], options)
+    >>> unit = queue.claim(get_owner())
+    >>> queue.complete(unit['id'], owner, results)
+    >>> for status, payload, results, error in queue.collect(job):
+    ...     pass
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db_url = f'sqlite:///{path}'
+        self.metadata = MetaData()
+        self.jobs, self.units = add_queue_tables(self.metadata)
+        self.engine = None
+
+    def create_engine(self, echo: bool = False):
+        """Create or get the db engine"""
+        if self.engine is None:
+            # Wait for the locks of the other nodes
+            self.engine = create_engine(self.db_url, echo=echo, connect_args={'timeout': 60})
+            try:
+                self.metadata.create_all(self.engine)
+            except OperationalError:
+                # The tables are created by another worker at the same time
+                self.metadata.create_all(self.engine)
+        return self.engine
+
+    def submit(self, runner, shards: list, options: dict, lease: float = 300,
+               max_attempts: int = 3) -> int:
+        """Enqueue the shards of a runner as a job
+
+        Args:
+            runner: the strategy instance
+            shards: list, the (token, parameters, result keys) of each shard
+            options: dict, the keyword arguments of `init_worker`
+            lease: float, the seconds of a lease
+            max_attempts: int, the max claims of a unit
+
+        Returns:
+            the job id.
+        """
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            job = conn.execute(self.jobs.insert().values(
+                runner=pickle.dumps(runner),
+                options=json.dumps(options),
+                created=int(time.time())
+            )).inserted_primary_key[0]
+            if shards:
+                conn.execute(self.units.insert(), [
+                    dict(job=job, status=PENDING, payload=pickle.dumps(shard), attempts=0,
+                         max_attempts=max_attempts, lease=lease)
+                    for shard in shards
+                ])
+        return job
+
+    def claim(self, owner: str, job: int | None = None) -> dict | None:
+        """Claim a pending unit or a unit of an expired lease
+
+        Returns:
+            the unit with its job, runner, options and payload, or None.
+        """
+        units = self.units
+        now = time.time()
+        engine = self.create_engine()
+        # The first update locks the db, so the claim is atomic
+        with engine.begin() as conn:
+            self._expire(conn, now)
+            stmt = select(units.c.id).where(or_(
+                units.c.status == PENDING,
+                and_(units.c.status == RUNNING, units.c.lease_until < now)
+            ))
+            if job is not None:
+                stmt = stmt.where(units.c.job == job)
+            unit_id = conn.execute(stmt.order_by(units.c.id).limit(1)).scalar()
+            if unit_id is None:
+                return None
+            conn.execute(update(units).where(units.c.id == unit_id).values(
+                status=RUNNING,
+                owner=owner,
+                attempts=units.c.attempts + 1,
+                lease_until=now + units.c.lease
+            ))
+            row = conn.execute(
+                select(units.c.id, units.c.job, units.c.payload, units.c.lease, units.c.attempts,
+                       self.jobs.c.runner, self.jobs.c.options)
+                .join(self.jobs, self.jobs.c.id == units.c.job)
+                .where(units.c.id == unit_id)
+            ).first()
+        return dict(
+            id=row.id,
+            job=row.job,
+            payload=pickle.loads(row.payload),
+            lease=row.lease,
+            attempts=row.attempts,
+            runner=row.runner,
+            options=json.loads(row.options)
+        )
+
+    def expire(self, job: int | None = None) -> int:
+        """Fail the units of the expired leases after `max_attempts`
+
+        A claim does it too, and the coordinator not working on its job does
+        it while it waits.
+
+        Returns:
+            the number of the failed units.
+        """
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            return self._expire(conn, time.time(), job=job)
+
+    def _expire(self, conn, now: float, job: int | None = None) -> int:
+        units = self.units
+        stmt = update(units).where(
+            units.c.status == RUNNING,
+            units.c.lease_until < now,
+            units.c.attempts >= units.c.max_attempts
+        )
+        if job is not None:
+            stmt = stmt.where(units.c.job == job)
+        return conn.execute(stmt.values(status=FAILED, error='lease expired')).rowcount
+
+    def heartbeat(self, unit_id: int, owner: str) -> bool:
+        """Renew the lease of a unit, False if the lease is lost"""
+        units = self.units
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            result = conn.execute(update(units).where(
+                units.c.id == unit_id, units.c.owner == owner, units.c.status == RUNNING
+            ).values(lease_until=time.time() + units.c.lease))
+        return result.rowcount == 1
+
+    def complete(self, unit_id: int, owner: str, results: list) -> bool:
+        """Save the results of a unit, False if the lease is lost"""
+        units = self.units
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            result = conn.execute(update(units).where(
+                units.c.id == unit_id, units.c.owner == owner, units.c.status == RUNNING
+            ).values(status=DONE, result=pickle.dumps(results), error=None))
+        return result.rowcount == 1
+
+    def fail(self, unit_id: int, owner: str, error: str):
+        """Release a failed unit for a retry, or fail it after `max_attempts`"""
+        units = self.units
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            conn.execute(update(units).where(
+                units.c.id == unit_id, units.c.owner == owner, units.c.status == RUNNING
+            ).values(
+                status=case((units.c.attempts >= units.c.max_attempts, FAILED), else_=PENDING),
+                error=error
+            ))
+
+    def collect(self, job: int) -> list:
+        """Take the finished units of a job, which are then merged
+
+        Returns:
+            the (status, payload, results, error) of each unit.
+        """
+        units = self.units
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(units.c.id, units.c.status, units.c.payload, units.c.result, units.c.error)
+                .where(units.c.job == job, units.c.status.in_([DONE, FAILED]))
+            ).all()
+            if rows:
+                conn.execute(update(units).where(units.c.id.in_([row.id for row in rows]))
+                             .values(status=MERGED, payload=None, result=None))
+        return [
+            (row.status, pickle.loads(row.payload),
+             pickle.loads(row.result) if row.result is not None else None, row.error)
+            for row in rows
+        ]
+
+    def progress(self, job: int) -> dict:
+        """Count the units of a job by status"""
+        units = self.units
+        engine = self.create_engine()
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(units.c.status, func.count()).where(units.c.job == job)
+                .group_by(units.c.status)
+            ).all()
+        return {status: count for status, count in rows}
+
+    def remove(self, job: int):
+        """Remove a job and its units"""
+        engine = self.create_engine()
+        with engine.begin() as conn:
+            conn.execute(delete(self.units).where(self.units.c.job == job))
+            conn.execute(delete(self.jobs).where(self.jobs.c.id == job))
+
+
+@contextmanager
+def heartbeat(path: str, unit_id: int, owner: str, interval: float):
+    """Renew the lease of a unit in a thread while running it"""
+    stopped = threading.Event()
+
+    def beat():
+        # The thread has its own connections
+        queue = WorkQueue(path)
+        while not stopped.wait(interval):
+            try:
+                if not queue.heartbeat(unit_id, owner):
+                    log.warning('the lease of unit %d is lost', unit_id)
+                    return
+            except Exception as ex:
+                log.warning('heartbeat of unit %d failed: %s', unit_id, ex)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_unit(queue: WorkQueue, unit: dict, owner: str, runner) -> bool:
+    """Run the shards of a claimed unit under a heartbeat"""
+    try:
+        with heartbeat(queue.path, unit['id'], owner, unit['lease'] / 3):
+            results = [
+                run_token(runner, token, param_list, keys)
+                for token, param_list, keys in unit['payload']
+            ]
+    except Exception as ex:
+        log.warning('unit %d failed: %s', unit['id'], ex)
+        queue.fail(unit['id'], owner, f'{type(ex).__name__}: {ex}')
+        return False
+    if not queue.complete(unit['id'], owner, results):
+        log.warning('the results of unit %d are dropped, its lease is lost', unit['id'])
+        return False
+    return True
+
+
+def work(path: str, idle_exit: float | None = None, poll: float = 2.0) -> int:
+    """Run the units of a queue until idle for `idle_exit` seconds
+
+    Returns:
+        the number of units done.
+    """
+    queue = WorkQueue(path)
+    owner = get_owner()
+    job, runner, done, idle = None, None, 0, time.time()
+    while True:
+        unit = queue.claim(owner)
+        if unit is None:
+            if idle_exit is not None and time.time() - idle > idle_exit:
+                break
+            time.sleep(poll)
+            continue
+        if unit['job'] != job:
+            # The cache and the db options of the job, the connections are
+            # owned by this process, so they are closed
+            job = unit['job']
+            dispose_klinedbs(close=True)
+            init_worker(**unit['options'])
+            # Only the runner of the current job is kept
+            runner = pickle.loads(unit['runner'])
+        log.info('%s runs unit %d of job %d, attempt %d', owner, unit['id'], job, unit['attempts'])
+        done += run_unit(queue, unit, owner, runner)
+        idle = time.time()
+    log.info('worker %s done %d units', owner, done)
+    return done
+
+
+def run_workers(path: str, workers: int = 1, idle_exit: str | float | None = None):
+    """Run the worker processes of a queue, see `runbt.py worker`"""
+    create_log("backtest")
+    idle_exit = parse_seconds(idle_exit)
+    if workers <= 1:
+        return work(path, idle_exit)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work, path, idle_exit) for _ in range(workers)]
+        return sum(future.result() for future in futures)
@@ -0,0 +1,254 @@
+"""The benchmarks of the backtest stages
+
+    python -m benchmarks.bench                      # compare with the baseline
+    python -m benchmarks.bench --save-baseline      # store the new baseline
+    python -m benchmarks.bench --db /tmp/klines     # reuse the generated dbs
+
+The synthetic kline dbs of `backtest.synth` are generated in a temp dir, then
+the SMA and RSI strategies are timed stage by stage:
+
+    - load: `BinanceData.load` of the close prices, in bars/sec
+    - signals: the signal kernel of the strategy, in bars/sec of all columns
+    - portfolio: `Portfolio.from_signals`, in backtests/sec
+    - stats: the metrics of the portfolio, in backtests/sec
+    - csv: the result store and the CSV export, in backtests/sec
+    - boxplot: `BoxPlot.create_plots`, in plots/sec
+
+Each stage also reports its peak memory traced by `tracemalloc` in a second
+pass, since the tracing slows down the stages. The suite
+fails if a stage is slower or takes more memory than the stored baseline by
+more than the tolerance. The timings depend on the machine, so the baseline
+is not committed, it is saved on the machine first by `--save-baseline` and
+the suite fails without it.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+import tracemalloc
+import warnings
+from datetime import datetime
+import vectorbt as vbt
+
+import backtest.db
+from backtest.cache import configure_cache
+from backtest.data import BinanceData
+from backtest.log import create_log
+from backtest.metrics import compute_stats
+from backtest.plot import BoxPlot
+from backtest.store import ResultStore, make_key
+from backtest.synth import generate_klinedb
+from backtest.utils import import_class
+
+
+# The module runs as __main__
+log = logging.getLogger('benchmarks.bench')
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# The strategy configs of the benchmarks
+BENCHMARKS = {
+    'sma': {
+        'name': 'DualSMAStrategy',
+        'module': 'backtest.strategy.sma',
+        'intervals': ['30m', '4h'],
+        'params': [[3, 6], [4, 8], [5, 10], [10, 20], [20, 50]],
+        'start': datetime(2023, 1, 1),
+        'init_cash': 10000,
+        'output': 'backtest_sma_{label}.csv',
+        'plots': ['Total Return [%]', 'Total Trades']
+    },
+    'rsi': {
+        'name': 'RSIStrategy',
+        'module': 'backtest.strategy.rsi',
+        'intervals': ['30m', '4h'],
+        'windows': [10, 14, 20],
+        'params': [[20, 80], [25, 75], [30, 70]],
+        'start': datetime(2023, 1, 1),
+        'init_cash': 10000,
+        'output': 'backtest_rsi_{label}.csv',
+        'plots': ['Total Return [%]', 'Total Trades']
+    }
+}
+
+STAGES = {
+    'load': 'bars',
+    'signals': 'bars',
+    'portfolio': 'backtests',
+    'stats': 'backtests',
+    'csv': 'backtests',
+    'boxplot': 'plots'
+}
+
+# The time differences under the noise floor are not regressions
+MIN_SECONDS = 0.05
+
+
+class Stage:
+    """Accumulate the time and the peak traced memory of a stage"""
+
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.tracing = tracemalloc.is_tracing()
+        self.seconds = 0.0
+        self.peak = 0
+        self.items = 0
+
+    def __enter__(self):
+        if self.tracing:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds += time.perf_counter() - self.t0
+        if self.tracing:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.base)
+
+    def result(self) -> dict:
+        return {
+            'seconds': round(self.seconds, 4),
+            'throughput': round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+            'unit': f'{self.unit}/sec',
+            'peak_mb': round(self.peak / 1024 ** 2, 2)
+        }
+
+
+def bench_strategy(cfg: dict, symbols: list, work_dir: str) -> dict:
+    """Run the stages of a strategy on the symbols"""
+    os.makedirs(work_dir, exist_ok=True)
+    runner = import_class(cfg['module'], cfg['name'])(work_dir, dict(cfg, work_dir=work_dir))
+    strategy = cfg['name']
+    code_hash = runner.get_code_hash()
+    names = runner.get_metrics()
+    stages = {key: Stage(unit) for key, unit in STAGES.items()}
+    store = ResultStore(runner.get_result_file())
+    param_list = runner.iter_parameters()
+    for symbol in symbols:
+        for group in runner.group_parameters(param_list):
+            interval = group[0]['interval']
+            with stages['load']:
+                price = BinanceData.load([symbol], interval=interval, start=cfg['start'],
+                                         columns=['Close']).get('Close')
+            stages['load'].items += len(price)
+            with stages['signals']:
+                entries, exits = runner.generate_signals(price, group)
+            stages['signals'].items += len(price) * len(group)
+            with stages['portfolio']:
+                pf = vbt.Portfolio.from_signals(price, entries, exits, init_cash=cfg['init_cash'])
+            stages['portfolio'].items += len(group)
+            with stages['stats']:
+                df = compute_stats(pf, names)
+            stages['stats'].items += len(group)
+            with stages['csv']:
+                for params in group:
+                    label = runner.create_label(**params)
+                    record = dict(
+                        key=make_key(strategy, label, symbol, interval, 0, code_hash),
+                        strategy=strategy, label=label, symbol=symbol, interval=interval,
+                        watermark=0, code_hash=code_hash
+                    )
+                    store.add(record, df.loc[label])
+            stages['csv'].items += len(group)
+    with stages['csv']:
+        store.flush()
+        df = store.load(strategy=strategy, code_hash=code_hash)
+        for params in param_list:
+            label = runner.create_label(**params)
+            store.export_csv(df[df['label'] == label], runner.get_output_file(**params),
+                             symbols=symbols, names=names)
+    with stages['boxplot']:
+        BoxPlot(runner, symbols=symbols).create_plots()
+    stages['boxplot'].items += len(runner.get_plots())
+    return {key: stage.result() for key, stage in stages.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Find the stages slower or larger than the baseline"""
+    regressions = list()
+    for bench, stages in results.items():
+        for key, result in stages.items():
+            base = baseline.get(bench, {}).get(key)
+            if base is None:
+                continue
+            if (result['seconds'] > base['seconds'] * (1 + tolerance)
+                    and result['seconds'] - base['seconds'] > MIN_SECONDS):
+                regressions.append(f"{bench}.{key}: {result['seconds']}s > {base['seconds']}s")
+            if result['peak_mb'] > base['peak_mb'] * (1 + tolerance) and result['peak_mb'] > 1:
+                regressions.append(f"{bench}.{key}: {result['peak_mb']}MB > {base['peak_mb']}MB")
+    return regressions
+
+
+def report(results: dict):
+    for bench, stages in results.items():
+        for key, r in stages.items():
+            log.info('%-4s %-10s %8.3fs %12s %-14s %8.2fMB', bench, key, r['seconds'],
+                     r['throughput'], r['unit'], r['peak_mb'])
+
+
+def run():
+    warnings.filterwarnings("ignore")
+    create_log("backtest", level="INFO")
+    create_log("benchmarks", level="INFO")
+    parser = argparse.ArgumentParser(description='The benchmarks of the backtest stages')
+    parser.add_argument('--db', type=str, help="the dir of the kline dbs, generated if missing")
+    parser.add_argument('--symbols', type=int, default=10, help="the number of synthetic symbols")
+    parser.add_argument('--years', type=float, default=1, help="the years of synthetic bars")
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), help="the benchmarks to run")
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE, help="the baseline file")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="the allowed relative regression")
+    parser.add_argument('-o', '--output', type=str, help="write the results into a JSON file")
+    args = parser.parse_args()
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        log.error('no baseline %s, save it on this machine by --save-baseline', args.baseline)
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db or os.path.join(tmp, 'klines')
+        intervals = sorted({i for key in args.benchmarks for i in BENCHMARKS[key]['intervals']})
+        if not os.path.exists(db_dir) or not os.listdir(db_dir):
+            log.info('generate %d symbols of %s years into %s ...', args.symbols, args.years, db_dir)
+            generate_klinedb(db_dir, symbols=args.symbols, intervals=intervals, years=args.years)
+        symbols = sorted(fn[:-3] for fn in os.listdir(db_dir) if fn.endswith('.db'))
+        backtest.db.BINANCE_FUTURES_KLINE_DB = db_dir
+        # Time the db reads rather than the kline cache
+        configure_cache(enabled=False)
+
+        results = dict()
+        for key in args.benchmarks:
+            # Compile the kernels before timing
+            bench_strategy(BENCHMARKS[key], symbols[:1], os.path.join(tmp, f'{key}_warmup'))
+            log.info('benchmark %s on %d symbols ...', key, len(symbols))
+            results[key] = bench_strategy(BENCHMARKS[key], symbols, os.path.join(tmp, key))
+            # Trace the memory in another pass, tracemalloc slows down the stages
+            tracemalloc.start()
+            traced = bench_strategy(BENCHMARKS[key], symbols, os.path.join(tmp, f'{key}_traced'))
+            tracemalloc.stop()
+            for stage, result in traced.items():
+                results[key][stage]['peak_mb'] = result['peak_mb']
+
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        log.info('baseline saved into %s', args.baseline)
+        return 0
+    with open(args.baseline, 'r') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        log.error('regression %s', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
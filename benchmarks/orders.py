@@ -0,0 +1,142 @@
+"""The benchmark of the order callbacks against a Python loop
+
+    python -m benchmarks.orders
+    python -m benchmarks.orders --bars 200000 --columns 50
+
+The trailing stop strategy of `backtest.strategy.trailing` is run on the
+synthetic close prices of `backtest.synth`, one column per set of parameters:
+
+    - compile: the first simulation, which compiles the callbacks and the
+      simulation of vectorbt
+    - numba: the simulation of all the columns by the compiled callbacks,
+      without the stats of the portfolio
+    - python: the same strategy by a loop in Python per column, which is how
+      a position dependent strategy would be run without the callbacks
+
+The benchmark fails if the end values or the trades of the two differ.
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+from backtest.log import create_log
+from backtest.strategy.trailing import TrailingStopStrategy
+from backtest.synth import DEFAULT_START, synth_klines
+
+
+# The module runs as __main__
+log = logging.getLogger('benchmarks.orders')
+
+
+WINDOWS = list(range(10, 210, 10))
+
+STOPS = [0.02, 0.05, 0.1, 0.15, 0.2]
+
+
+def trailing_stop_loop(close: np.ndarray, window: int, stop: float, size: float,
+                       init_cash: float) -> tuple:
+    """The trailing stop strategy of one column in Python
+
+    Returns:
+        (end value, trades, orders), the orders are the (bar, size) of each
+        order, a sell of a negative size.
+    """
+    # The SMA of running sums like `rolling_mean_1d_nb`
+    cumsum = np.cumsum(close)
+    sma = np.full(len(close), np.nan)
+    sma[window - 1] = cumsum[window - 1] / window
+    sma[window:] = (cumsum[window:] - cumsum[:-window]) / window
+    cash, position, peak, trades = init_cash, 0., np.nan, 0
+    orders = list()
+    for i in range(len(close)):
+        price = close[i]
+        if position > 0:
+            if price > peak:
+                peak = price
+            if price < peak * (1 - stop):
+                orders.append((i, -position))
+                cash += position * price
+                position = 0.
+        elif i > 0 and price > sma[i] and close[i - 1] <= sma[i - 1]:
+            spend = cash * size
+            position = spend / price
+            cash -= spend
+            peak = price
+            trades += 1
+            orders.append((i, position))
+    return cash + position * close[-1], trades, orders
+
+
+def bench(bars: int, columns: int, size: float = 1.0, init_cash: float = 10000) -> dict:
+    df = synth_klines('BENCH', '30m', DEFAULT_START, bars)
+    price = pd.Series(df['c'].to_numpy(), index=pd.to_datetime(df['s'], unit='ms', utc=True),
+                      name='Close')
+    grid = [(window, stop) for window in WINDOWS for stop in STOPS]
+    param_list = [dict(interval='30m', window=window, stop=stop) for window, stop in grid[:columns]]
+    runner = TrailingStopStrategy('.', dict(init_cash=init_cash, size=size))
+    results = dict()
+
+    t0 = time.perf_counter()
+    runner.simulate_orders(price.iloc[:1000], param_list[:2])
+    results['compile'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    pf = runner.simulate_orders(price, param_list)
+    results['numba'] = time.perf_counter() - t0
+    end_values = np.atleast_1d(pf.final_value())
+    trades = np.atleast_1d(pf.trades.count())
+
+    t0 = time.perf_counter()
+    close = price.to_numpy()
+    expected = [
+        trailing_stop_loop(close, params['window'], params['stop'], size, init_cash)
+        for params in param_list
+    ]
+    results['python'] = time.perf_counter() - t0
+
+    same = (np.allclose(end_values, [value for value, _, _ in expected], rtol=1e-9)
+            and np.array_equal(trades, [n for _, n, _ in expected]))
+    return dict(
+        bars=bars,
+        columns=len(param_list),
+        seconds={key: round(value, 4) for key, value in results.items()},
+        throughput={
+            key: round(bars * len(param_list) / results[key], 1) for key in ('numba', 'python')
+        },
+        speedup=round(results['python'] / results['numba'], 1),
+        same=bool(same)
+    )
+
+
+def run():
+    warnings.filterwarnings("ignore")
+    create_log("benchmarks", level="INFO")
+    parser = argparse.ArgumentParser(description='The benchmark of the order callbacks')
+    parser.add_argument('--bars', type=int, default=100000, help="the number of bars")
+    parser.add_argument('--columns', type=int, default=20, help="the number of parameter sets")
+    parser.add_argument('--size', type=float, default=1.0, help="the fraction of the cash of an entry")
+    parser.add_argument('-o', '--output', type=str, help="write the results into a JSON file")
+    args = parser.parse_args()
+
+    result = bench(args.bars, args.columns, size=args.size)
+    for key, seconds in result['seconds'].items():
+        log.info('%-8s %8.3fs %14s bars/sec', key, seconds, result['throughput'].get(key, ''))
+    log.info('numba is %.1fx of python on %d bars x %d columns', result['speedup'],
+             result['bars'], result['columns'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if not result['same']:
+        log.error('the results of numba and python differ')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -1,7 +1,8 @@
 import argparse
+import cProfile
+import time
 import warnings
 
-from backtest.engine import BacktestEngine
 from backtest.log import create_log
 
 def run():
@@ -10,11 +11,80 @@ def run():
     parser = argparse.ArgumentParser(description='The Backtest Engine')
     parser.add_argument('-f', '--config-file', type=str, default="config.yaml", help="the yaml config file")
     parser.add_argument('-s', '--show', dest='show_only', action='store_true', help="show the result")
+    parser.add_argument('--top', type=int, help="only show the top symbols by the metric")
+    parser.add_argument('--metric', type=str, default='Total Return [%]', help="the metric of --top")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help="disable the kline cache")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="the number of worker processes")
+    parser.add_argument('--force', action='store_true', help="run again the computed backtests")
+    parser.add_argument('--profile', action='store_true', help="write the timing of the stages into the work dir")
+    parser.add_argument('--cprofile', type=str, help="dump the cProfile stats into the file")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="only load the config")
+    subparsers = parser.add_subparsers(dest='command')
+    # The -w of the subcommands has no default, so it keeps a -w before the subcommand
+    # runbt.py ingest D:\data\binance\dumps -w 8
+    ingest_parser = subparsers.add_parser('ingest', help="ingest the kline dumps into the kline dbs")
+    ingest_parser.add_argument('root', type=str, help="the dir of the kline dump files")
+    ingest_parser.add_argument('--db', dest='path', type=str, help="the dir of the kline dbs")
+    ingest_parser.add_argument('--symbols', nargs='+', help="only ingest these symbols")
+    ingest_parser.add_argument('--intervals', nargs='+', help="only ingest these intervals")
+    ingest_parser.add_argument('-w', '--workers', type=int, default=argparse.SUPPRESS, help="the number of worker processes")
+    # runbt.py worker /shared/bt/queue.db -w 8
+    worker_parser = subparsers.add_parser('worker', help="run the units of a work queue")
+    worker_parser.add_argument('path', type=str, help="the work queue db on the shared filesystem")
+    worker_parser.add_argument('-w', '--workers', type=int, default=argparse.SUPPRESS, help="the number of worker processes")
+    worker_parser.add_argument('--idle-exit', type=str, help="exit after idle for the duration, e.g. 10m")
+    # runbt.py catalog --db D:\data\binance\db\futures\um_klines
+    catalog_parser = subparsers.add_parser('catalog', help="refresh the catalog of the kline dbs")
+    catalog_parser.add_argument('--db', dest='path', type=str, help="the dir of the kline dbs")
+    catalog_parser.add_argument('--catalog', type=str, help="the catalog db, catalog.db of the dir by default")
+    catalog_parser.add_argument('--symbols', nargs='+', help="only refresh these symbols, all dbs by default")
+    catalog_parser.add_argument('-o', '--output', type=str, help="write the summary into a CSV file")
+    catalog_parser.add_argument('-w', '--workers', type=int, default=argparse.SUPPRESS, help="the number of worker processes")
+    # runbt.py -f config.yaml warmup
+    subparsers.add_parser('warmup', help="compile the numba functions of the strategies into the numba cache")
+    # runbt.py -f config.yaml live --every 30m
+    live_parser = subparsers.add_parser('live', help="update the results by the new klines")
+    live_parser.add_argument('--every', type=str, help="update again every duration, e.g. 30m")
 
+    # The heavy dependencies are imported after parsing the arguments
     args = parser.parse_args()
-    
-    executor = BacktestEngine(args.config_file)
-    executor.exec(show_only=args.show_only)
+    if args.command == 'ingest':
+        from backtest.ingest import ingest
+        ingest(args.root, path=args.path, symbols=args.symbols, intervals=args.intervals,
+               workers=args.workers)
+        return
+    if args.command == 'catalog':
+        from backtest.catalog import refresh_catalog
+        refresh_catalog(path=args.path, catalog=args.catalog, symbols=args.symbols,
+                        output=args.output, workers=args.workers)
+        return
+    if args.command == 'worker':
+        from backtest.workqueue import run_workers
+        run_workers(args.path, workers=args.workers, idle_exit=args.idle_exit)
+        return
+
+    t0 = time.perf_counter()
+    from backtest.engine import BacktestEngine
+    from backtest.timing import profiler
+    seconds = time.perf_counter() - t0
+    executor = BacktestEngine(args.config_file, use_cache=args.use_cache, workers=args.workers,
+                              force=args.force, profile=args.profile)
+    profiler.record('import', seconds, label='backtest.engine')
+    if args.command == 'warmup':
+        executor.warm_up()
+        return
+    if args.command == 'live':
+        executor.live(every=args.every)
+        return
+    if args.cprofile:
+        # Only the main process is profiled
+        pr = cProfile.Profile()
+        pr.enable()
+        executor.exec(dry_run=args.dry_run, show_only=args.show_only, top=args.top, metric=args.metric)
+        pr.disable()
+        pr.dump_stats(args.cprofile)
+    else:
+        executor.exec(dry_run=args.dry_run, show_only=args.show_only, top=args.top, metric=args.metric)
 
 
 
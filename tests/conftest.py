@@ -0,0 +1,42 @@
+"""The fixtures shared by the tests"""
+
+import os
+
+import pytest
+
+from backtest import db
+from backtest.cache import kline_cache
+from backtest.db import KlineDb, dispose_klinedbs
+from backtest.synth import DEFAULT_START, synth_klines
+
+
+@pytest.fixture
+def klines(tmp_path, monkeypatch):
+    """Store the rows of the synthetic klines of a symbol into a temp db
+
+    The kline dbs of the temp dir are the default ones, e.g.
+
+        klines('SYN000USDT', slice(0, 400), bars=600)
+
+    stores the first 400 of 600 bars of 30m.
+    """
+    path = str(tmp_path / 'klines')
+    os.makedirs(path)
+    monkeypatch.setattr(db, 'BINANCE_FUTURES_KLINE_DB', path)
+    dispose_klinedbs()
+    kdbs, frames = dict(), dict()
+
+    def store(symbol: str, rows, bars: int, interval: str = '30m'):
+        if symbol not in kdbs:
+            kdbs[symbol] = KlineDb(symbol, path)
+            kdbs[symbol].create_tables()
+        if (symbol, interval, bars) not in frames:
+            frames[(symbol, interval, bars)] = synth_klines(symbol, interval, DEFAULT_START, bars)
+        df = frames[(symbol, interval, bars)]
+        kdbs[symbol].upsert(interval, df.iloc[rows].to_dict('records'))
+
+    yield store
+    for kdb in kdbs.values():
+        kdb.dispose()
+    dispose_klinedbs()
+    kline_cache.clear()
@@ -0,0 +1,122 @@
+"""The incremental rescan, the gaps and the `min_bars` screening of the kline catalog"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest import catalog as catalog_module
+from backtest.catalog import KlineCatalog
+from backtest.engine import BacktestEngine
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+SHORT = 'SYN001USDT'
+MISSING = 'SYN002USDT'
+BARS = 600
+MS = 30 * 60 * 1000
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Record the open times after which each scan reads the klines"""
+    afters = list()
+    read_times = catalog_module._read_times
+
+    def record(conn, table, after):
+        afters.append(after)
+        return read_times(conn, table, after)
+
+    monkeypatch.setattr(catalog_module, '_read_times', record)
+    return afters
+
+
+def open_time(i: int) -> int:
+    return DEFAULT_START + i * MS
+
+
+def test_rescan_after_append(klines, scans, tmp_path):
+    kc = KlineCatalog(str(tmp_path / 'catalog.db'))
+    klines(SYMBOL, slice(0, 400), BARS)
+    kc.refresh([SYMBOL])
+    assert scans == [-1]
+
+    # A hole in the appended klines
+    klines(SYMBOL, list(range(400, 450)) + list(range(460, BARS)), BARS)
+    kc.refresh([SYMBOL])
+    assert scans == [-1, open_time(399)]
+    row = kc.find(SYMBOL, '30m')
+    assert (row['first'], row['last'], row['rows']) == (open_time(0), open_time(BARS - 1), BARS - 10)
+    assert row['gaps'] == [[open_time(450), open_time(460)]]
+    assert kc.find(SYMBOL, '2h') == row
+
+    # The unchanged db is not scanned, and the rows are loaded from the catalog
+    kc = KlineCatalog(kc.db_url[len('sqlite:///'):])
+    kc.refresh([SYMBOL])
+    assert len(scans) == 2
+    assert kc.find(SYMBOL, '30m')['gaps'] == row['gaps']
+    assert kc.bars(SYMBOL, '30m') == BARS - 10
+    assert kc.bars(SYMBOL, '30m', start=open_time(455)) == BARS - 460
+    assert kc.bars(SYMBOL, '2h') == (BARS - 10) // 4
+
+
+def test_rescan_after_backfill(klines, scans, tmp_path):
+    kc = KlineCatalog(str(tmp_path / 'catalog.db'))
+    klines(SYMBOL, list(range(0, 100)) + list(range(200, BARS)), BARS)
+    kc.refresh([SYMBOL])
+    assert kc.find(SYMBOL, '30m')['gaps'] == [[open_time(100), open_time(200)]]
+
+    # The klines inserted before the last one are found by a full scan
+    klines(SYMBOL, slice(100, 200), BARS)
+    kc.refresh([SYMBOL])
+    assert scans[-1] == -1
+    row = kc.find(SYMBOL, '30m')
+    assert row['rows'] == BARS and row['gaps'] == []
+
+
+def test_screen_min_bars(klines, tmp_path):
+    klines(SYMBOL, list(range(0, 300)) + list(range(400, BARS)), BARS)
+    klines(SHORT, slice(0, 240), BARS)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{SYMBOL}, {SHORT}, {MISSING}]
+- catalog: {{path: {tmp_path / 'catalog.db'}, min_bars: 100}}
+""")
+    engine = BacktestEngine(str(fp))
+    engine.refresh_catalog()
+    start = datetime.fromtimestamp(open_time(100) / 1000, tz=timezone.utc)
+    runner = DualSMAStrategy(str(tmp_path), dict(intervals=['30m', '2h'], start=start, min_bars=120))
+
+    assert engine._screen(runner, [SYMBOL, SHORT, MISSING]) == [SYMBOL, SHORT]
+    skipped = pd.read_csv(tmp_path / 'skipped.csv')
+    assert list(skipped.columns) == ['Token', 'Interval', 'Reason']
+    # 400 and 140 bars of 30m since the start, without the gap
+    assert [tuple(row[:2]) for row in skipped.itertuples(index=False)] == [
+        (SYMBOL, '2h'), (SHORT, '2h'), (MISSING, '30m'), (MISSING, '2h')
+    ]
+    reasons = dict(zip(zip(skipped['Token'], skipped['Interval']), skipped['Reason']))
+    assert reasons[(SYMBOL, '2h')].startswith('100 bars of 2h')
+    assert reasons[(SHORT, '2h')].startswith('35 bars of 2h')
+    assert reasons[(MISSING, '30m')] == 'no kline db'
+
+
+def test_screen_date_start(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{SYMBOL}]
+- catalog: {{path: {tmp_path / 'catalog.db'}}}
+""")
+    engine = BacktestEngine(str(fp))
+    engine.refresh_catalog()
+    # `start: 2023-10-01` of YAML is a date
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc).date()
+    runner = DualSMAStrategy(str(tmp_path), dict(intervals=['30m'], start=start, min_bars=BARS + 1))
+
+    assert runner.get_start() == datetime(start.year, start.month, start.day)
+    assert engine._screen(runner, [SYMBOL]) == []
+    assert engine._bars(runner, SYMBOL, [dict(interval='30m')]) <= BARS
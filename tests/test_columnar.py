@@ -0,0 +1,98 @@
+"""The refresh and the versions of the columnar kline cache"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from backtest import db
+from backtest.columnar import ColumnarCache, KLINE_COLUMNS
+from backtest.db import dispose_klinedbs, get_default_klinedb
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+BARS = 600
+
+
+def assert_same_as_db(columns: dict):
+    expected = get_default_klinedb(SYMBOL).select('30m', columns=list(KLINE_COLUMNS))
+    for name in KLINE_COLUMNS:
+        np.testing.assert_array_equal(columns[name], expected[name])
+
+
+def versions(cache: ColumnarCache) -> set:
+    d = cache.get_dir(SYMBOL, '30m')
+    return {fn.split('-', 1)[1][:-len('.npy')] for fn in os.listdir(d) if fn.startswith('c-')}
+
+
+def test_refresh_after_append(klines, tmp_path):
+    cache = ColumnarCache(str(tmp_path / 'cache'))
+    klines(SYMBOL, slice(0, 500), BARS)
+    first = cache.refresh(SYMBOL, '30m')
+    assert first['rows'] == 500
+
+    klines(SYMBOL, slice(500, BARS), BARS)
+    second = cache.refresh(SYMBOL, '30m')
+    assert second['rows'] == BARS and second['previous'] == first['version']
+    assert second['watermark'] == DEFAULT_START + (BARS - 1) * 30 * 60 * 1000
+    assert_same_as_db(cache.load(SYMBOL, '30m'))
+    # The previous version is kept for the readers which resolved it
+    assert versions(cache) == {first['version'], second['version']}
+    assert cache.refresh(SYMBOL, '30m') == second
+
+
+def test_refresh_after_backfill(klines, tmp_path):
+    cache = ColumnarCache(str(tmp_path / 'cache'))
+    klines(SYMBOL, slice(100, BARS), BARS)
+    first = cache.refresh(SYMBOL, '30m')
+    # The older klines leave the watermark
+    klines(SYMBOL, slice(0, 100), BARS)
+    second = cache.refresh(SYMBOL, '30m')
+    assert second['watermark'] == first['watermark'] and second['rows'] == BARS
+    assert_same_as_db(cache.load(SYMBOL, '30m'))
+
+
+def test_load_after_version_change(klines, tmp_path, monkeypatch):
+    cache = ColumnarCache(str(tmp_path / 'cache'))
+    klines(SYMBOL, slice(0, 400), BARS)
+    stale = cache.refresh(SYMBOL, '30m')
+    # Two commits of another writer remove the version resolved by a reader
+    klines(SYMBOL, slice(400, 500), BARS)
+    ColumnarCache(cache.root).refresh(SYMBOL, '30m')
+    klines(SYMBOL, slice(500, BARS), BARS)
+    current = ColumnarCache(cache.root).refresh(SYMBOL, '30m')
+    assert stale['version'] not in versions(cache)
+
+    metas = iter([stale, current])
+    monkeypatch.setattr(cache, 'refresh', lambda symbol, interval: next(metas))
+    assert_same_as_db(cache.load(SYMBOL, '30m'))
+
+
+def test_two_writers_materialize(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    a, b = ColumnarCache(str(tmp_path / 'cache')), ColumnarCache(str(tmp_path / 'cache'))
+    # Both writers found no cache, and read the same klines
+    columns = a._read_rows(SYMBOL, '30m')
+    watermark = int(columns['s'][-1])
+    meta = a._write(SYMBOL, '30m', columns, watermark, None)
+    assert b._write(SYMBOL, '30m', columns, watermark, None) == meta
+    assert versions(a) == {meta['version']}
+    assert_same_as_db(b.load(SYMBOL, '30m'))
+
+
+def load_sum(root: str, path: str) -> float:
+    db.BINANCE_FUTURES_KLINE_DB = path
+    dispose_klinedbs(close=False)
+    return float(np.sum(ColumnarCache(root).load(SYMBOL, '30m', columns=['c'])['c']))
+
+
+def test_concurrent_writers(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    root = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        sums = list(executor.map(load_sum, [root] * 8, [db.BINANCE_FUTURES_KLINE_DB] * 8))
+    expected = get_default_klinedb(SYMBOL).select('30m', columns=['c'])['c'].sum()
+    assert sums == [pytest.approx(expected, rel=1e-12)] * 8
+    assert_same_as_db(ColumnarCache(root).load(SYMBOL, '30m'))
@@ -0,0 +1,28 @@
+"""The registry of the default kline dbs"""
+
+from backtest import db
+from backtest.db import KLINEDB_OPTIONS, KLINEDB_STATS, get_default_klinedb, klinedb_stats
+
+
+SYMBOLS = ['SYN000USDT', 'SYN001USDT', 'SYN002USDT']
+
+
+def test_evict_least_recently_used(klines, monkeypatch):
+    for symbol in SYMBOLS:
+        klines(symbol, slice(0, 10), 10)
+    monkeypatch.setitem(KLINEDB_OPTIONS, 'max_open', 2)
+    evictions = KLINEDB_STATS['evictions']
+
+    first = get_default_klinedb(SYMBOLS[0])
+    assert first.get_watermark('30m') > 0
+    get_default_klinedb(SYMBOLS[1])
+    # The first one is used again, so the second one is evicted
+    assert get_default_klinedb(SYMBOLS[0]) is first
+    get_default_klinedb(SYMBOLS[2])
+    assert klinedb_stats()['registered'] == 2
+    assert KLINEDB_STATS['evictions'] == evictions + 1
+    assert [key[1] for key in db._klinedbs] == [SYMBOLS[0], SYMBOLS[2]]
+
+    # The engine of an evicted db is disposed
+    get_default_klinedb(SYMBOLS[1])
+    assert first.engine is None and SYMBOLS[0] not in [key[1] for key in db._klinedbs]
@@ -0,0 +1,80 @@
+"""The backtests of the engine in the worker processes against the ones in process"""
+
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest.engine import BacktestEngine
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+TOKENS = [f'SYN{i:03d}USDT' for i in range(5)]
+BROKEN = 'SYN002USDT'
+
+
+class BrokenSMAStrategy(DualSMAStrategy):
+    """The dual SMA strategy failing on one token"""
+
+    def run_batch(self, symbol: str, param_list: list):
+        if symbol == BROKEN:
+            raise RuntimeError(f'no klines of {symbol}')
+        return super().run_batch(symbol, param_list)
+
+
+@pytest.fixture
+def engine(klines, tmp_path):
+    for token in TOKENS:
+        klines(token, slice(0, 400), 400)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(TOKENS)}]
+""")
+    return BacktestEngine(str(fp))
+
+
+def create_runner(work_dir: str):
+    os.makedirs(work_dir, exist_ok=True)
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    return BrokenSMAStrategy(work_dir, dict(intervals=['30m', '2h'], params=[[3, 6], [5, 10]],
+                                            start=start, output='sma_{label}.csv'))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_workers(engine, tmp_path, workers):
+    engine.workers = workers
+    runner = create_runner(str(tmp_path / f'workers_{workers}'))
+    param_list = runner.iter_parameters()
+    engine._exec(runner, TOKENS, param_list)
+
+    # The failure is written instead of swallowed
+    failures = pd.read_csv(tmp_path / f'workers_{workers}' / 'failures.csv')
+    assert sorted(zip(failures['Token'], failures['Label'])) == sorted(
+        (BROKEN, runner.create_label(**params)) for params in param_list
+    )
+    assert failures['Error'].str.contains(f'no klines of {BROKEN}').all()
+    df = ResultStore(runner.get_result_file()).load()
+    assert len(df) == (len(TOKENS) - 1) * len(param_list)
+    assert BROKEN not in set(df['symbol'])
+
+
+def test_workers_same_results(engine, tmp_path):
+    stored, exported = list(), list()
+    for workers in [1, 2]:
+        engine.workers = workers
+        runner = create_runner(str(tmp_path / f'workers_{workers}'))
+        param_list = runner.iter_parameters()
+        engine._exec(runner, TOKENS, param_list)
+        df = ResultStore(runner.get_result_file()).load()
+        stored.append(df.drop(columns='created').sort_values(['symbol', 'label'], ignore_index=True))
+        exported.append([pd.read_csv(runner.get_output_file(**params)) for params in param_list])
+
+    pd.testing.assert_frame_equal(stored[0], stored[1])
+    for one, two in zip(*exported):
+        # The same rows in the same order
+        assert one['Token'].tolist() == two['Token'].tolist()
+        pd.testing.assert_frame_equal(one, two)
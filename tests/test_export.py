@@ -0,0 +1,82 @@
+"""The chunked OHLCV feeds against `KlineDb.select`"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from backtest.db import KlineDb, get_default_klinedb, ohlcv_frame, export_ohlcv_feeds
+
+
+SYMBOLS = ['SYN000USDT', 'SYN001USDT', 'SYN002USDT']
+BARS = 500
+
+FORMATS = ['csv', 'parquet', 'feather']
+
+
+@pytest.fixture
+def data(klines, tmp_path, monkeypatch):
+    """The klines of the symbols, exported into the `data` dir of the temp dir"""
+    for symbol in SYMBOLS:
+        klines(symbol, slice(0, BARS), BARS)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    return tmp_path / 'data'
+
+
+def read_feed(fn: str, fmt: str) -> pd.DataFrame:
+    if fmt == 'csv':
+        return pd.read_csv(fn, parse_dates=['datetime'], float_precision='round_trip')
+    if fmt == 'parquet':
+        return pd.read_parquet(fn)
+    return pd.read_feather(fn)
+
+
+def expected_feed(symbol: str, interval: str = '30m') -> pd.DataFrame:
+    return ohlcv_frame(get_default_klinedb(symbol).select(interval, columns=['o', 'h', 'l', 'c', 'qv']))
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_export_chunks(data, fmt):
+    if fmt != 'csv':
+        pytest.importorskip('pyarrow')
+    # The chunks do not divide the klines
+    fn = get_default_klinedb(SYMBOLS[0]).export_ohlcv_file(SYMBOLS[0], '30m', fmt=fmt, chunk_size=64)
+    df = read_feed(fn, fmt)
+    assert len(df) == BARS
+    pd.testing.assert_frame_equal(df, expected_feed(SYMBOLS[0]), check_dtype=False)
+    assert os.listdir(data) == [os.path.basename(fn)]
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_export_empty(data, klines, fmt):
+    if fmt != 'csv':
+        pytest.importorskip('pyarrow')
+    klines('SYN009USDT', slice(0, 0), BARS)
+    fn = get_default_klinedb('SYN009USDT').export_ohlcv_file('SYN009USDT', '30m', fmt=fmt)
+    df = read_feed(fn, fmt)
+    assert len(df) == 0
+    assert df.columns.tolist() == ['datetime', 'open', 'high', 'low', 'close', 'volume']
+
+
+def test_export_failure_removes_temp_file(data, monkeypatch):
+    iter_chunks = KlineDb.iter_chunks
+
+    def fail(self, *args, **kwargs):
+        for chunk in iter_chunks(self, *args, **kwargs):
+            yield chunk
+            raise RuntimeError('db is gone')
+
+    monkeypatch.setattr(KlineDb, 'iter_chunks', fail)
+    with pytest.raises(RuntimeError):
+        get_default_klinedb(SYMBOLS[0]).export_ohlcv_file(SYMBOLS[0], '30m', chunk_size=64)
+    # Neither a partial file nor its temp file is left
+    assert os.listdir(data) == []
+
+
+def test_export_in_parallel(data):
+    files = export_ohlcv_feeds(SYMBOLS, '30m', workers=2)
+    assert files == [f'data/binance-{symbol}-30m.csv' for symbol in SYMBOLS]
+    for symbol, fn in zip(SYMBOLS, files):
+        pd.testing.assert_frame_equal(read_feed(fn, 'csv'), expected_feed(symbol), check_dtype=False)
+    assert sorted(os.listdir(data)) == sorted(os.path.basename(fn) for fn in files)
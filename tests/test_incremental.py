@@ -0,0 +1,110 @@
+"""The live updates against `pf.stats()` of the backtests of the whole history"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest.cache import kline_cache
+from backtest.data import BinanceData
+from backtest.db import KlineDb
+from backtest.live import CheckpointStore, live_token
+from backtest.strategy.rsi import RSIStrategy
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+
+# The 30m bars stored, the last 2h bucket is incomplete
+BARS = 962
+
+# The bars stored by each update, a checkpoint in the middle of a 2h bucket
+SPLITS = [[BARS], [601, BARS], [601, 603, BARS]]
+
+STRATEGIES = [
+    pytest.param(DualSMAStrategy, dict(params=[[3, 6], [5, 10]]), id='sma'),
+    pytest.param(RSIStrategy, dict(windows=[10, 14], params=[[25, 75]]), id='rsi'),
+]
+
+
+@pytest.mark.parametrize('splits', SPLITS, ids=lambda splits: 'x'.join(map(str, splits)))
+@pytest.mark.parametrize('interval', ['30m', '2h'])
+@pytest.mark.parametrize('cls, cfg', STRATEGIES)
+def test_live_stats(klines, tmp_path, cls, cfg, interval, splits):
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    runner = cls(str(tmp_path), dict(cfg, intervals=[interval], start=start, init_cash=10000))
+    param_list = runner.iter_parameters()
+    checkpoints = CheckpointStore(runner.get_checkpoint_file())
+    for bars in splits:
+        klines(SYMBOL, slice(0, bars), BARS)
+        _, stats, errors, saved, _ = live_token(runner, SYMBOL, param_list)
+        assert errors == {}
+        checkpoints.save(saved)
+
+    for params in param_list:
+        expected = runner.run(SYMBOL, **params).stats()
+        pd.testing.assert_series_equal(stats[runner.create_label(**params)], expected,
+                                       check_names=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize('interval, bars', [('30m', [601, BARS]), ('2h', [151, 241])])
+def test_load_after_ingest(klines, interval, bars):
+    klines(SYMBOL, slice(0, 601), BARS)
+    first = BinanceData.load([SYMBOL], interval=interval, columns=['Close']).get('Close')
+    klines(SYMBOL, slice(0, BARS), BARS)
+    second = BinanceData.load([SYMBOL], interval=interval, columns=['Close']).get('Close')
+    assert [len(first), len(second)] == bars
+
+
+def test_load_without_count(klines, monkeypatch):
+    klines(SYMBOL, slice(100, 601), BARS)
+    first = BinanceData.load([SYMBOL], interval='30m', columns=['Close']).get('Close')
+
+    def count(self, interval):
+        raise AssertionError('rows counted on load')
+
+    monkeypatch.setattr(KlineDb, 'get_coverage', count)
+    hits = kline_cache.hits
+    BinanceData.load([SYMBOL], interval='30m', columns=['Close'])
+    assert kline_cache.hits == hits + 1
+    # The older klines before the first one are read again
+    klines(SYMBOL, slice(0, 100), BARS)
+    second = BinanceData.load([SYMBOL], interval='30m', columns=['Close']).get('Close')
+    assert [len(first), len(second)] == [501, 601]
+
+
+def test_load_after_gap_fill(klines, monkeypatch):
+    klines(SYMBOL, list(range(0, 300)) + list(range(350, 601)), BARS)
+    first = BinanceData.load([SYMBOL], interval='30m', columns=['Close']).get('Close')
+
+    def count(self, interval):
+        raise AssertionError('rows counted on load')
+
+    monkeypatch.setattr(KlineDb, 'get_coverage', count)
+    # The klines inside the first and the latest ones are read again
+    klines(SYMBOL, slice(300, 350), BARS)
+    second = BinanceData.load([SYMBOL], interval='30m', columns=['Close']).get('Close')
+    assert [len(first), len(second)] == [551, 601]
+
+
+@pytest.mark.parametrize('interval', ['30m', '2h'])
+@pytest.mark.parametrize('cls, cfg', STRATEGIES)
+def test_live_stats_after_backfill(klines, tmp_path, cls, cfg, interval):
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    runner = cls(str(tmp_path), dict(cfg, intervals=[interval], start=start, init_cash=10000))
+    param_list = runner.iter_parameters()
+    checkpoints = CheckpointStore(runner.get_checkpoint_file())
+    # A gap before the checkpoint is backfilled with the new bars
+    klines(SYMBOL, list(range(0, 300)) + list(range(350, 601)), BARS)
+    _, _, errors, saved, _ = live_token(runner, SYMBOL, param_list)
+    assert errors == {}
+    checkpoints.save(saved)
+    klines(SYMBOL, slice(300, BARS), BARS)
+    _, stats, errors, saved, _ = live_token(runner, SYMBOL, param_list)
+    assert errors == {}
+
+    for params in param_list:
+        expected = runner.run(SYMBOL, **params).stats()
+        pd.testing.assert_series_equal(stats[runner.create_label(**params)], expected,
+                                       check_names=False, rtol=1e-9)
@@ -0,0 +1,88 @@
+"""The ingestion of Binance kline dumps against the stored klines"""
+
+import zipfile
+
+import numpy as np
+import pytest
+
+from backtest.db import KlineDb
+from backtest.ingest import ingest, ingest_file, ingest_symbol
+from backtest.synth import DEFAULT_START, synth_klines
+
+
+SYMBOL = 'SYN000USDT'
+BARS = 600
+
+# The header line of the dumps since 2022
+HEADER = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_volume',
+          'count', 'taker_buy_volume', 'taker_buy_quote_volume', 'ignore']
+
+
+@pytest.fixture
+def frame():
+    return synth_klines(SYMBOL, '30m', DEFAULT_START, BARS)
+
+
+def write_dump(root, df, period: str, fmt: str = 'csv', header: bool = True) -> str:
+    """Write the klines as a Binance dump, a zip holds the CSV file of the same name"""
+    name = f'{SYMBOL}-30m-{period}'
+    text = df.to_csv(header=HEADER if header else False, index=False)
+    if fmt == 'zip':
+        fn = str(root / f'{name}.zip')
+        with zipfile.ZipFile(fn, 'w') as z:
+            z.writestr(f'{name}.csv', text)
+    else:
+        fn = str(root / f'{name}.csv')
+        with open(fn, 'w') as f:
+            f.write(text)
+    return fn
+
+
+def assert_stored(path: str, df):
+    kdb = KlineDb(SYMBOL, path)
+    stored = kdb.select('30m')
+    kdb.dispose()
+    assert len(stored['s']) == len(df)
+    for field, values in stored.items():
+        np.testing.assert_allclose(values, df[field].to_numpy(), rtol=1e-12, err_msg=field)
+
+
+@pytest.mark.parametrize('fmt, header', [('csv', True), ('csv', False), ('zip', True), ('zip', False)])
+def test_ingest_dump(tmp_path, frame, fmt, header):
+    (tmp_path / 'dumps').mkdir()
+    write_dump(tmp_path / 'dumps', frame, '2023-01', fmt=fmt, header=header)
+    path = str(tmp_path / 'klines')
+    assert ingest(str(tmp_path / 'dumps'), path=path) == BARS
+    assert_stored(path, frame)
+
+
+def test_skip_ingested_file(tmp_path, frame, monkeypatch):
+    fn = write_dump(tmp_path, frame, '2023-01')
+    kdb = KlineDb(SYMBOL, str(tmp_path))
+    kdb.create_tables()
+    assert ingest_file(kdb, '30m', fn) == BARS
+
+    def upsert(self, interval: str, rows: list, batch_size: int = 10000) -> int:
+        raise AssertionError('an ingested file is written again')
+
+    monkeypatch.setattr(KlineDb, 'upsert', upsert)
+    assert ingest_file(kdb, '30m', fn) == 0
+    kdb.dispose()
+
+
+def test_upsert_overlapping_files(tmp_path, frame):
+    # The daily dumps overlap the monthly one by 100 klines
+    files = [
+        ('30m', '2023-01', write_dump(tmp_path, frame.iloc[:400], '2023-01', fmt='zip')),
+        ('30m', '2023-01-08', write_dump(tmp_path, frame.iloc[300:], '2023-01-08')),
+    ]
+    (tmp_path / 'klines').mkdir()
+    path = str(tmp_path / 'klines')
+    symbol, inserted, errors = ingest_symbol(SYMBOL, files, path)
+    assert (symbol, inserted, errors) == (SYMBOL, BARS, {})
+    assert_stored(path, frame)
+
+    # A file within the stored klines inserts nothing
+    files.append(('30m', '2023-01-13', write_dump(tmp_path, frame.iloc[500:], '2023-01-13')))
+    assert ingest_symbol(SYMBOL, files, path)[1] == 0
+    assert_stored(path, frame)
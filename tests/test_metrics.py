@@ -0,0 +1,56 @@
+"""The selected metrics against `pf.stats()`"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest.metrics import REQUIRED_METRICS, STATS_HEADERS, compute_stats, select_metrics
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+BARS = 600
+METRICS = ['Sharpe Ratio', 'Max Drawdown [%]', 'Win Rate [%]', 'Avg Winning Trade Duration']
+
+
+@pytest.fixture
+def runner(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    return DualSMAStrategy(str(tmp_path), dict(intervals=['30m'], params=[[3, 6], [5, 10], [8, 16]],
+                                               start=start, metrics=METRICS))
+
+
+def test_required_metrics():
+    names = select_metrics(['Sharpe Ratio'])
+    assert set(REQUIRED_METRICS) <= set(names)
+    # In the order of the stats
+    assert names == [name for name in STATS_HEADERS if name in names]
+    assert select_metrics([]) == [name for name in STATS_HEADERS if name in REQUIRED_METRICS]
+    with pytest.raises(ValueError):
+        select_metrics(['Total Return'])
+
+
+def test_selected_stats(runner):
+    names = runner.get_metrics()
+    assert set(METRICS) | set(REQUIRED_METRICS) == set(names)
+    pf = runner.run_batch(SYMBOL, runner.iter_parameters())
+    df = compute_stats(pf, names)
+    assert df.columns.tolist() == names
+    assert df.index.tolist() == pf.wrapper.columns.tolist()
+    for column in pf.wrapper.columns:
+        expected = pf.stats(column=column)[names]
+        pd.testing.assert_series_equal(df.loc[column], expected, check_names=False,
+                                       check_dtype=False)
+
+
+def test_selected_stats_single_column(runner):
+    names = runner.get_metrics()
+    params = runner.iter_parameters()[0]
+    pf = runner.run(SYMBOL, **params)
+    df = compute_stats(pf, names)
+    assert len(df) == 1
+    pd.testing.assert_series_equal(df.iloc[0], pf.stats()[names], check_names=False,
+                                   check_dtype=False)
@@ -0,0 +1,45 @@
+"""The trailing stop callbacks against the loop of each set of parameters"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.strategy.trailing import TrailingStopStrategy
+from backtest.synth import DEFAULT_START, synth_klines
+from benchmarks.orders import trailing_stop_loop
+
+
+SYMBOL = 'SYN000USDT'
+BARS = 3000
+PARAMS = [(20, 0.05), (50, 0.1), (10, 0.02)]
+INIT_CASH = 10000
+SIZE = 0.5
+
+
+@pytest.mark.parametrize('tz', ['UTC', None], ids=['tz-aware', 'naive'])
+def test_columns_as_the_loop(tmp_path, tz):
+    df = synth_klines(SYMBOL, '30m', DEFAULT_START, BARS)
+    index = pd.DatetimeIndex(pd.to_datetime(df['s'].to_numpy(), unit='ms', utc=True))
+    price = pd.Series(df['c'].to_numpy(), index=index if tz else index.tz_convert(None), name='Close')
+    runner = TrailingStopStrategy(str(tmp_path), dict(init_cash=INIT_CASH, size=SIZE))
+    param_list = [dict(interval='30m', window=window, stop=stop) for window, stop in PARAMS]
+    # All the parameter sets in one simulation
+    pf = runner.simulate_orders(price, param_list)
+    assert pf.wrapper.index.tz is None
+
+    close = price.to_numpy()
+    records = pf.orders.values
+    for j, params in enumerate(param_list):
+        label = runner.create_label(**params)
+        value, trades, orders = trailing_stop_loop(close, params['window'], params['stop'], SIZE,
+                                                   INIT_CASH)
+        assert len(orders) > 1
+        col = records[records['col'] == j]
+        np.testing.assert_array_equal(col['idx'], [i for i, _ in orders])
+        np.testing.assert_allclose(np.where(col['side'] == 0, col['size'], -col['size']),
+                                   [size for _, size in orders], rtol=1e-9)
+        assert pf.final_value()[label] == pytest.approx(value, rel=1e-9)
+        assert pf.trades.count()[label] == trades
+        # The same stats as the simulation of the parameter set alone
+        single = runner.simulate_orders(price, [params])
+        pd.testing.assert_series_equal(pf.stats(column=label), single.stats(), check_names=False)
@@ -0,0 +1,52 @@
+"""The panels of the tokens without bars since the start"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from backtest.engine import BacktestEngine
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+OTHER = 'SYN001USDT'
+DELISTED = 'SYN002USDT'
+BARS = 600
+MS = 30 * 60 * 1000
+
+
+def test_panel_without_bars_since_start(klines, tmp_path, monkeypatch):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    klines(OTHER, slice(0, BARS), BARS)
+    # The klines end before the start
+    klines(DELISTED, slice(0, 100), BARS)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{SYMBOL}, {OTHER}, {DELISTED}]
+""")
+    engine = BacktestEngine(str(fp))
+    start = datetime.fromtimestamp((DEFAULT_START + 200 * MS) / 1000, tz=timezone.utc)
+    runner = DualSMAStrategy(str(tmp_path), dict(intervals=['30m', '2h'], params=[[3, 6]],
+                                                 start=start, panel=True))
+    panels = list()
+    run_panel = runner.run_panel
+
+    def record(symbols: list, **params):
+        panels.append(symbols)
+        return run_panel(symbols, **params)
+
+    monkeypatch.setattr(runner, 'run_panel', record)
+    engine._exec_panel(runner, engine.cfg.symbols, runner.iter_parameters())
+    assert panels == [[SYMBOL, OTHER], [SYMBOL, OTHER]]
+    df = ResultStore(runner.get_result_file()).load()
+    assert sorted(zip(df['symbol'], df['label'])) == [
+        (SYMBOL, '2h_3x6'), (SYMBOL, '30m_3x6'), (OTHER, '2h_3x6'), (OTHER, '30m_3x6')
+    ]
+    assert len(pd.read_csv(tmp_path / 'failures.csv')) == 0
+
+    # All the panels are computed
+    engine._exec_panel(runner, engine.cfg.symbols, runner.iter_parameters())
+    assert len(panels) == 2
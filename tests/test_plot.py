@@ -0,0 +1,82 @@
+"""The box plots of the stored results"""
+
+import os
+from datetime import datetime, timezone
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.engine import BacktestEngine
+from backtest.plot import BoxPlot
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+TOKENS = [f'SYN{i:03d}USDT' for i in range(5)]
+PLOTS = ['Total Return [%]', 'Max Drawdown [%]', 'Win Rate [%]']
+
+
+@pytest.fixture
+def runner(klines, tmp_path):
+    """The runner of the computed results"""
+    for token in TOKENS:
+        klines(token, slice(0, 600), 600)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(TOKENS)}]
+""")
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    os.makedirs(tmp_path / 'bt_dir')
+    runner = DualSMAStrategy(str(tmp_path / 'bt_dir'), dict(intervals=['30m'],
+                                                            params=[[3, 6], [5, 10], [8, 16]],
+                                                            start=start, metrics=PLOTS, plots=PLOTS))
+    BacktestEngine(str(fp))._exec(runner, TOKENS, runner.iter_parameters())
+    return runner
+
+
+def expected_results(runner, symbols: list) -> pd.DataFrame:
+    df = ResultStore(runner.get_result_file()).load()
+    df = df[df['symbol'].isin(symbols)][['label'] + runner.get_metrics()]
+    df = df.replace([np.inf, -np.inf], np.nan).dropna()
+    return df[df['Total Closed Trades'] > 0]
+
+
+def test_read_results(runner):
+    df = BoxPlot(runner, symbols=TOKENS[:3]).read_results()
+    assert df.columns.tolist() == ['label'] + runner.get_metrics()
+    pd.testing.assert_frame_equal(df, expected_results(runner, TOKENS[:3]))
+
+
+def test_create_plots(runner, monkeypatch):
+    loads = list()
+    load = ResultStore.load
+
+    def record(self, *args, **kwargs):
+        loads.append(kwargs)
+        return load(self, *args, **kwargs)
+
+    monkeypatch.setattr(ResultStore, 'load', record)
+    figures = plt.get_fignums()
+    BoxPlot(runner, symbols=TOKENS, workers=2).create_plots()
+    monkeypatch.undo()
+
+    # The results are loaded once for all the metrics
+    assert len(loads) == 1
+    # No figure is left open
+    assert plt.get_fignums() == figures
+    work_dir = runner.get_work_dir()
+    for key in PLOTS:
+        with open(os.path.join(work_dir, f'{key}.png'), 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+    df = expected_results(runner, TOKENS)
+    summary = pd.read_csv(os.path.join(work_dir, 'boxplot_summary.csv'), index_col='Label')
+    assert summary['Metric'].unique().tolist() == PLOTS
+    for key in PLOTS:
+        expected = df[key].groupby(df['label']).describe()
+        pd.testing.assert_frame_equal(summary[summary['Metric'] == key].drop(columns='Metric'),
+                                      expected, check_names=False, check_dtype=False)
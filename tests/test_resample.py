@@ -0,0 +1,77 @@
+"""The compiled resampling against `pandas.resample` on synthetic klines"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.resample import AGGREGATIONS, align_start, resample_columns
+from backtest.synth import DEFAULT_START, synth_klines
+from backtest.utils import parse_interval
+
+
+def synth_columns(interval: str, bars: int) -> dict:
+    """The kline arrays with gaps, and the last bucket of most intervals partial"""
+    df = synth_klines('SYN000USDT', interval, DEFAULT_START, bars).drop(columns=['i'])
+    step = parse_interval(interval)
+    # A hole inside a bucket, and a day of klines missing which empties the shorter buckets
+    gaps = ((df['s'] - DEFAULT_START) // step).isin(
+        list(range(100, 103)) + list(range(500, 500 + 86400000 // step))
+    )
+    return {name: values.to_numpy() for name, values in df[~gaps].items()}
+
+
+def pandas_resample(columns: dict, interval: str) -> pd.DataFrame:
+    df = pd.DataFrame(columns, index=pd.to_datetime(columns['s'], unit='ms'))
+    if interval == '1w':
+        resampler = df.resample('W-MON', label='left', closed='left')
+    else:
+        resampler = df.resample(pd.Timedelta(parse_interval(interval), unit='ms'), origin='epoch')
+    counts = resampler['s'].count()
+    expected = resampler.agg(AGGREGATIONS)[counts > 0]
+    return expected.astype({name: columns[name].dtype for name in AGGREGATIONS})
+
+
+@pytest.mark.parametrize('base, interval, bars', [
+    ('1m', '15m', 5000),
+    ('30m', '2h', 2001),
+    ('30m', '8h', 2001),
+    ('30m', '1d', 2001),
+    ('30m', '3d', 2001),
+    ('30m', '1w', 2001),
+])
+def test_resample_columns(base, interval, bars):
+    columns = synth_columns(base, bars)
+    result = resample_columns(columns, interval)
+    expected = pandas_resample(columns, interval)
+
+    np.testing.assert_array_equal(result['s'], expected.index.asi8 // 1_000_000)
+    np.testing.assert_array_equal(result['e'], result['s'] + parse_interval(interval) - 1)
+    for name in AGGREGATIONS:
+        assert result[name].dtype == columns[name].dtype
+        np.testing.assert_allclose(result[name], expected[name].to_numpy(), rtol=1e-12, err_msg=name)
+
+
+def test_resample_partial_last_bucket():
+    columns = synth_columns('30m', 2001)
+    result = resample_columns(columns, '2h')
+    # The last 2h bucket has only its first 30m kline
+    assert result['s'][-1] == columns['s'][-1]
+    for name in AGGREGATIONS:
+        assert result[name][-1] == columns[name][-1]
+    assert result['e'][-1] > columns['e'][-1]
+
+
+def test_resample_empty():
+    columns = synth_columns('30m', 2001)
+    result = resample_columns({name: values[:0] for name, values in columns.items()}, '2h')
+    assert all(len(values) == 0 for values in result.values())
+
+
+@pytest.mark.parametrize('interval, st, expected', [
+    ('2h', DEFAULT_START + 90 * 60 * 1000, DEFAULT_START),
+    ('1d', DEFAULT_START + 1, DEFAULT_START),
+    # 2023-01-01 is a Sunday, the week starts on Monday 2022-12-26
+    ('1w', DEFAULT_START, DEFAULT_START - 6 * 86400000),
+])
+def test_align_start(interval, st, expected):
+    assert align_start(st, interval) == expected
@@ -0,0 +1,117 @@
+"""The parameter space, the successive halving and the Gaussian process search"""
+
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.engine import BacktestEngine
+from backtest.search import ParameterSpace, SuccessiveHalving, GaussianProcessSearch
+from backtest.strategy.rsi import RSIStrategy
+from backtest.synth import DEFAULT_START
+
+
+RANGES = dict(window=[5, 30], min_rsi=[10, 40], max_rsi=[60.0, 90.0])
+TOKENS = [f'SYN{i:03d}USDT' for i in range(9)]
+METRIC = 'Total Return [%]'
+
+
+def objective(window: int, min_rsi: int, max_rsi: float, **params) -> float:
+    return -abs(window - 20) - abs(min_rsi - 30) - abs(max_rsi - 70)
+
+
+class Evaluations:
+    """Score the parameter sets by `objective` on any tokens, and record the calls"""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.calls = list()
+
+    def __call__(self, param_list: list, tokens: list) -> pd.DataFrame:
+        self.calls.append(([self.runner.create_label(**params) for params in param_list], tokens))
+        return pd.DataFrame([
+            {'label': self.runner.create_label(**params), 'symbol': token, METRIC: objective(**params)}
+            for params in param_list for token in tokens
+        ])
+
+
+@pytest.fixture
+def runner(tmp_path):
+    return RSIStrategy(str(tmp_path), dict(intervals=['30m']))
+
+
+def test_parameter_space():
+    space = ParameterSpace(RANGES)
+    assert space.from_unit(np.array([0., 0.5, 1.])) == dict(window=5, min_rsi=25, max_rsi=90.0)
+    # The points out of the unit cube are clipped
+    assert space.from_unit(np.array([-1., 2., 0.5])) == dict(window=5, min_rsi=40, max_rsi=75.0)
+    params = dict(window=20, min_rsi=16, max_rsi=75.0)
+    assert space.from_unit(space.to_unit(params)) == params
+    assert isinstance(space.from_unit(np.zeros(3))['window'], int)
+
+
+def test_halving_promotes_the_best(runner):
+    search = SuccessiveHalving(runner, RANGES, eta=3, budget=13, metric=METRIC)
+    evaluate = Evaluations(runner)
+    df = search.run(evaluate, TOKENS)
+
+    # 8 candidates on 1 token, the best 2 on 3 tokens, the best one on all
+    assert [(len(labels), len(tokens)) for labels, tokens in evaluate.calls] == [(8, 1), (2, 3), (1, 9)]
+    scores = {p['label']: objective(**p) for p in search.points}
+    for (labels, _), (promoted, _) in zip(evaluate.calls, evaluate.calls[1:]):
+        ranked = sorted(labels, key=scores.get, reverse=True)
+        assert promoted == ranked[:len(promoted)]
+    # The tokens of a round are in the ones of the next round
+    assert set(evaluate.calls[0][1]) <= set(evaluate.calls[1][1]) <= set(TOKENS)
+    assert df.iloc[0]['label'] == max(evaluate.calls[0][0], key=scores.get)
+    assert df.iloc[0]['symbols'] == len(TOKENS) and len(df) == 8
+
+
+def test_halving_budget(runner):
+    search = SuccessiveHalving(runner, RANGES, eta=3, candidates=8, budget=5, metric=METRIC)
+    evaluate = Evaluations(runner)
+    search.run(evaluate, TOKENS)
+    # The candidates are cut to the budget, and nothing is left to promote
+    assert [len(labels) for labels, _ in evaluate.calls] == [5]
+    assert search.evaluations == 5
+
+
+def test_gaussian_process_search(runner):
+    search = GaussianProcessSearch(runner, RANGES, init_points=6, batch_size=3, budget=15,
+                                   samples=500, metric=METRIC, seed=1)
+    evaluate = Evaluations(runner)
+    df = search.run(evaluate, TOKENS)
+
+    assert [len(labels) for labels, _ in evaluate.calls] == [6, 3, 3, 3]
+    assert all(tokens == TOKENS for _, tokens in evaluate.calls)
+    labels = [label for labels, _ in evaluate.calls for label in labels]
+    assert len(set(labels)) == len(labels) == len(df) == 15
+    # The proposals improve on the random initial points
+    assert df['score'].max() >= max(objective(**p) for p in search.points[:6])
+    assert df.iloc[0]['score'] == df['score'].max()
+
+
+def test_search_exports_the_best_once(klines, tmp_path):
+    tokens = TOKENS[:4]
+    for token in tokens:
+        klines(token, slice(0, 400), 400)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(tokens)}]
+""")
+    engine = BacktestEngine(str(fp))
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    search = dict(method='halving', budget=6, eta=2, top=2, metric=METRIC,
+                  ranges=dict(window=[5, 30], min_rsi=[10, 40], max_rsi=[60, 90]))
+    runner = RSIStrategy(str(tmp_path), dict(intervals=['30m'], start=start, search=search,
+                                             output='rsi_{label}.csv'))
+    best = engine._exec_search(runner, tokens)
+
+    exported = sorted(fn for fn in os.listdir(tmp_path) if fn.startswith('rsi_'))
+    assert exported == sorted(f'rsi_{runner.create_label(**params)}.csv' for params in best)
+    # The winner is exported over all tokens
+    df = pd.read_csv(runner.get_output_file(**best[0]))
+    assert sorted(df['Token']) == tokens
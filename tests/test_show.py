@@ -0,0 +1,89 @@
+"""The portfolios shown from the saved ones of the engine"""
+
+import os
+from datetime import datetime, timezone
+
+import pytest
+import vectorbt as vbt
+
+from backtest.engine import BacktestEngine
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+TOKENS = [f'SYN{i:03d}USDT' for i in range(4)]
+
+
+class Figure:
+    """The figure of `pf.plot`, which records the shown titles"""
+
+    def __init__(self, shown: list):
+        self.shown = shown
+        self.title = None
+
+    def update_layout(self, title: dict, **kwargs):
+        self.title = title['text']
+
+    def show(self):
+        self.shown.append(self.title)
+
+
+@pytest.fixture
+def shown(monkeypatch):
+    titles = list()
+    monkeypatch.setattr(vbt.Portfolio, 'plot', lambda pf, **kwargs: Figure(titles))
+    return titles
+
+
+@pytest.fixture
+def computed(klines, tmp_path):
+    """The engine and the runner of the computed and saved portfolios"""
+    for token in TOKENS:
+        klines(token, slice(0, 400), 400)
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(TOKENS)}]
+""")
+    engine = BacktestEngine(str(fp))
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    os.makedirs(tmp_path / 'bt_dir')
+    runner = DualSMAStrategy(str(tmp_path / 'bt_dir'), dict(intervals=['30m'], params=[[3, 6], [5, 10]],
+                                                            start=start, save_portfolios=True))
+    engine._exec(runner, TOKENS, runner.iter_parameters())
+    return engine, runner
+
+
+@pytest.fixture
+def no_runs(monkeypatch):
+    def run(self, *args, **kwargs):
+        raise AssertionError('the backtest is run again')
+
+    monkeypatch.setattr(DualSMAStrategy, 'run', run)
+    monkeypatch.setattr(DualSMAStrategy, 'run_batch', run)
+
+
+def test_show_saved(computed, shown, no_runs):
+    engine, runner = computed
+    for params in runner.iter_parameters():
+        engine.show(runner, TOKENS, **params)
+    assert shown == [
+        f'DualSMAStrategy: {token}@{runner.create_label(**params)}'
+        for params in runner.iter_parameters() for token in TOKENS
+    ]
+
+
+@pytest.mark.parametrize('metric', ['Total Return [%]', 'Max Drawdown [%]'])
+def test_show_top(computed, shown, no_runs, metric):
+    engine, runner = computed
+    params = runner.iter_parameters()[1]
+    label = runner.create_label(**params)
+    df = ResultStore(runner.get_result_file()).load(labels=[label])
+    expected = df.sort_values(metric, ascending=False)['symbol'].head(2).tolist()
+    assert engine.top_tokens(runner, TOKENS, label, 2, metric) == expected
+    # The top tokens within the given ones
+    assert engine.top_tokens(runner, TOKENS[:1], label, 2, metric) == TOKENS[:1]
+
+    engine.show(runner, TOKENS, top=2, metric=metric, **params)
+    assert shown == [f'DualSMAStrategy: {token}@{label}' for token in expected]
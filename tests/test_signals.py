@@ -0,0 +1,95 @@
+"""The signal kernels and the batches against the `vbt.MA` and `vbt.RSI` runs"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+import vectorbt as vbt
+
+from backtest.strategy.rsi import RSIStrategy
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+SYMBOL = 'SYN000USDT'
+OTHER = 'SYN001USDT'
+BARS = 800
+
+
+def sma_signals(price, fast_n: int, slow_n: int, **params) -> tuple:
+    """The signals of a set of parameters before the kernel"""
+    fast_ma = vbt.MA.run(price, fast_n)
+    slow_ma = vbt.MA.run(price, slow_n)
+    return fast_ma.ma_crossed_above(slow_ma), fast_ma.ma_crossed_below(slow_ma)
+
+
+def rsi_signals(price, window: int, min_rsi: int, max_rsi: int, **params) -> tuple:
+    """The signals of a set of parameters before the kernel"""
+    rsi = vbt.RSI.run(price, window)
+    return rsi.rsi_below(min_rsi), rsi.rsi_above(max_rsi)
+
+
+STRATEGIES = [
+    pytest.param(DualSMAStrategy, dict(params=[[3, 6], [5, 10], [10, 20]]), sma_signals, id='sma'),
+    pytest.param(RSIStrategy, dict(windows=[10, 14], params=[[25, 75], [30, 70]]), rsi_signals,
+                 id='rsi'),
+]
+
+
+@pytest.fixture
+def runner_of(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    klines(OTHER, slice(100, BARS), BARS)
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+
+    def create(cls, cfg: dict, interval: str):
+        return cls(str(tmp_path), dict(cfg, intervals=[interval], start=start, init_cash=10000))
+
+    return create
+
+
+def expected_stats(runner, price, signals, **params) -> pd.Series:
+    entries, exits = signals(price, **params)
+    pf = vbt.Portfolio.from_signals(price, entries, exits, init_cash=runner.get('init_cash'))
+    return pf.stats()
+
+
+@pytest.mark.parametrize('interval', ['30m', '2h'])
+@pytest.mark.parametrize('cls, cfg, signals', STRATEGIES)
+def test_kernel_signals(runner_of, cls, cfg, signals, interval):
+    runner = runner_of(cls, cfg, interval)
+    price = runner.load_price(SYMBOL, interval)
+    for params in runner.iter_parameters():
+        entries, exits = runner.generate_signals(price, [params])
+        expected_entries, expected_exits = signals(price, **params)
+        np.testing.assert_array_equal(entries.to_numpy(), expected_entries.to_numpy())
+        np.testing.assert_array_equal(exits.to_numpy(), expected_exits.to_numpy())
+        pd.testing.assert_series_equal(runner.run(SYMBOL, **params).stats(),
+                                       expected_stats(runner, price, signals, **params),
+                                       check_names=False)
+
+
+@pytest.mark.parametrize('interval', ['30m', '2h'])
+@pytest.mark.parametrize('cls, cfg, signals', STRATEGIES)
+def test_batch_stats(runner_of, cls, cfg, signals, interval):
+    runner = runner_of(cls, cfg, interval)
+    price = runner.load_price(SYMBOL, interval)
+    param_list = runner.iter_parameters()
+    pf = runner.run_batch(SYMBOL, param_list)
+    for params in param_list:
+        pd.testing.assert_series_equal(pf.stats(column=runner.create_label(**params)),
+                                       expected_stats(runner, price, signals, **params),
+                                       check_names=False)
+
+
+@pytest.mark.parametrize('cls, cfg, signals', STRATEGIES)
+def test_panel_stats(runner_of, cls, cfg, signals):
+    runner = runner_of(cls, cfg, '30m')
+    params = runner.iter_parameters()[0]
+    pf = runner.run_panel([SYMBOL, OTHER], **params)
+    price = pf.close
+    for symbol in (SYMBOL, OTHER):
+        pd.testing.assert_series_equal(pf.stats(column=symbol),
+                                       expected_stats(runner, price[symbol], signals, **params),
+                                       check_names=False)
@@ -0,0 +1,35 @@
+"""The lazy imports of the engine and the warm-up of the strategies"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from backtest.strategy.rsi import RSIStrategy
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.warmup import warm_up_parameters, warm_up_runner
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_engine_lazy_imports():
+    code = ("import sys, backtest.engine; "
+            "print(','.join(m for m in ('vectorbt', 'numba', 'matplotlib') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == ''
+
+
+@pytest.mark.parametrize('runner, sampled', [
+    pytest.param(DualSMAStrategy('.', dict(intervals=['30m'], metrics=['Sharpe Ratio'])), 0,
+                 id='no-grid'),
+    pytest.param(RSIStrategy('.', dict(intervals=['30m'], search=dict(
+        ranges=dict(window=[5, 30], min_rsi=[10, 40], max_rsi=[60, 90]))
+    )), 2, id='search'),
+])
+def test_warm_up_runner_without_grid(runner, sampled):
+    assert runner.iter_parameters() == []
+    assert len(warm_up_parameters(runner)) == sampled
+    warm_up_runner(runner, bars=200)
@@ -0,0 +1,107 @@
+"""The results computed once by the store, and their exported CSV files"""
+
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest.engine import BacktestEngine
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+
+
+TOKENS = [f'SYN{i:03d}USDT' for i in range(3)]
+NAMES = ['Total Return [%]', 'Max Drawdown [%]', 'Total Trades']
+
+
+@pytest.fixture
+def runs(klines, monkeypatch):
+    """Record the (token, labels) of the backtests"""
+    for token in TOKENS:
+        klines(token, slice(0, 400), 400)
+    calls = list()
+    run_batch = DualSMAStrategy.run_batch
+
+    def record(self, symbol: str, param_list: list):
+        calls.append((symbol, [self.create_label(**params) for params in param_list]))
+        return run_batch(self, symbol, param_list)
+
+    monkeypatch.setattr(DualSMAStrategy, 'run_batch', record)
+    return calls
+
+
+def write_config(tmp_path, params: list, **options) -> str:
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    extra = ''.join(f'    {key}: {value},\n' for key, value in options.items())
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(TOKENS)}]
+- strategies:
+  - strategy: {{
+    name: DualSMAStrategy,
+    module: backtest.strategy.sma,
+    intervals: ['30m'],
+    params: {params},
+    start: '{start.isoformat()}',
+    work_dir: '{tmp_path / 'bt_dir'}',
+    output: 'sma_{{label}}.csv',
+{extra}  }}
+""")
+    return str(fp)
+
+
+def test_skip_computed(runs, tmp_path):
+    BacktestEngine(write_config(tmp_path, [[3, 6]])).exec()
+    assert sorted(runs) == [(token, ['30m_3x6']) for token in TOKENS]
+
+    # Only the label of the new parameters is run
+    runs.clear()
+    BacktestEngine(write_config(tmp_path, [[3, 6], [5, 10]])).exec()
+    assert sorted(runs) == [(token, ['30m_5x10']) for token in TOKENS]
+    runs.clear()
+    BacktestEngine(write_config(tmp_path, [[3, 6], [5, 10]])).exec()
+    assert runs == []
+
+    df = ResultStore(str(tmp_path / 'bt_dir' / 'results.db')).load()
+    assert sorted(zip(df['symbol'], df['label'])) == sorted(
+        (token, label) for token in TOKENS for label in ['30m_3x6', '30m_5x10']
+    )
+    # Both labels are exported, the first one from the stored results
+    for label in ['30m_3x6', '30m_5x10']:
+        assert sorted(pd.read_csv(tmp_path / 'bt_dir' / f'sma_{label}.csv')['Token']) == TOKENS
+
+
+def test_force(runs, tmp_path):
+    fp = write_config(tmp_path, [[3, 6], [5, 10]])
+    BacktestEngine(fp).exec()
+    runs.clear()
+    BacktestEngine(fp, force=True).exec()
+    assert sorted(runs) == [(token, ['30m_3x6', '30m_5x10']) for token in TOKENS]
+    # The results are replaced, not added
+    df = ResultStore(str(tmp_path / 'bt_dir' / 'results.db')).load()
+    assert len(df) == len(TOKENS) * 2
+
+
+def test_export_csv(runs, tmp_path):
+    BacktestEngine(write_config(tmp_path, [[3, 6]])).exec()
+    store = ResultStore(str(tmp_path / 'bt_dir' / 'results.db'))
+    df = store.load(labels=['30m_3x6'])
+    fp = str(tmp_path / 'export.csv')
+    store.export_csv(df, fp, symbols=TOKENS[:2], names=NAMES)
+
+    exported = pd.read_csv(fp)
+    assert exported.columns.tolist() == ['Token'] + NAMES
+    assert sorted(exported['Token']) == TOKENS[:2]
+    # Sorted by the total return
+    assert exported['Total Return [%]'].is_monotonic_decreasing
+    expected = df.set_index('symbol').loc[exported['Token'], 'Total Return [%]']
+    assert exported['Total Return [%]'].tolist() == pytest.approx(expected.tolist())
+
+
+def test_export_csv_disabled(runs, tmp_path):
+    BacktestEngine(write_config(tmp_path, [[3, 6]], export_csv='false')).exec()
+    assert not os.path.exists(tmp_path / 'bt_dir' / 'sma_30m_3x6.csv')
+    assert len(ResultStore(str(tmp_path / 'bt_dir' / 'results.db')).load()) == len(TOKENS)
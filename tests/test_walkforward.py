@@ -0,0 +1,73 @@
+"""The folds, the selection and the out of sample stats of the walk-forward"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest.metrics import compute_stats
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+from backtest.walkforward import WalkForward, walk_forward_token
+
+
+SYMBOL = 'SYN000USDT'
+BARS = 800
+METRIC = 'Total Return [%]'
+
+
+def test_split_rolling_and_anchored():
+    # 98 hours, the last test window is partial
+    index = pd.date_range('2023-01-01', periods=98, freq='h', tz='UTC')
+    expected = [(s, s + 10, min(s + 15, 98)) for s in range(0, 90, 5)]
+    assert WalkForward('10h', '5h').split(index) == expected
+    assert expected[-1] == (85, 95, 98)
+    assert WalkForward('10h', '5h', anchored=True).split(index) == [
+        (0, i1, i2) for _, i1, i2 in expected
+    ]
+    assert WalkForward('10h', '5h', step='10h').split(index) == expected[::2]
+    assert WalkForward('100h', '5h').split(index) == []
+
+
+def test_select():
+    values = pd.Series({'a': 1., 'b': np.inf, 'c': 3., 'd': np.nan})
+    assert WalkForward('10h', '5h').select(values) == 'c'
+    assert WalkForward('10h', '5h', minimize=True).select(values) == 'a'
+    assert WalkForward('10h', '5h').select(pd.Series({'a': np.nan})) is None
+
+
+def test_walk_forward_token(klines, tmp_path):
+    klines(SYMBOL, slice(0, BARS), BARS)
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    runner = DualSMAStrategy(str(tmp_path), dict(
+        intervals=['30m'], params=[[3, 6], [5, 10], [10, 20]], start=start, init_cash=10000,
+        walk_forward=dict(train='5d', test='2d', metric=METRIC)
+    ))
+    param_list = runner.iter_parameters()
+    token, rows, errors, _ = walk_forward_token(runner, SYMBOL, param_list)
+    assert token == SYMBOL and errors == {}
+
+    price = runner.load_price(SYMBOL, '30m')
+    folds = WalkForward('5d', '2d').split(price.index)
+    assert [row['Fold'] for row in rows] == list(range(len(folds))) and len(rows) > 1
+    signals = {
+        runner.create_label(**params): runner.generate_signals(price, [params]) for params in param_list
+    }
+    for row, (i0, i1, i2) in zip(rows, folds):
+        assert (row['Train Start'], row['Test Start'], row['Test End']) == (
+            price.index[i0], price.index[i1], price.index[i2 - 1]
+        )
+        # The best label on the train slice
+        train = {
+            label: compute_stats(runner.simulate(price.iloc[i0:i1], entries.iloc[i0:i1],
+                                                 exits.iloc[i0:i1]), [METRIC]).iloc[0][METRIC]
+            for label, (entries, exits) in signals.items()
+        }
+        assert row['Label'] == max(train, key=train.get)
+        assert row[f'Train {METRIC}'] == pytest.approx(train[row['Label']], rel=1e-12)
+        # The out of sample stats of a direct simulation of the test window
+        entries, exits = signals[row['Label']]
+        expected = runner.simulate(price.iloc[i1:i2], entries.iloc[i1:i2], exits.iloc[i1:i2]).stats()
+        pd.testing.assert_series_equal(pd.Series({name: row[name] for name in expected.index}),
+                                       expected, check_names=False, check_dtype=False)
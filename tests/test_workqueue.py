@@ -0,0 +1,118 @@
+"""The leases, the retries and the expiry of the work queue"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from backtest.engine import BacktestEngine
+from backtest.store import ResultStore
+from backtest.strategy.sma import DualSMAStrategy
+from backtest.synth import DEFAULT_START
+from backtest.workqueue import WorkQueue, work, DONE, FAILED, PENDING, RUNNING
+
+
+# The seconds of a lease, and of a wait until it is expired
+LEASE = 0.2
+EXPIRED = 0.3
+
+SHARD = [('BTCUSDT', [dict(interval='30m')], {'30m': 'key'})]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.db'))
+
+
+def submit(queue: WorkQueue, max_attempts: int = 3) -> int:
+    return queue.submit('runner', [SHARD], dict(), lease=LEASE, max_attempts=max_attempts)
+
+
+def test_expired_lease_claimed_by_another_owner(queue):
+    job = submit(queue)
+    unit = queue.claim('a')
+    assert unit['payload'] == SHARD and unit['attempts'] == 1
+    assert queue.claim('b') is None
+    assert queue.heartbeat(unit['id'], 'a')
+
+    time.sleep(EXPIRED)
+    retry = queue.claim('b')
+    assert retry['id'] == unit['id'] and retry['attempts'] == 2
+    # The lost lease neither renews nor completes
+    assert not queue.heartbeat(unit['id'], 'a')
+    assert not queue.complete(unit['id'], 'a', ['stale'])
+    assert queue.complete(unit['id'], 'b', ['fresh'])
+
+    assert queue.collect(job) == [(DONE, SHARD, ['fresh'], None)]
+    assert queue.collect(job) == []
+
+
+def test_expired_lease_fails_after_max_attempts(queue):
+    job = submit(queue, max_attempts=2)
+    queue.claim('a')
+    time.sleep(EXPIRED)
+    assert queue.claim('b')['attempts'] == 2
+    time.sleep(EXPIRED)
+    assert queue.claim('a') is None
+    assert queue.collect(job) == [(FAILED, SHARD, None, 'lease expired')]
+
+
+def test_failed_unit_retried_until_max_attempts(queue):
+    job = submit(queue, max_attempts=2)
+    unit = queue.claim('a')
+    queue.fail(unit['id'], 'a', 'RuntimeError: boom')
+    assert queue.progress(job) == {PENDING: 1}
+    unit = queue.claim('b')
+    queue.fail(unit['id'], 'b', 'RuntimeError: boom')
+    assert queue.claim('a') is None
+    assert queue.collect(job) == [(FAILED, SHARD, None, 'RuntimeError: boom')]
+
+
+def test_expire_without_claim(queue):
+    # The coordinator of `work: false` expires the units while it waits
+    job = submit(queue, max_attempts=1)
+    other = submit(queue, max_attempts=1)
+    queue.claim('a', job=job)
+    queue.claim('a', job=other)
+    assert queue.expire(job) == 0
+    time.sleep(EXPIRED)
+    assert queue.expire(job) == 1
+    assert queue.progress(job) == {FAILED: 1}
+    assert queue.progress(other) == {RUNNING: 1}
+
+
+def test_work_merges_the_results_of_a_job(klines, tmp_path):
+    tokens = [f'SYN{i:03d}USDT' for i in range(3)]
+    for token in tokens:
+        klines(token, slice(0, 400), 400)
+    path = str(tmp_path / 'queue.db')
+    fp = tmp_path / 'engine.yaml'
+    fp.write_text(f"""
+- symbols:
+    - names: [{', '.join(tokens)}]
+- queue: {{path: {path}, shard_size: 2, poll: 0.05, work: false}}
+""")
+    engine = BacktestEngine(str(fp))
+    start = datetime.fromtimestamp(DEFAULT_START / 1000, tz=timezone.utc)
+    runner = DualSMAStrategy(str(tmp_path), dict(intervals=['30m'], params=[[3, 6], [5, 10]],
+                                                 start=start, output='sma_{label}.csv'))
+    param_list = runner.iter_parameters()
+    queue = WorkQueue(path)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # The coordinator does not work, so the units wait for the worker
+        future = executor.submit(engine._exec, runner, tokens, param_list)
+        while not queue.progress(1) and not future.done():
+            time.sleep(0.05)
+        assert work(path, idle_exit=0, poll=0.05) == 2
+        future.result(timeout=60)
+
+    df = ResultStore(runner.get_result_file()).load()
+    labels = [runner.create_label(**params) for params in param_list]
+    assert sorted(zip(df['symbol'], df['label'])) == sorted(
+        (token, label) for token in tokens for label in labels
+    )
+    assert len(pd.read_csv(tmp_path / 'failures.csv')) == 0
+    # The job is removed once merged
+    assert queue.progress(1) == {}